@@ -12,6 +12,8 @@ def parse_args():
     parser.add_argument("-c", "--count", type=int, help="The target selection count, must be an integer greater than 0")
     parser.add_argument("-d", "--display", action="store_true", help="Display the count of images in each bucket")
     parser.add_argument("-r", "--reverse", action="store_true", help="Display in reverse order, only for displaying")
+    parser.add_argument("-a", "--tag-ids", action="store_true", help=f"If set, will read the tags from the tag ID arrays in \"{TAG_IDS_DIR}\" made by make_tag_ids.py, images missing from them are read from their metadata")
+    utils.add_profile_args(parser)
     args = parser.parse_args()
     if not args.display:
         if args.reverse:
@@ -26,12 +28,28 @@ def parse_args():
     elif isinstance(args.count, int):
         print("You can't specify the target selection count when using display mode!")
         sys.exit(1)
+    if args.tag_ids:
+        try:
+            import numpy
+        except ImportError:
+            print("You need to pip install numpy to use tag ID arrays!")
+            sys.exit(1)
     return args
 
 def main():
     args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
     print("Starting...\nGetting model tags...")
-    model_tags = utils.get_model_tags(MODEL_TAGS_PATH)
+    vocabulary = utils.load_tag_vocabulary(MODEL_TAGS_PATH)
+    tag_id_arrays = None
+    if args.tag_ids:
+        tag_id_arrays = utils.load_tag_id_arrays(TAG_IDS_DIR, vocabulary)
+        if tag_id_arrays is None:
+            print(f"No tag ID arrays made with the current model tags found in \"{TAG_IDS_DIR}\", please run make_tag_ids.py first!")
+            sys.exit(1)
+    # Every image is looked up by tag without the tag ID arrays, so it's worth decoding the whole vocabulary into a dict,
+    # with them only the few images missing from the arrays are, which binary search the mmap'd vocabulary instead.
+    get_tag_id = vocabulary.get_tag_id_dict().get if tag_id_arrays is None else vocabulary.get_id
     print("Getting paths...")
     image_id_image_metadata_path_tuple_tuple_list = sorted(utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR).items(), key=lambda x: x[0])
     print("Got", len(image_id_image_metadata_path_tuple_tuple_list), "images.\nShuffling paths...")
@@ -39,30 +57,35 @@ def main():
     random.shuffle(image_id_image_metadata_path_tuple_tuple_list)
     print("Making buckets...")
     in_bucket_image_count = 0
-    buckets = {tag: [] for tag in model_tags}
+    buckets = [[] for _ in range(len(vocabulary))] # Index: Tag ID.
+    tag_filter = utils.TagFilter()
     for image_id_image_metadata_path_tuple_tuple in tqdm.tqdm(image_id_image_metadata_path_tuple_tuple_list, desc="Making buckets"):
         did_append = False
-        for tag in utils.get_tags(image_id_image_metadata_path_tuple_tuple[1][1]):
-            bucket = buckets.get(tag)
-            if bucket is None:
+        tag_ids = tag_id_arrays.get_tag_ids(image_id_image_metadata_path_tuple_tuple[0]) if tag_id_arrays is not None else None
+        if tag_ids is not None:
+            tag_ids = tag_ids.tolist()
+        else:
+            tag_ids = [get_tag_id(tag) for tag in tag_filter.get_tags(image_id_image_metadata_path_tuple_tuple[1][1])]
+        for tag_id in tag_ids:
+            if tag_id is None:
                 continue
-            bucket.append(image_id_image_metadata_path_tuple_tuple)
+            buckets[tag_id].append(image_id_image_metadata_path_tuple_tuple)
             did_append = True
         if did_append:
             in_bucket_image_count += 1
     print("Got", in_bucket_image_count, "unique images in buckets.")
-    buckets = sorted(buckets.items(), key=lambda x: len(x[1]))
+    buckets = sorted(enumerate(buckets), key=lambda x: len(x[1]))
     if args.display:
         if args.reverse: range_iter = range(len(buckets) - 1, -1, -1)
         else: range_iter = range(len(buckets))
-        for i in range_iter: print(buckets[i][0], len(buckets[i][1]))
+        for i in range_iter: print(vocabulary.get_tag(buckets[i][0]), len(buckets[i][1]))
         return
     print("Selecting...")
     total = min(args.count, in_bucket_image_count)
     selected = {} # Key: Image ID, Value: (Image path, Metadata path).
     with tqdm.tqdm(total=total, desc="Selecting") as progress_bar:
         while len(selected) < total:
-            for tag, image_id_image_metadata_path_tuple_tuple_list in buckets:
+            for _, image_id_image_metadata_path_tuple_tuple_list in buckets:
                 if len(selected) >= total:
                     break
                 if len(image_id_image_metadata_path_tuple_tuple_list) <= 0:
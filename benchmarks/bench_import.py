@@ -0,0 +1,87 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Checks the import time of every entry point with python -X importtime, run from the repository root:
+# python -m benchmarks.bench_import
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NETWORK_MODULES = ("aiohttp", "bs4", "PIL")
+OFFLINE_MODULES = ("aiohttp", "bs4", "PIL", "numpy")
+# Entry point: (Budget in milliseconds, Heavy modules it must not import before its main runs).
+IMPORT_BUDGETS = {
+    "convert": (150, OFFLINE_MODULES),
+    "compress": (60, OFFLINE_MODULES),
+    "decompress": (60, OFFLINE_MODULES),
+    "make_model_tags": (150, OFFLINE_MODULES),
+    "balance_tags": (150, OFFLINE_MODULES),
+    "make_tag_ids": (150, OFFLINE_MODULES),
+    "make_bucket_index": (60, OFFLINE_MODULES),
+    "make_tag_index": (150, OFFLINE_MODULES),
+    "query_tags": (60, OFFLINE_MODULES),
+    "transcode": (150, OFFLINE_MODULES),
+    "merge_shards": (60, OFFLINE_MODULES),
+    "make_work_queue": (150, NETWORK_MODULES),
+    "scrape_gel": (150, NETWORK_MODULES),
+    "scrape_yan": (150, NETWORK_MODULES),
+    "nl_llm_tag": (500, ("PIL", "numpy")),
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the import time of the entry points and check it against their budgets.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Times to import each entry point, the fastest is reported, default to 5")
+    parser.add_argument("-e", "--entry-points", nargs="+", choices=sorted(IMPORT_BUDGETS), help="Only check these entry points, default to all")
+    parser.add_argument("-t", "--top", type=int, default=3, help="Amount of the slowest direct imports to show for each entry point, default to 3")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        print("Repeat must be positive!")
+        sys.exit(1)
+    return args
+
+def measure_import(module):
+    # Returns (Cumulative microseconds of the module, List of (Cumulative microseconds, Depth, Imported module name)).
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if not parts[1].strip().isdigit():
+            continue # The header line.
+        name = parts[2].rstrip()
+        imports.append((int(parts[1]), (len(name) - len(name.lstrip()) - 1) // 2, name.strip()))
+    module_time = max((cumulative for cumulative, depth, name in imports if depth == 0 and name == module), default=0)
+    return module_time, imports
+
+def main():
+    args = parse_args()
+    failed = False
+    for module in args.entry_points or IMPORT_BUDGETS:
+        budget, forbidden_modules = IMPORT_BUDGETS[module]
+        measure_import(module) # Warm up so compiling bytecode isn't measured.
+        measurements = [measure_import(module) for _ in range(args.repeat)]
+        module_time, imports = min(measurements, key=lambda x: x[0])
+        imported_names = {name for _, _, name in imports}
+        forbidden_imported = [name for name in forbidden_modules if name in imported_names]
+        slowest_children = sorted((i for i in imports if i[1] == 1), reverse=True)[:args.top]
+        over_budget = module_time / 1000 > budget
+        failed = failed or over_budget or bool(forbidden_imported)
+        status = "OVER BUDGET" if over_budget else "ok"
+        if forbidden_imported:
+            status += f", imports {', '.join(forbidden_imported)} eagerly"
+        print(
+            f"{module}: {module_time / 1000:.1f}ms / {budget}ms budget, {status},",
+            "slowest imports:", ", ".join(f"{name} {cumulative / 1000:.1f}ms" for cumulative, _, name in slowest_children) or "none",
+        )
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -0,0 +1,78 @@
+import sys
+import json
+import time
+import random
+import argparse
+import utils
+from benchmarks.bench_tools import get_tag_vocabulary, make_metadata
+
+# Compares the metadata parse and serialize throughput of the available JSON backends, run from the repository root:
+# python -m benchmarks.bench_json -n 100000
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the JSON backends on synthetic image metadata.")
+    parser.add_argument("-n", "--metadata-count", type=int, default=20000, help="Amount of synthetic metadata, default to 20000")
+    parser.add_argument("-d", "--nl-desc-rate", type=float, default=0.5, help="Fraction of metadata with a natural language description, default to 0.5")
+    parser.add_argument("-s", "--seed", type=int, default=42, help="Random seed for the synthetic metadata, default to 42")
+    args = parser.parse_args()
+    if args.metadata_count < 1:
+        print("Metadata count must be positive!")
+        sys.exit(1)
+    if not 0 <= args.nl_desc_rate <= 1:
+        print("Natural language description rate must be between 0 and 1!")
+        sys.exit(1)
+    return args
+
+def make_metadata_list(args):
+    rng = random.Random(args.seed)
+    vocabulary = get_tag_vocabulary()
+    metadata_list = []
+    for image_id in range(1, args.metadata_count + 1):
+        metadata = make_metadata(rng, vocabulary, image_id)
+        if rng.random() < args.nl_desc_rate:
+            # Non ASCII and escaped characters so the byte identical check covers them.
+            metadata["nl_desc"] = " ".join(rng.choices(vocabulary, k=rng.randint(50, 150))).replace("_", " ") + " \"引用\" — fin.\n"
+        metadata_list.append(metadata)
+    return metadata_list
+
+def time_it(function, items):
+    start_time = time.perf_counter()
+    for item in items:
+        function(item)
+    return time.perf_counter() - start_time
+
+def main():
+    args = parse_args()
+    print(f"Generating {args.metadata_count} synthetic metadata...")
+    metadata_list = make_metadata_list(args)
+    expected_texts = [json.dumps(metadata, ensure_ascii=False, separators=(",", ":")) for metadata in metadata_list]
+    expected_bytes = [text.encode("utf8") for text in expected_texts]
+    total_mib = sum(len(data) for data in expected_bytes) / 1024 / 1024
+    default_backend = utils.get_json_backend()
+    mismatch_count = 0
+    try:
+        for backend in utils.get_available_json_backends():
+            utils.set_json_backend(backend)
+            mismatches = sum(utils.dumps_json(metadata) != text for metadata, text in zip(metadata_list, expected_texts))
+            mismatches += sum(utils.dumps_metadata(utils.Metadata.from_dict(utils.loads_json(data))) != text for data, text in zip(expected_bytes, expected_texts))
+            mismatch_count += mismatches
+            serialize_time = time_it(utils.dumps_json, metadata_list)
+            parse_time = time_it(utils.loads_json, expected_bytes)
+            struct_time = time_it(lambda data: utils.Metadata.from_dict(utils.loads_json(data)), expected_bytes)
+            print(
+                f"{backend}: serialize {total_mib / serialize_time:.1f}MiB/s ({args.metadata_count / serialize_time:.0f}/s),",
+                f"parse {total_mib / parse_time:.1f}MiB/s ({args.metadata_count / parse_time:.0f}/s),",
+                f"parse into struct {args.metadata_count / struct_time:.0f}/s, {mismatches} outputs not byte identical to the standard library",
+            )
+    finally:
+        utils.set_json_backend(default_backend)
+    if mismatch_count > 0:
+        print("Some backends aren't byte identical to the standard library!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
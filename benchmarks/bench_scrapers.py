@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import importlib
+import subprocess
+import utils
+from constants import IMAGE_DIR
+
+# Drives the real scraper entry points against benchmarks/fake_booru.py, run from the repository root:
+# python -m benchmarks.bench_scrapers gel -n 1000
+
+SCRAPER_MODULES = {"gel": "scrape_gel", "yan": "scrape_yan"}
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark a scraper end to end against a local stand-in booru.")
+    parser.add_argument("scraper", choices=sorted(SCRAPER_MODULES), help="Which scraper to benchmark")
+    parser.add_argument("-n", "--image-count", type=int, default=1000, help="Amount of images to scrape, default to 1000")
+    parser.add_argument("-l", "--latency", type=float, default=0.05, help="Mean seconds of latency of the stand-in server, default to 0.05")
+    parser.add_argument("-e", "--error-rate", type=float, default=0.0, help="Fraction of stand-in server responses that are errors, default to 0")
+    parser.add_argument("-r", "--truncate-rate", type=float, default=0.0, help="Fraction of stand-in server image responses cut off halfway through, default to 0")
+    parser.add_argument("-R", "--redirect-rate", type=float, default=0.0, help="Fraction of stand-in server responses that redirect back to the same URL first, default to 0")
+    parser.add_argument("-s", "--image-size", type=int, default=512, help="Width and height of the synthetic images, default to 512")
+    parser.add_argument("-p", "--port", type=int, default=0, help="Port for the stand-in server, default to a free port")
+    parser.add_argument("-o", "--output", help="Append the result as a JSON line to this file")
+    parser.add_argument("-x", "--scraper-args", default="", help="Extra arguments passed to the scraper as one string, e.g. \"-W 256 -H 256 -a\"")
+    args = parser.parse_args()
+    args.scraper_args = shlex.split(args.scraper_args)
+    if args.image_count < 1:
+        print("Image count must be positive!")
+        sys.exit(1)
+    return args
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(args, port):
+    server = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_booru", "-p", str(port), "-n", str(args.image_count * 2),
+        "-l", str(args.latency), "-e", str(args.error_rate), "-r", str(args.truncate_rate), "-R", str(args.redirect_rate), "-s", str(args.image_size), "-t", os.path.join(REPO_DIR, "model_tags.txt"),
+    ], cwd=REPO_DIR, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The stand-in server exited before it was ready!")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("The stand-in server didn't start in time!")
+
+async def monitor_event_loop_lag(histogram, interval=0.01):
+    while True:
+        start_time = time.perf_counter()
+        await asyncio.sleep(interval)
+        histogram.add(max(time.perf_counter() - start_time - interval, 0))
+
+async def run_scraper(main_coroutine, lag_histogram):
+    monitor_task = asyncio.create_task(monitor_event_loop_lag(lag_histogram))
+    try:
+        await main_coroutine
+    finally:
+        monitor_task.cancel()
+
+def main():
+    args = parse_args()
+    if args.output is not None:
+        args.output = os.path.abspath(args.output)
+    port = args.port or get_free_port()
+    print(f"Starting the stand-in booru on port {port}...")
+    server = start_server(args, port)
+    try:
+        scraper = importlib.import_module(SCRAPER_MODULES[args.scraper])
+        with tempfile.TemporaryDirectory(prefix="aisp_bench_") as work_dir:
+            os.chdir(work_dir)
+            sys.argv = [scraper.__name__ + ".py", "-s", f"http://127.0.0.1:{port}", "-m", str(args.image_count), *args.scraper_args]
+            lag_histogram = utils.Histogram()
+            start_usage = resource.getrusage(resource.RUSAGE_SELF)
+            start_time = time.perf_counter()
+            asyncio.run(run_scraper(scraper.main(), lag_histogram))
+            used_time = time.perf_counter() - start_time
+            end_usage = resource.getrusage(resource.RUSAGE_SELF)
+            image_count = len(utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR))
+    finally:
+        os.chdir(REPO_DIR)
+        server.terminate()
+        server.wait()
+    cpu_time = end_usage.ru_utime - start_usage.ru_utime + end_usage.ru_stime - start_usage.ru_stime
+    result = {
+        "time": time.time(), "scraper": args.scraper, "scraper_args": args.scraper_args, "latency": args.latency, "error_rate": args.error_rate, "truncate_rate": args.truncate_rate, "redirect_rate": args.redirect_rate, "image_size": args.image_size,
+        "images": image_count, "seconds": used_time, "images_per_second": image_count / used_time, "cpu_ms_per_image": cpu_time * 1000 / max(image_count, 1),
+        "peak_rss_mib": end_usage.ru_maxrss / 1024, "event_loop_lag": lag_histogram.to_dict(),
+    }
+    print(
+        f"Scraped {image_count} images in {used_time:.2f}s: {result['images_per_second']:.1f} images/s, {result['cpu_ms_per_image']:.2f}ms CPU/image,",
+        f"peak RSS {result['peak_rss_mib']:.1f}MiB, event loop lag p50/p95/max {lag_histogram.get_text()}",
+    )
+    if args.output is not None:
+        with open(args.output, "a", encoding="utf8") as output_file:
+            output_file.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import functools
+import tempfile
+import statistics
+import contextlib
+import utils
+import convert
+import compress
+import decompress
+import balance_tags
+import make_model_tags
+from constants import *
+
+# Times the main path of the offline dataset tools on a synthetic IMAGE_DIR, run from the repository root:
+# python -m benchmarks.bench_tools -n 100000 --save-baseline
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE_PATH = os.path.join(REPO_DIR, "benchmarks", "baselines", "bench_tools.json")
+# Smallest valid PNG, the tools only move image files around so their content doesn't matter.
+PLACEHOLDER_IMAGE = bytes.fromhex("89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082")
+RATINGS = ("general", "sensitive", "questionable", "explicit")
+SIDE_TAG_WEIGHTS = [1 / (i + 1) for i in range(2000)]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the offline dataset tools on a synthetic dataset.")
+    parser.add_argument("-n", "--image-count", type=int, default=10000, help="Amount of synthetic images, default to 10000")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Times to run each benchmark, the median is reported, default to 3")
+    parser.add_argument("-b", "--benchmarks", nargs="+", help="Only run the benchmarks with these names, default to all")
+    parser.add_argument("-s", "--seed", type=int, default=42, help="Random seed for the synthetic dataset, default to 42")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help=f"Baseline results file to compare with or save to, default to \"{DEFAULT_BASELINE_PATH}\"")
+    parser.add_argument("--save-baseline", action="store_true", help="If set, will save the results as the new baseline")
+    args = parser.parse_args()
+    if args.image_count < 1 or args.repeat < 1:
+        print("Image count and repeat must be positive!")
+        sys.exit(1)
+    return args
+
+def get_tag_vocabulary():
+    return [tag for tag in utils.get_model_tags(os.path.join(REPO_DIR, MODEL_TAGS_PATH)) if not tag.startswith("rating:")]
+
+def make_metadata(rng, vocabulary, image_id):
+    # Zipf-like weights so a few tags are very common and most are rare, like on real boorus.
+    type_tags_dict = {}
+    for tag_type in ("artist", "character", "copyright"):
+        if rng.random() < 0.8:
+            type_tags_dict[tag_type] = list(dict.fromkeys(f"{tag_type}_{i}" for i in rng.choices(range(2000), SIDE_TAG_WEIGHTS, k=rng.randint(1, 2))))
+    type_tags_dict["general"] = list(dict.fromkeys(rng.choices(vocabulary, get_tag_weights(len(vocabulary)), k=rng.randint(10, 60))))
+    type_tags_dict["metadata"] = rng.sample(("highres", "absurdres", "commentary", "translated"), rng.randint(0, 2))
+    return {"image_id": str(image_id), "score": int(rng.paretovariate(1.2)) - 1, "rating": rng.choice(RATINGS), "tags": type_tags_dict}
+
+@functools.cache
+def get_tag_weights(tag_count):
+    return [1 / (i + 1) for i in range(tag_count)]
+
+def generate_dataset(image_dir, image_count, seed):
+    rng = random.Random(seed)
+    vocabulary = get_tag_vocabulary()
+    os.makedirs(image_dir, exist_ok=True)
+    for image_id in range(1, image_count + 1):
+        metadata = make_metadata(rng, vocabulary, image_id)
+        with open(os.path.join(image_dir, f"{image_id}.png"), "wb") as image_file:
+            image_file.write(PLACEHOLDER_IMAGE)
+        with open(os.path.join(image_dir, f"{image_id}.json"), "w", encoding="utf8") as metadata_file:
+            metadata_file.write(utils.dumps_metadata(metadata))
+
+def run_main(module, argv):
+    sys.argv = [module.__name__ + ".py", *argv]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        module.main()
+
+def bench_get_paths(args):
+    utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR)
+
+def bench_get_tags(args):
+    for _, metadata_path in utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR).values():
+        utils.get_tags(metadata_path)
+
+def bench_convert(args):
+    run_main(convert, ["-n"])
+
+def bench_make_model_tags(args):
+    run_main(make_model_tags, [])
+
+def bench_balance_tags(args):
+    run_main(balance_tags, ["-c", str(args.image_count // 2)])
+
+def bench_compress(args):
+    run_main(compress, ["-o", COMPRESSED_DIR, "-n", "1000"])
+
+def bench_decompress(args):
+    run_main(decompress, ["-i", COMPRESSED_DIR, "-o", "extracted"])
+
+def prepare_copy(dataset_dir, work_dir):
+    shutil.copytree(dataset_dir, os.path.join(work_dir, IMAGE_DIR))
+    shutil.copy(os.path.join(dataset_dir, os.pardir, MODEL_TAGS_PATH), os.path.join(work_dir, MODEL_TAGS_PATH))
+
+def prepare_compressed(dataset_dir, work_dir):
+    prepare_copy(dataset_dir, work_dir)
+    os.chdir(work_dir)
+    run_main(compress, ["-o", COMPRESSED_DIR, "-n", "1000"])
+
+# Name: (Benchmark function, Setup function which fills a fresh work directory), setup time isn't counted.
+BENCHMARKS = {
+    "get_image_id_image_metadata_path_tuple_dict": (bench_get_paths, prepare_copy),
+    "get_tags": (bench_get_tags, prepare_copy),
+    "convert": (bench_convert, prepare_copy),
+    "make_model_tags": (bench_make_model_tags, prepare_copy),
+    "balance_tags": (bench_balance_tags, prepare_copy),
+    "compress": (bench_compress, prepare_copy),
+    "decompress": (bench_decompress, prepare_compressed),
+}
+
+def main():
+    args = parse_args()
+    benchmark_names = args.benchmarks or list(BENCHMARKS)
+    for name in benchmark_names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark \"{name}\", available benchmarks: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="aisp_bench_") as temp_dir:
+        print(f"Generating a synthetic dataset with {args.image_count} images...")
+        dataset_dir = os.path.join(temp_dir, "dataset", IMAGE_DIR)
+        generate_dataset(dataset_dir, args.image_count, args.seed)
+        os.chdir(os.path.dirname(dataset_dir))
+        run_main(make_model_tags, []) # Balancing needs model tags made from this dataset.
+        try:
+            for name in benchmark_names:
+                bench_function, setup_function = BENCHMARKS[name]
+                times = []
+                for i in range(args.repeat):
+                    work_dir = os.path.join(temp_dir, f"{name}_{i}")
+                    os.makedirs(work_dir)
+                    setup_function(dataset_dir, work_dir)
+                    os.chdir(work_dir)
+                    start_time = time.perf_counter()
+                    bench_function(args)
+                    times.append(time.perf_counter() - start_time)
+                    os.chdir(temp_dir)
+                    shutil.rmtree(work_dir)
+                results[name] = {"median": statistics.median(times), "min": min(times), "images": args.image_count}
+                print(f"{name}: median {results[name]['median']:.3f}s, min {results[name]['min']:.3f}s, {args.image_count / results[name]['median']:.0f} images/s")
+        finally:
+            os.chdir(REPO_DIR)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, "r", encoding="utf8") as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"Comparing with the baseline \"{args.baseline}\"...")
+        for name, result in results.items():
+            baseline_result = baseline.get(name)
+            if baseline_result is None:
+                continue
+            # Normalized per image so baselines made at another scale are still roughly comparable.
+            ratio = (result["median"] / result["images"]) / (baseline_result["median"] / baseline_result["images"])
+            print(f"{name}: {ratio:.2f}x the baseline time per image{' (regression)' if ratio > 1.1 else ''}")
+    if args.save_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf8") as baseline_file:
+            json.dump(baseline, baseline_file, indent=4)
+        print(f"Saved the results as the baseline \"{args.baseline}\".")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+import utils
+from constants import MAX_TASKS, TIMEOUT
+
+# Compares the HTTP transports of utils.get_session against benchmarks/fake_h2.py, run from the repository root:
+# python -m benchmarks.bench_transport -n 2000 -c 50
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the HTTP transports against a local HTTP/2 capable stand-in server.")
+    parser.add_argument("-n", "--request-count", type=int, default=1000, help="Amount of requests for each transport, default to 1000")
+    parser.add_argument("-c", "--concurrency", type=int, default=MAX_TASKS, help=f"Concurrent requests, default to {MAX_TASKS} like the scrapers")
+    parser.add_argument("-k", "--kind", choices=("bytes", "json"), default="bytes", help="Download image sized bytes with PartialDownload or small JSON responses, default to bytes")
+    parser.add_argument("-l", "--latency", type=float, default=0.05, help="Mean seconds of latency of the stand-in server, default to 0.05")
+    parser.add_argument("-s", "--size", type=int, default=256, help="KiB of each bytes response, default to 256")
+    parser.add_argument("-r", "--redirect-rate", type=float, default=0.1, help="Fraction of requests the stand-in server redirects once first, default to 0.1")
+    parser.add_argument("-t", "--transports", nargs="+", choices=utils.TRANSPORTS, help="Transports to compare, default to all available ones")
+    parser.add_argument("-p", "--port", type=int, default=0, help="Port for the stand-in server, default to a free port")
+    parser.add_argument("-o", "--output", help="Append the results as JSON lines to this file")
+    args = parser.parse_args()
+    if args.request_count < 1 or args.concurrency < 1:
+        print("Request count and concurrency must be positive!")
+        sys.exit(1)
+    if not 0 <= args.redirect_rate <= 1:
+        print("Redirect rate must be between 0 and 1!")
+        sys.exit(1)
+    try:
+        import hypercorn
+    except ImportError:
+        print("You need to pip install hypercorn to run the HTTP/2 stand-in server!")
+        sys.exit(1)
+    if args.transports is None:
+        args.transports = utils.get_available_transports()
+    for transport in args.transports:
+        if transport not in utils.get_available_transports():
+            print("You need to pip install httpx[http2] to benchmark the HTTP/2 transport!")
+            sys.exit(1)
+    return args
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(args, port):
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_h2", "-p", str(port), "-l", str(args.latency), "-s", str(args.size), "-r", str(args.redirect_rate)], cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The stand-in server exited before it was ready!")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("The stand-in server didn't start in time!")
+
+async def get_stats(session, base_url, reset=False):
+    async with session.get(base_url + "/stats" + ("?reset=1" if reset else "")) as response:
+        utils.check_status(response)
+        return await response.json()
+
+async def run_transport(transport, args, base_url):
+    utils.set_transport(transport)
+    latency_histogram = utils.Histogram()
+    total_bytes = 0
+    error_count = 0
+    error_counts = {}
+    next_request = 0
+
+    async def worker(session):
+        nonlocal total_bytes, error_count, next_request
+        while next_request < args.request_count:
+            next_request += 1
+            start_time = time.perf_counter()
+            try:
+                if args.kind == "bytes":
+                    size = len(await utils.PartialDownload(base_url + "/bytes").read(session))
+                else:
+                    async with session.get(base_url + "/json") as response:
+                        utils.check_status(response)
+                        size = len(await response.read())
+            except Exception as e:
+                error_count += 1
+                error_counts[e.__class__.__name__] = error_counts.get(e.__class__.__name__, 0) + 1
+                continue
+            total_bytes += size # Added after the await, as an augmented assignment around it would lose the other workers' updates.
+            latency_histogram.add(time.perf_counter() - start_time)
+
+    async with utils.get_session(TIMEOUT) as session:
+        await get_stats(session, base_url, True)
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+        used_time = time.perf_counter() - start_time
+        stats = await get_stats(session, base_url)
+    return {
+        "time": time.time(), "transport": transport, "kind": args.kind, "requests": args.request_count, "concurrency": args.concurrency, "latency": args.latency, "size_kib": args.size,
+        "seconds": used_time, "requests_per_second": args.request_count / used_time, "mib_per_second": total_bytes / 1024 / 1024 / used_time, "errors": error_count, "error_types": error_counts,
+        "connections": stats["connections"], "http_versions": stats["requests"], "redirects": stats["redirects"], "request_latency": latency_histogram.to_dict(), "latency_text": latency_histogram.get_text(),
+    }
+
+def main():
+    args = parse_args()
+    port = args.port or get_free_port()
+    print(f"Starting the HTTP/2 stand-in on port {port}...")
+    server = start_server(args, port)
+    results = []
+    try:
+        for transport in args.transports:
+            result = asyncio.run(run_transport(transport, args, f"http://127.0.0.1:{port}"))
+            results.append(result)
+            print(
+                f"{transport}: {result['requests']} {args.kind} requests in {result['seconds']:.2f}s, {result['requests_per_second']:.1f} requests/s, {result['mib_per_second']:.1f}MiB/s,",
+                f"latency p50/p95/max {result.pop('latency_text')}, {result['connections']} connections, requests by HTTP version {result['http_versions']}, {result['redirects']} redirects, {result['errors']} errors{' ' + str(result['error_types']) if result['error_types'] else ''}",
+            )
+    finally:
+        server.terminate()
+        server.wait()
+    if args.output is not None:
+        with open(args.output, "a", encoding="utf8") as output_file:
+            output_file.writelines(json.dumps(result) + "\n" for result in results)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -0,0 +1,247 @@
+import io
+import os
+import re
+import sys
+import html
+import random
+import asyncio
+import argparse
+from aiohttp import web
+
+# Stand-in for Gelbooru (listing and post HTML pages) and yande.re (post.json) with synthetic posts and images.
+
+COMPARE_FILTER_PATTERN = re.compile(r"^(id|score):([<>])(=?)(-?\d+)$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d+)-$")
+RATINGS = ("general", "sensitive", "questionable", "explicit")
+YAN_RATINGS = {"general": "s", "sensitive": "s", "questionable": "q", "explicit": "e"}
+GEL_PAGE_SIZE = 42
+TAG_TYPES = ("artist", "character", "copyright", "metadata")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a local stand-in booru server with synthetic posts.")
+    parser.add_argument("-H", "--host", default="127.0.0.1", help="Host to listen on, default to 127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8001, help="Port to listen on, default to 8001")
+    parser.add_argument("-n", "--post-count", type=int, default=10000, help="Number of synthetic posts, default to 10000")
+    parser.add_argument("-l", "--latency", type=float, default=0.05, help="Mean seconds of latency for each response, default to 0.05")
+    parser.add_argument("-e", "--error-rate", type=float, default=0.0, help="Fraction of responses that are 500 errors, default to 0")
+    parser.add_argument("-r", "--truncate-rate", type=float, default=0.0, help="Fraction of image responses cut off halfway through, default to 0")
+    parser.add_argument("-R", "--redirect-rate", type=float, default=0.0, help="Fraction of responses that are a redirect back to the same URL first, default to 0")
+    parser.add_argument("-v", "--video-rate", type=float, default=0.0, help="Fraction of Gelbooru posts that are videos, default to 0")
+    parser.add_argument("-s", "--image-size", type=int, default=512, help="Width and height of the synthetic images, default to 512")
+    parser.add_argument("-d", "--depth-cap", type=int, default=20000, help="Gelbooru search depth cap in posts, default to 20000")
+    parser.add_argument("-t", "--tags-path", default="model_tags.txt", help="Tag vocabulary to draw post tags from, default to model_tags.txt, synthetic tags are used if missing")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the synthetic posts, default to 42")
+    args = parser.parse_args()
+    if args.post_count < 1 or args.image_size < 1:
+        print("Post count and image size must be positive!")
+        sys.exit(1)
+    if not 0 <= args.error_rate <= 1 or not 0 <= args.truncate_rate <= 1 or not 0 <= args.video_rate <= 1 or not 0 <= args.redirect_rate <= 1:
+        print("Rates must be between 0 and 1!")
+        sys.exit(1)
+    return args
+
+def load_vocabulary(tags_path):
+    if os.path.isfile(tags_path):
+        with open(tags_path, "r", encoding="utf8") as tags_file:
+            tags = [line.split()[1] for line in tags_file if len(line.split()) == 2]
+        tags = [tag for tag in tags if not tag.startswith("rating:")]
+        if tags:
+            return tags
+    return [f"tag_{i}" for i in range(5000)]
+
+def matches_filter(post, key, less_than, with_equal, value):
+    if post[key] == value:
+        return with_equal
+    return post[key] < value if less_than else post[key] > value
+
+def matches_tag(post, tag):
+    if tag.startswith("score:"):
+        return str(post["score"]) == tag[6:]
+    if tag.startswith("rating:"):
+        return post["rating"] == tag[7:]
+    return any(tag in tags for tags in post["type_tags_dict"].values())
+
+def make_images(image_size, count=8, seed=42):
+    from PIL import Image
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        img = Image.frombytes("RGB", (image_size, image_size), rng.randbytes(image_size * image_size * 3))
+        with io.BytesIO() as image_filelike:
+            img.save(image_filelike, "PNG")
+            images.append(image_filelike.getvalue())
+    return images
+
+class FakeBooru:
+
+    def __init__(self, args):
+        self.args = args
+        self.vocabulary = load_vocabulary(args.tags_path)
+        self.images = make_images(args.image_size, seed=args.seed)
+        # Zipf-like weights so a few tags are very common and most are rare, like on real boorus.
+        self.tag_weights = [1 / (i + 1) for i in range(len(self.vocabulary))]
+        self.posts = [self.make_post(post_id) for post_id in range(args.post_count, 0, -1)]
+        self.request_count = 0
+
+    def make_post(self, post_id):
+        rng = random.Random(self.args.seed * 1000003 + post_id)
+        tags = list(dict.fromkeys(rng.choices(self.vocabulary, self.tag_weights, k=rng.randint(5, 40))))
+        type_tags_dict = {"general": tags}
+        for tag_type in TAG_TYPES:
+            if rng.random() < 0.7:
+                type_tags_dict[tag_type] = [f"{tag_type}_{rng.randint(1, 200)}"]
+        return {
+            "id": post_id, "score": int(rng.paretovariate(1.2)) - 1, "rating": rng.choice(RATINGS),
+            "type_tags_dict": type_tags_dict, "is_video": rng.random() < self.args.video_rate,
+        }
+
+    async def simulate_network(self, request):
+        self.request_count += 1
+        if self.args.latency > 0:
+            await asyncio.sleep(random.expovariate(1 / self.args.latency))
+        if random.random() < self.args.error_rate:
+            raise web.HTTPInternalServerError(text="Synthetic error.")
+        # Marked so the redirected request is served instead of redirected again.
+        if "redirected" not in request.query and random.random() < self.args.redirect_rate:
+            raise web.HTTPFound(request.rel_url.update_query(redirected=1))
+
+    def search(self, tags_text):
+        general_tags = []
+        sort_type = "id"
+        descending = True
+        filters = []
+        for tag in tags_text.split():
+            if tag.startswith("sort:"):
+                sort_parts = tag.split(":")
+                sort_type = sort_parts[1]
+                descending = len(sort_parts) < 3 or sort_parts[2] != "asc"
+                continue
+            re_match = COMPARE_FILTER_PATTERN.match(tag)
+            if re_match is not None:
+                filters.append((re_match.group(1), re_match.group(2) == "<", bool(re_match.group(3)), int(re_match.group(4))))
+                continue
+            general_tags.append(tag)
+        posts = [post for post in self.posts if all(matches_filter(post, *f) for f in filters) and all(matches_tag(post, tag) for tag in general_tags)]
+        posts.sort(key=lambda post: (post[sort_type], post["id"]), reverse=descending)
+        return posts
+
+    def get_base_url(self, request):
+        return f"{request.scheme}://{request.host}"
+
+    async def gel_index(self, request):
+        await self.simulate_network(request)
+        if request.query.get("page") != "post":
+            raise web.HTTPNotFound()
+        match request.query.get("s"):
+            case "list":
+                return self.gel_list(request)
+            case "view":
+                return self.gel_view(request)
+        raise web.HTTPNotFound()
+
+    def gel_list(self, request):
+        base_url = self.get_base_url(request)
+        pid = int(request.query.get("pid", 0))
+        parts = ["<html><body><div class=\"thumbnail-container\">"]
+        if pid >= self.args.depth_cap:
+            parts.append("<div class=\"notice error\">Unable to search this deep in temporarily.</div>")
+        else:
+            for post in self.search(request.query.get("tags", ""))[pid:pid + GEL_PAGE_SIZE]:
+                title = html.escape(" ".join(tag for tags in post["type_tags_dict"].values() for tag in tags) + f" score:{post['score']} rating:{post['rating']}")
+                parts.append(
+                    f"<article class=\"thumbnail-preview\"><a id=\"p{post['id']}\" href=\"{base_url}/index.php?page=post&amp;s=view&amp;id={post['id']}&amp;tags=all\">"
+                    f"<img src=\"{base_url}/thumbnails/{post['id']}.jpg\" title=\"{title}\" alt=\"{title}\"></a></article>"
+                )
+        parts.append("</div></body></html>")
+        return web.Response(text="".join(parts), content_type="text/html")
+
+    def gel_view(self, request):
+        base_url = self.get_base_url(request)
+        post_id = int(request.query.get("id", 0))
+        if not 1 <= post_id <= len(self.posts):
+            raise web.HTTPNotFound()
+        post = self.posts[len(self.posts) - post_id]
+        parts = ["<html><body><ul id=\"tag-list\">"]
+        for tag_type, tags in post["type_tags_dict"].items():
+            for tag in tags:
+                parts.append(f"<li class=\"tag-type-{tag_type}\"><a href=\"{base_url}/index.php?page=post&amp;s=list&amp;tags={html.escape(tag)}\">{html.escape(tag.replace('_', ' '))}</a> <span>1</span></li>")
+        parts.append("</ul>")
+        if post["is_video"]:
+            parts.append(f"<video id=\"gelcomVideoPlayer\"><source src=\"{base_url}/images/{post_id}.webm\"></video>")
+        else:
+            gel_rating = "safe" if post["rating"] == "general" else post["rating"]
+            parts.append(f"<section class=\"image-container note-container\" data-rating=\"{gel_rating}\"><img id=\"image\" src=\"{base_url}/samples/{post_id}.png\"></section>")
+            parts.append(f"<a href=\"{base_url}/images/{post_id}.png\">Original image</a>")
+        parts.append(f"<span id=\"psc{post_id}\">{post['score']}</span></body></html>")
+        return web.Response(text="".join(parts), content_type="text/html")
+
+    async def yan_post_json(self, request):
+        await self.simulate_network(request)
+        base_url = self.get_base_url(request)
+        limit = min(int(request.query.get("limit", 1000)), 1000)
+        page = max(int(request.query.get("page", 1)), 1)
+        posts = self.search(request.query.get("tags", ""))[(page - 1) * limit:page * limit]
+        tag_type_dict = {}
+        post_objects = []
+        for post in posts:
+            for tag_type, tags in post["type_tags_dict"].items():
+                for tag in tags:
+                    tag_type_dict[tag] = tag_type
+            post_objects.append({
+                "id": post["id"], "score": post["score"], "rating": YAN_RATINGS[post["rating"]],
+                "tags": " ".join(tag for tags in post["type_tags_dict"].values() for tag in tags),
+                "file_url": f"{base_url}/images/{post['id']}.png", "sample_url": f"{base_url}/samples/{post['id']}.png",
+            })
+        return web.json_response({"posts": post_objects, "tags": tag_type_dict})
+
+    async def image(self, request):
+        await self.simulate_network(request)
+        post_id = int(request.match_info["post_id"])
+        image_data = self.images[post_id % len(self.images)]
+        headers = {"Accept-Ranges": "bytes", "ETag": f"\"{post_id % len(self.images)}\""}
+        start = 0
+        re_match = RANGE_PATTERN.search(request.headers.get("Range", ""))
+        if re_match is not None and request.headers.get("If-Range", headers["ETag"]) == headers["ETag"]:
+            start = int(re_match.group(1))
+            if start >= len(image_data):
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{len(image_data)}"})
+            headers["Content-Range"] = f"bytes {start}-{len(image_data) - 1}/{len(image_data)}"
+        body = image_data[start:]
+        response = web.StreamResponse(status=206 if start > 0 else 200, headers=headers)
+        response.content_type = "image/png"
+        response.content_length = len(body)
+        await response.prepare(request)
+        if random.random() < self.args.truncate_rate:
+            # Cuts the connection halfway through the body like a flaky link does.
+            await response.write(body[:len(body) // 2])
+            request.transport.close()
+            return response
+        await response.write(body)
+        await response.write_eof()
+        return response
+
+def make_app(args):
+    fake_booru = FakeBooru(args)
+    app = web.Application()
+    app["fake_booru"] = fake_booru
+    app.add_routes([
+        web.get("/index.php", fake_booru.gel_index),
+        web.get("/post.json", fake_booru.yan_post_json),
+        web.get("/images/{post_id:\\d+}.png", fake_booru.image),
+        web.get("/samples/{post_id:\\d+}.png", fake_booru.image),
+    ])
+    return app
+
+def main():
+    args = parse_args()
+    print("Generating synthetic posts...")
+    app = make_app(args)
+    print(f"Serving the stand-in booru at http://{args.host}:{args.port}", flush=True)
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
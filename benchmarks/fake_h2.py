@@ -0,0 +1,130 @@
+import sys
+import json
+import random
+import asyncio
+import argparse
+
+# HTTP/2 capable stand-in server for benchmarking the transports, also speaks HTTP/1.1 on the same port.
+# Serves /bytes and /json itself, or proxies every request to another stand-in like fake_booru.py with --upstream,
+# and counts the client connections by their address as HTTP/1.1 opens one per concurrent request and HTTP/2 doesn't.
+# With --redirect-rate, that fraction of GET requests first gets a 302 back to the same URL like CDNs hand out, so the transports have to follow redirects.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a local HTTP/2 capable stand-in server.")
+    parser.add_argument("-H", "--host", default="127.0.0.1", help="Host to listen on, default to 127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8443, help="Port to listen on, default to 8443")
+    parser.add_argument("-l", "--latency", type=float, default=0.05, help="Mean seconds of latency for each response, default to 0.05")
+    parser.add_argument("-s", "--size", type=int, default=256, help="KiB of each /bytes response, default to 256")
+    parser.add_argument("-u", "--upstream", help="Proxy every request other than /stats to this URL prefix instead, e.g. http://127.0.0.1:8011 for fake_booru.py")
+    parser.add_argument("-r", "--redirect-rate", type=float, default=0.0, help="Fraction of GET requests redirected once before they're served, default to 0")
+    parser.add_argument("-m", "--max-streams", type=int, default=100, help="Max concurrent HTTP/2 streams per connection, default to 100")
+    args = parser.parse_args()
+    if args.latency < 0 or args.size < 0:
+        print("Latency and size must be greater than or equal to 0!")
+        sys.exit(1)
+    if not 0 <= args.redirect_rate <= 1:
+        print("Redirect rate must be between 0 and 1!")
+        sys.exit(1)
+    try:
+        import hypercorn
+    except ImportError:
+        print("You need to pip install hypercorn to run the HTTP/2 stand-in server!")
+        sys.exit(1)
+    return args
+
+class FakeH2:
+
+    def __init__(self, args):
+        self.args = args
+        self.body = random.Random(0).randbytes(args.size * 1024)
+        self.client_addresses = set()
+        self.http_version_counts = {}
+        self.redirect_count = 0
+        self.upstream_session = None
+
+    async def send(self, send, status, body, content_type, headers=()):
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type.encode("utf8")), (b"content-length", str(len(body)).encode("utf8")), *headers]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def read_body(self, receive):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    async def proxy(self, scope, receive, send):
+        import aiohttp
+        if self.upstream_session is None:
+            self.upstream_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), auto_decompress=False)
+        path = scope["raw_path"].decode("utf8") + ("?" + scope["query_string"].decode("utf8") if scope["query_string"] else "")
+        # The Host header is passed through so the upstream makes its URLs point back here.
+        headers = [(name.decode("latin1"), value.decode("latin1")) for name, value in scope["headers"] if name.lower() not in (b"connection", b"transfer-encoding")]
+        async with self.upstream_session.request(scope["method"], self.args.upstream + path, headers=headers, data=await self.read_body(receive), allow_redirects=False) as response:
+            body = await response.read()
+            response_headers = [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in response.headers.items() if name.lower() not in ("content-length", "content-type", "connection", "transfer-encoding")]
+            await self.send(send, response.status, body, response.headers.get("Content-Type", "application/octet-stream"), response_headers)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    if self.upstream_session is not None:
+                        await self.upstream_session.close()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        self.client_addresses.add(tuple(scope["client"]))
+        self.http_version_counts[scope["http_version"]] = self.http_version_counts.get(scope["http_version"], 0) + 1
+        if scope["path"] == "/stats":
+            stats = {"connections": len(self.client_addresses), "requests": dict(self.http_version_counts), "redirects": self.redirect_count}
+            if scope["query_string"] == b"reset=1": # So each benchmark run only counts its own connections.
+                self.client_addresses.clear()
+                self.http_version_counts.clear()
+                self.redirect_count = 0
+            await self.send(send, 200, json.dumps(stats).encode("utf8"), "application/json")
+            return
+        query_string = scope["query_string"].decode("utf8")
+        if scope["method"] == "GET" and "redirected=1" not in query_string.split("&") and random.random() < self.args.redirect_rate:
+            # Marked so the redirected request is served instead of redirected again.
+            self.redirect_count += 1
+            location = scope["raw_path"].decode("utf8") + "?" + (query_string + "&" if query_string else "") + "redirected=1"
+            await self.send(send, 302, b"Found.", "text/plain", [(b"location", location.encode("utf8"))])
+            return
+        if self.args.upstream is not None:
+            await self.proxy(scope, receive, send)
+            return
+        await asyncio.sleep(random.expovariate(1 / self.args.latency) if self.args.latency > 0 else 0)
+        match scope["path"]:
+            case "/bytes":
+                await self.send(send, 200, self.body, "application/octet-stream")
+            case "/json":
+                await self.send(send, 200, json.dumps({"ok": True, "value": random.random()}).encode("utf8"), "application/json")
+            case _:
+                await self.send(send, 404, b"Not found.", "text/plain")
+
+def main():
+    args = parse_args()
+    from hypercorn.config import Config
+    from hypercorn.asyncio import serve
+    config = Config()
+    config.bind = [f"{args.host}:{args.port}"]
+    config.h2_max_concurrent_streams = args.max_streams
+    config.keep_alive_timeout = 60
+    # Hypercorn closes a connection after 1000 requests without waiting for the large responses still streaming on it, which would count as transport errors.
+    config.keep_alive_max_requests = 1 << 30
+    config.accesslog = None
+    print(f"Serving the HTTP/2 stand-in at http://{args.host}:{args.port}", flush=True)
+    asyncio.run(serve(FakeH2(args), config))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
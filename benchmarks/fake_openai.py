@@ -0,0 +1,149 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from aiohttp import web
+
+# Stand-in for an OpenAI compatible API, implements chat completions and the batch file flow.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a local stand-in OpenAI compatible API server.")
+    parser.add_argument("-H", "--host", default="127.0.0.1", help="Host to listen on, default to 127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="Port to listen on, default to 8000")
+    parser.add_argument("-l", "--latency", type=float, default=0.5, help="Seconds of latency for each chat completion, default to 0.5")
+    parser.add_argument("-e", "--error-rate", type=float, default=0.0, help="Fraction of chat completions that respond with a 500 error, default to 0")
+    parser.add_argument("-r", "--rate-limit-rate", type=float, default=0.0, help="Fraction of chat completions that respond with a 429 error, default to 0")
+    parser.add_argument("-b", "--batch-delay", type=float, default=5.0, help="Seconds before a submitted batch completes, default to 5")
+    parser.add_argument("-d", "--description", default="A fake description for image {custom_id}.", help="Template of the returned description")
+    args = parser.parse_args()
+    if not 0 <= args.error_rate <= 1 or not 0 <= args.rate_limit_rate <= 1:
+        print("Error rates must be between 0 and 1!")
+        sys.exit(1)
+    return args
+
+class FakeOpenAI:
+
+    def __init__(self, args):
+        self.args = args
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.batch_tasks = set()
+        self.request_count = 0
+
+    def new_id(self, prefix):
+        self.request_count += 1
+        return f"{prefix}-{self.request_count}"
+
+    def make_completion(self, request_json, custom_id=None):
+        content = self.args.description.format(custom_id=custom_id or self.request_count)
+        return {
+            "id": self.new_id("chatcmpl"), "object": "chat.completion", "created": int(time.time()), "model": request_json.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(json.dumps(request_json)) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(json.dumps(request_json)) + len(content)) // 4},
+        }
+
+    async def chat_completions(self, request):
+        request_json = await request.json()
+        await asyncio.sleep(self.args.latency)
+        roll = random.random()
+        if roll < self.args.rate_limit_rate:
+            return web.json_response({"error": {"message": "Rate limit reached.", "type": "rate_limit_exceeded"}}, status=429)
+        if roll < self.args.rate_limit_rate + self.args.error_rate:
+            return web.json_response({"error": {"message": "Internal server error.", "type": "server_error"}}, status=500)
+        return web.json_response(self.make_completion(request_json))
+
+    async def upload_file(self, request):
+        reader = await request.multipart()
+        purpose = None
+        content = None
+        filename = None
+        async for part in reader:
+            if part.name == "purpose":
+                purpose = await part.text()
+            elif part.name == "file":
+                filename = part.filename
+                content = await part.read()
+        if content is None:
+            return web.json_response({"error": {"message": "No file uploaded."}}, status=400)
+        file_id = self.new_id("file")
+        self.files[file_id] = content
+        return web.json_response({"id": file_id, "object": "file", "bytes": len(content), "filename": filename, "purpose": purpose})
+
+    async def get_file_content(self, request):
+        content = self.files.get(request.match_info["file_id"])
+        if content is None:
+            return web.json_response({"error": {"message": "File not found."}}, status=404)
+        return web.Response(body=content, content_type="application/jsonl")
+
+    async def run_batch(self, batch):
+        await asyncio.sleep(self.args.batch_delay)
+        output_lines = []
+        error_lines = []
+        for line in self.files[batch["input_file_id"]].splitlines():
+            if not line.strip():
+                continue
+            request_line = json.loads(line)
+            custom_id = request_line["custom_id"]
+            if random.random() < self.args.error_rate:
+                error_lines.append({"id": self.new_id("batch_req"), "custom_id": custom_id, "response": None, "error": {"code": "server_error", "message": "Internal server error."}})
+                continue
+            output_lines.append({
+                "id": self.new_id("batch_req"), "custom_id": custom_id,
+                "response": {"status_code": 200, "request_id": self.new_id("req"), "body": self.make_completion(request_line["body"], custom_id)}, "error": None,
+            })
+        for key, lines in (("output_file_id", output_lines), ("error_file_id", error_lines)):
+            if lines:
+                file_id = self.new_id("file")
+                self.files[file_id] = "".join(json.dumps(line) + "\n" for line in lines).encode("utf8")
+                batch[key] = file_id
+        batch["request_counts"] = {"total": len(output_lines) + len(error_lines), "completed": len(output_lines), "failed": len(error_lines)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    async def create_batch(self, request):
+        request_json = await request.json()
+        input_file_id = request_json.get("input_file_id")
+        if input_file_id not in self.files:
+            return web.json_response({"error": {"message": "Input file not found."}}, status=404)
+        batch = {
+            "id": self.new_id("batch"), "object": "batch", "endpoint": request_json.get("endpoint"), "input_file_id": input_file_id,
+            "completion_window": request_json.get("completion_window"), "status": "in_progress", "created_at": int(time.time()),
+            "output_file_id": None, "error_file_id": None,
+        }
+        self.batches[batch["id"]] = batch
+        task = asyncio.create_task(self.run_batch(batch))
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+        return web.json_response(batch)
+
+    async def get_batch(self, request):
+        batch = self.batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return web.json_response({"error": {"message": "Batch not found."}}, status=404)
+        return web.json_response(batch)
+
+def make_app(args):
+    fake_openai = FakeOpenAI(args)
+    app = web.Application(client_max_size=1024 ** 3)
+    app.add_routes([
+        web.post("/v1/chat/completions", fake_openai.chat_completions),
+        web.post("/v1/files", fake_openai.upload_file),
+        web.get("/v1/files/{file_id}/content", fake_openai.get_file_content),
+        web.post("/v1/batches", fake_openai.create_batch),
+        web.get("/v1/batches/{batch_id}", fake_openai.get_batch),
+    ])
+    return app
+
+def main():
+    args = parse_args()
+    print(f"Serving the stand-in API at http://{args.host}:{args.port}/v1")
+    web.run_app(make_app(args), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -16,23 +16,29 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Group images into uncompressed tar files.")
     parser.add_argument("-i", "--input-dir", default=IMAGE_DIR, help="Input directory for the images to chunk into tars")
     parser.add_argument("-o", "--output-dir", default=COMPRESSED_DIR, help="Output directory for chunked tars")
+    parser.add_argument("--id-list", help="Only chunk the images whose IDs are in this file, one per line, e.g. made by query_tags.py, default to all images")
     parser.add_argument("-n", "--num-images-per-chunk", type=int, default=sys.maxsize, help="Number of images per chunk, default to infinite")
+    utils.add_profile_args(parser)
     args = parser.parse_args()
     if args.num_images_per_chunk < 1:
         print("Number of images per chunk needs to be a positive integer!")
         sys.exit(1)
+    if args.id_list is not None and not os.path.isfile(args.id_list):
+        print(f"Your ID list \"{args.id_list}\" doesn't exist or isn't a file!")
+        sys.exit(1)
     return args
 
 def main():
     args = parse_args()
-    image_metadata_path_tuple_list = [e[1] for e in sorted(utils.get_image_id_image_metadata_path_tuple_dict(args.input_dir).items(), key=lambda x: x[0])]
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    image_metadata_path_tuple_list = [e[1] for e in sorted(utils.filter_image_id_dict(utils.get_image_id_image_metadata_path_tuple_dict(args.input_dir), args.id_list).items(), key=lambda x: x[0])]
     os.makedirs(args.output_dir, exist_ok=True)
     with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
         futures = []
         for i in range(0, len(image_metadata_path_tuple_list), args.num_images_per_chunk):
             chunk = image_metadata_path_tuple_list[i:i + args.num_images_per_chunk]
             chunk_index = i // args.num_images_per_chunk
-            future = executor.submit(compress_chunk, chunk, chunk_index, args.output_dir)
+            future = executor.submit(utils.profile_call, "compress_chunk", compress_chunk, chunk, chunk_index, args.output_dir)
             futures.append(future)
         concurrent.futures.wait(futures)
 
@@ -12,3 +12,6 @@ IMAGE_EXT = {
 }
 
 MODEL_TAGS_PATH = "model_tags.txt"
+TAG_IDS_DIR = "tag_ids"
+TAG_INDEX_DIR = "tag_index"
+POST_STAGES_DIR = "post_stages"
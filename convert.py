@@ -13,15 +13,18 @@ def parse_args():
     mutex.add_argument("-e", "--exclude", nargs="+", help="Exclude tag groups with the specified group names, you can only set either exclude or include, but not both")
     mutex.add_argument("-i", "--include", nargs="+", help="Include tag groups with the specified group names, you can only set either include or exclude, but not both")
     parser.add_argument("-p", "--no-rating-prefix", action="store_true", help="If set, won't prepend the \"rating:\" prefix to the rating")
+    utils.add_profile_args(parser)
     return parser.parse_args()
 
 def main():
     args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
     print("Starting...\nGetting paths...")
     image_id_image_metadata_path_tuple_dict = utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR)
     print("Got", len(image_id_image_metadata_path_tuple_dict), "images.")
+    tag_filter = utils.TagFilter(args.exclude, args.include, args.no_rating_prefix)
     for _, metadata_path in tqdm.tqdm(image_id_image_metadata_path_tuple_dict.values(), desc="Converting"):
-        tags = utils.get_tags(metadata_path, args.exclude, args.include, args.no_rating_prefix)
+        tags = tag_filter.get_tags(metadata_path)
         random.shuffle(tags)
         tags_text = ", ".join(tag.replace("_", " ") for tag in tags)
         with open(os.path.splitext(metadata_path)[0] + ".txt", "w", encoding="utf8") as tags_file:
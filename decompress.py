@@ -1,5 +1,6 @@
 import os
 import sys
+import utils
 import argparse
 import tarfile
 from constants import *
@@ -13,11 +14,13 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Extract files from chunked tar archives.")
     parser.add_argument("-i", "--input-dir", default=COMPRESSED_DIR, help="Input directory containing tar chunks")
     parser.add_argument("-o", "--output-dir", default=IMAGE_DIR, help="Output directory for extracted files")
+    utils.add_profile_args(parser)
     args = parser.parse_args()
     return args
 
 def main():
     args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
     if not os.path.isdir(args.input_dir):
         print(f"Your input dir \"{args.input_dir}\" doesn't exist or isn't a directory!")
         sys.exit(1)
@@ -26,7 +29,7 @@ def main():
     with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
         futures = []
         for chunk_file in chunk_files:
-            future = executor.submit(decompress_chunk, chunk_file, args.output_dir)
+            future = executor.submit(utils.profile_call, "decompress_chunk", decompress_chunk, chunk_file, args.output_dir)
             futures.append(future)
         concurrent.futures.wait(futures)
 
@@ -0,0 +1,27 @@
+import sys
+import utils
+import argparse
+from constants import *
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=f"Make the per bucket image ID index \"{utils.BUCKET_INDEX_FILENAME}\" of images scraped or transcoded with aspect ratio bucketing.")
+    parser.add_argument("-i", "--input-dir", default=IMAGE_DIR, help=f"Directory with the bucketed images, default to \"{IMAGE_DIR}\"")
+    utils.add_profile_args(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    print("Starting...\nMaking the bucket index...")
+    bucket_index = utils.write_bucket_index(args.input_dir)
+    print("Got", sum(len(image_ids) for image_ids in bucket_index.values()), "bucketed images in", len(bucket_index), "buckets:")
+    for bucket, image_ids in bucket_index.items():
+        print(bucket, len(image_ids))
+    print("Finished.")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
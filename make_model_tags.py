@@ -11,6 +11,8 @@ def parse_args():
     mutex = parser.add_mutually_exclusive_group()
     mutex.add_argument("-e", "--exclude", nargs="+", help="Exclude tag groups with the specified group names, you can only set either exclude or include, but not both")
     mutex.add_argument("-i", "--include", nargs="+", help="Include tag groups with the specified group names, you can only set either include or exclude, but not both")
+    parser.add_argument("-n", "--no-stage-counts", action="store_true", help=f"If set, will always count from the metadata files instead of using the tag counts the tag_counts post stage of the scrapers keeps in \"{POST_STAGES_DIR}\" when they cover exactly the current images")
+    utils.add_profile_args(parser)
     args = parser.parse_args()
     if args.min_images < 0:
         print("Minimum images must be greater than or equal to 0!")
@@ -19,13 +21,25 @@ def parse_args():
 
 def main():
     args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
     print("Starting...\nGetting paths...")
     image_id_image_metadata_path_tuple_dict = utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR)
     print("Got", len(image_id_image_metadata_path_tuple_dict), "images.\nMaking buckets...")
     buckets = defaultdict(int)
-    for _, metadata_path in tqdm.tqdm(image_id_image_metadata_path_tuple_dict.values(), desc="Making buckets"):
-        for tag in utils.get_tags(metadata_path, args.exclude, args.include):
-            buckets[tag] += 1
+    tag_filter = utils.TagFilter(args.exclude, args.include)
+    tag_counts = None if args.no_stage_counts else utils.load_tag_counts(POST_STAGES_DIR)
+    if tag_counts is not None and set(tag_counts["image_ids"]) == set(image_id_image_metadata_path_tuple_dict):
+        print("Using the tag counts of the tag_counts post stage, as they cover exactly these images...")
+        for tag_type, tag_count_dict in tag_counts["counts"].items():
+            if tag_filter.accepts(tag_type):
+                for tag, count in tag_count_dict.items():
+                    buckets[tag] += count
+    else:
+        if tag_counts is not None:
+            print("The tag counts of the tag_counts post stage don't cover exactly these images, counting from the metadata instead...")
+        for _, metadata_path in tqdm.tqdm(image_id_image_metadata_path_tuple_dict.values(), desc="Making buckets"):
+            for tag in tag_filter.get_tags(metadata_path):
+                buckets[tag] += 1
     ratings = []
     for bucket in list(buckets.items()):
         tag = bucket[0]
@@ -36,12 +50,13 @@ def main():
     print("Sorting the tags based on alphabetical order...")
     buckets = sorted(buckets.items())
     print("Filtering out tags with less than", args.min_images, "images...")
-    buckets += ratings
+    buckets += sorted(ratings) # Sorted as the order they were found in depends on the directory listing.
     tags = [bucket[0] for bucket in buckets if bucket[1] >= args.min_images]
     print("The new model tags list contains", len(tags), "tags.\nSaving the result...")
     with open(MODEL_TAGS_PATH, "w", encoding="utf8") as file:
         for i, tag in enumerate(tags):
             file.write(f"{i} {tag}\n")
+    utils.write_tag_vocabulary(tags, utils.get_tag_vocabulary_path(MODEL_TAGS_PATH))
     print("Finished.")
 
 if __name__ == "__main__":
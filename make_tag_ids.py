@@ -0,0 +1,64 @@
+import os
+import sys
+import tqdm
+import utils
+import argparse
+from constants import *
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=f"Create or update the per image tag ID arrays in \"{TAG_IDS_DIR}\" based on the model tags.")
+    parser.add_argument("-r", "--rebuild", action="store_true", help="If set, will parse every image's metadata again instead of only the new and changed ones")
+    utils.add_profile_args(parser)
+    args = parser.parse_args()
+    try:
+        import numpy
+    except ImportError:
+        print("You need to pip install numpy to make tag ID arrays!")
+        sys.exit(1)
+    return args
+
+def main():
+    args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    import numpy as np
+    print("Starting...\nGetting model tags...")
+    vocabulary = utils.load_tag_vocabulary(MODEL_TAGS_PATH)
+    tag_id_dict = vocabulary.get_tag_id_dict()
+    tag_filter = utils.TagFilter()
+    old_tag_id_arrays = None if args.rebuild else utils.load_tag_id_arrays(TAG_IDS_DIR, vocabulary)
+    if old_tag_id_arrays is None:
+        print("No up to date tag ID arrays found, making them from scratch...")
+    print("Getting paths...")
+    image_id_image_metadata_path_tuple_dict = utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR)
+    image_id_metadata_path_tuple_list = sorted((int(image_id), metadata_path) for image_id, (_, metadata_path) in image_id_image_metadata_path_tuple_dict.items() if image_id.isdecimal())
+    if len(image_id_metadata_path_tuple_list) < len(image_id_image_metadata_path_tuple_dict):
+        print("Skipped", len(image_id_image_metadata_path_tuple_dict) - len(image_id_metadata_path_tuple_list), "images without a numeric image ID.")
+    print("Got", len(image_id_metadata_path_tuple_list), "images.")
+    image_ids = np.empty(len(image_id_metadata_path_tuple_list), dtype=np.int64)
+    mtimes = np.empty(len(image_id_metadata_path_tuple_list), dtype=np.int64)
+    indptr = np.zeros(len(image_id_metadata_path_tuple_list) + 1, dtype=np.int64)
+    rows = []
+    reused_count = 0
+    for i, (image_id, metadata_path) in enumerate(tqdm.tqdm(image_id_metadata_path_tuple_list, desc="Making tag ID arrays")):
+        mtime = os.stat(metadata_path).st_mtime_ns
+        old_row = old_tag_id_arrays.get_row(image_id) if old_tag_id_arrays is not None else None
+        if old_row is not None and old_tag_id_arrays.mtimes[old_row] == mtime:
+            row = old_tag_id_arrays.get_row_tag_ids(old_row)
+            reused_count += 1
+        else:
+            row = np.array(sorted({tag_id_dict[tag] for tag in tag_filter.get_tags(metadata_path) if tag in tag_id_dict}), dtype=np.int32)
+        image_ids[i] = image_id
+        mtimes[i] = mtime
+        indptr[i + 1] = indptr[i] + len(row)
+        rows.append(row)
+    indices = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+    print(f"Reused {reused_count} rows and parsed {len(rows) - reused_count} metadata files, {len(old_tag_id_arrays) - reused_count if old_tag_id_arrays is not None else 0} stale rows dropped.\nSaving the result...")
+    utils.save_tag_id_arrays(TAG_IDS_DIR, utils.TagIdArrays(image_ids, mtimes, indptr, indices.astype(np.int32, copy=False)), vocabulary)
+    print("Finished.")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
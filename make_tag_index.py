@@ -0,0 +1,86 @@
+import os
+import sys
+import tqdm
+import utils
+import argparse
+from constants import *
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=f"Create or update the inverted tag index in \"{TAG_INDEX_DIR}\" used by query_tags.py.")
+    parser.add_argument("-r", "--rebuild", action="store_true", help="If set, will parse every image's metadata again instead of only the new and changed ones")
+    utils.add_profile_args(parser)
+    args = parser.parse_args()
+    try:
+        import numpy
+    except ImportError:
+        print("You need to pip install numpy to make the tag index!")
+        sys.exit(1)
+    return args
+
+def main():
+    args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    import numpy as np
+    print("Starting...")
+    old_tag_index = None if args.rebuild else utils.load_tag_index(TAG_INDEX_DIR)
+    if old_tag_index is None:
+        print("No tag index found, making it from scratch...")
+    print("Getting paths...")
+    image_id_image_metadata_path_tuple_dict = utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR)
+    image_id_metadata_path_tuple_list = sorted((int(image_id), metadata_path) for image_id, (_, metadata_path) in image_id_image_metadata_path_tuple_dict.items() if image_id.isdecimal())
+    if len(image_id_metadata_path_tuple_list) < len(image_id_image_metadata_path_tuple_dict):
+        print("Skipped", len(image_id_image_metadata_path_tuple_dict) - len(image_id_metadata_path_tuple_list), "images without a numeric image ID.")
+    print("Got", len(image_id_metadata_path_tuple_list), "images.")
+    image_count = len(image_id_metadata_path_tuple_list)
+    image_ids = np.empty(image_count, dtype=np.int64)
+    mtimes = np.empty(image_count, dtype=np.int64)
+    scores = np.empty(image_count, dtype=np.int64)
+    ratings = np.empty(image_count, dtype=np.int8)
+    indptr = np.zeros(image_count + 1, dtype=np.int64)
+    rows = []
+    tag_id_dict = {}
+    old_tag_id_map = None # Old tag ID to new tag ID, made on the first reused row.
+    reused_count = 0
+    for i, (image_id, metadata_path) in enumerate(tqdm.tqdm(image_id_metadata_path_tuple_list, desc="Indexing tags")):
+        mtime = os.stat(metadata_path).st_mtime_ns
+        old_row = old_tag_index.get_row(image_id) if old_tag_index is not None else None
+        if old_row is not None and old_tag_index.mtimes[old_row] == mtime:
+            if old_tag_id_map is None:
+                old_tag_id_map = np.array([tag_id_dict.setdefault(tag, len(tag_id_dict)) for tag in old_tag_index.tags], dtype=np.int32)
+            row = old_tag_id_map[old_tag_index.get_row_tag_ids(old_row)]
+            scores[i] = old_tag_index.scores[old_row]
+            ratings[i] = old_tag_index.ratings[old_row]
+            reused_count += 1
+        else:
+            metadata = utils.load_metadata(metadata_path)
+            row = np.array([tag_id_dict.setdefault(tag, len(tag_id_dict)) for type_tags in metadata.tags.values() for tag in type_tags], dtype=np.int32)
+            scores[i] = metadata.score
+            ratings[i] = utils.TAG_INDEX_RATINGS.index(metadata.rating) if metadata.rating in utils.TAG_INDEX_RATINGS else -1
+        image_ids[i] = image_id
+        mtimes[i] = mtime
+        indptr[i + 1] = indptr[i] + len(row)
+        rows.append(row)
+    print(f"Reused {reused_count} rows and parsed {len(rows) - reused_count} metadata files.\nMaking posting lists...")
+    indices = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+    # Sorts the tags by name and drops the ones no image has anymore.
+    tags = np.array(list(tag_id_dict), dtype=object)
+    used_tag_ids = np.flatnonzero(np.bincount(indices, minlength=len(tags)))
+    used_tag_ids = used_tag_ids[np.argsort(tags[used_tag_ids], kind="stable")]
+    tag_id_map = np.full(len(tags), -1, dtype=np.int32)
+    tag_id_map[used_tag_ids] = np.arange(len(used_tag_ids), dtype=np.int32)
+    # One sort over (Row, Tag ID) keys orders and dedups the tag IDs of every row at once.
+    entry_keys = np.unique(np.repeat(np.arange(image_count, dtype=np.int64), np.diff(indptr)) * len(used_tag_ids) + tag_id_map[indices])
+    indices = (entry_keys % max(len(used_tag_ids), 1)).astype(np.int32)
+    np.cumsum(np.bincount(entry_keys // max(len(used_tag_ids), 1), minlength=image_count), out=indptr[1:])
+    posting_indptr, postings = utils.make_postings(indptr, indices, len(used_tag_ids))
+    tag_index = utils.TagIndex(image_ids, mtimes, scores, ratings, indptr, indices, posting_indptr, postings, tags[used_tag_ids].tolist())
+    print(f"Got {len(tag_index.tags)} tags.\nSaving the result...")
+    utils.save_tag_index(TAG_INDEX_DIR, tag_index)
+    print("Finished.")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -0,0 +1,69 @@
+import os
+import sys
+import utils
+import asyncio
+import argparse
+import importlib
+
+SCRAPER_MODULES = {"gel": "scrape_gel", "yan": "scrape_yan"}
+DEFAULT_SITES = {"gel": "https://gelbooru.com", "yan": "https://yande.re"}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Split a search into image ID range work units for a distributed crawl, workers run the scraper with --work-queue.")
+    parser.add_argument("-S", "--scraper", required=True, choices=sorted(SCRAPER_MODULES), help="Which scraper the workers run")
+    parser.add_argument("-q", "--queue-path", default="work_queue.db", help="Path of the SQLite work queue to create, put it on a filesystem shared by the workers, default to \"work_queue.db\"")
+    parser.add_argument("-s", "--site", help="Domain to get the newest image ID from, default to the scraper's default site")
+    parser.add_argument("-u", "--unit-size", type=int, default=10000, help="Amount of image IDs in each work unit, default to 10000")
+    parser.add_argument("--min-id", type=int, default=1, help="Smallest image ID to scrape, default to 1")
+    parser.add_argument("--max-id", type=int, help="Largest image ID to scrape, default to the newest image ID of the search")
+    parser.add_argument("tags_to_search", nargs=argparse.REMAINDER, help="List of tags to search for, after every option, default to all")
+    utils.add_profile_args(parser)
+    args = parser.parse_args()
+    if any(tag.startswith("--") for tag in args.tags_to_search):
+        print("Options must come before the tags to search, everything after the first tag is taken as a tag!")
+        sys.exit(1)
+    if args.unit_size < 1:
+        print("Unit size must be greater than or equal to 1!")
+        sys.exit(1)
+    if args.min_id < 1:
+        print("Minimum ID must be greater than or equal to 1!")
+        sys.exit(1)
+    if args.max_id is not None and args.max_id < args.min_id:
+        print("Maximum ID must be greater than or equal to the minimum ID!")
+        sys.exit(1)
+    if os.path.exists(args.queue_path):
+        print(f"The work queue \"{args.queue_path}\" already exists!")
+        sys.exit(1)
+    for tag in args.tags_to_search:
+        if tag.strip().lower().startswith("id:"):
+            print("You can't use ID filters in the search tags, use --min-id and --max-id instead!")
+            sys.exit(1)
+    return args
+
+def main():
+    args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    print("Starting...")
+    max_id = args.max_id
+    if max_id is None:
+        print("Getting the newest image ID...")
+        scraper = importlib.import_module(SCRAPER_MODULES[args.scraper])
+        max_id = asyncio.run(scraper.get_max_image_id(args.site or DEFAULT_SITES[args.scraper], args.tags_to_search))
+        if max_id is None:
+            print("The search has no images!")
+            sys.exit(1)
+        print("Got newest image ID", max_id)
+        if max_id < args.min_id:
+            print("The newest image ID is smaller than the minimum ID!")
+            sys.exit(1)
+    work_queue = utils.WorkQueue(args.queue_path)
+    work_queue.create(args.scraper, args.tags_to_search, args.min_id, max_id, args.unit_size)
+    print(f"Made {work_queue.get_state_counts().get('pending', 0)} work units with IDs from {args.min_id} to {max_id} in \"{args.queue_path}\".")
+    work_queue.close()
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -0,0 +1,70 @@
+import os
+import sys
+import utils
+import argparse
+from constants import *
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=f"Build a global image ID index over the worker subdirectories of \"{IMAGE_DIR}\" after a distributed crawl.")
+    parser.add_argument("-q", "--work-queue", help="Also print the progress of this work queue, default to not printing it")
+    parser.add_argument("-r", "--remove-duplicates", action="store_true", help="If set, will delete the copies of images scraped by more than one worker, keeping the ones in the index")
+    parser.add_argument("-f", "--flatten", action="store_true", help=f"If set, will move every image and its metadata out of the worker subdirectories into \"{IMAGE_DIR}\" so the other tools can use them, implies --remove-duplicates")
+    utils.add_profile_args(parser)
+    args = parser.parse_args()
+    if args.work_queue is not None and not os.path.isfile(args.work_queue):
+        print(f"Your work queue \"{args.work_queue}\" doesn't exist or isn't a file!")
+        sys.exit(1)
+    if not os.path.isdir(IMAGE_DIR):
+        print(f"Your image dir \"{IMAGE_DIR}\" doesn't exist or isn't a directory!")
+        sys.exit(1)
+    return args
+
+def remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def main():
+    args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    print("Starting...")
+    if args.work_queue is not None:
+        work_queue = utils.WorkQueue(args.work_queue)
+        state_counts = work_queue.get_state_counts()
+        work_queue.close()
+        print("Work units:", ", ".join(f"{state}: {count}" for state, count in sorted(state_counts.items())) or "none")
+        if state_counts.get("pending") or state_counts.get("leased"):
+            print("Warning: The crawl isn't finished yet, the index will be missing the images of the unfinished work units.")
+    print("Indexing the worker subdirectories...")
+    id_index, duplicates = utils.make_id_index(IMAGE_DIR)
+    shard_count_dict = {}
+    for shard_name in id_index.values():
+        shard_count_dict[shard_name] = shard_count_dict.get(shard_name, 0) + 1
+    print("Got", len(id_index), "images:", ", ".join(f"{shard_name}: {count}" for shard_name, count in sorted(shard_count_dict.items())) or "none")
+    if duplicates:
+        print(f"Found {len(duplicates)} images scraped by more than one worker.")
+        if args.remove_duplicates or args.flatten:
+            for _, image_path, metadata_path in duplicates:
+                remove_files(image_path, metadata_path)
+            print("Deleted the duplicates.")
+    if args.flatten:
+        moved_count = 0
+        for shard_dir in utils.get_shard_dirs(IMAGE_DIR):
+            for image_id, (image_path, metadata_path) in utils.get_image_id_image_metadata_path_tuple_dict(shard_dir).items():
+                # The image first, so an interruption can only leave an image without metadata, which gets scraped again.
+                os.replace(image_path, os.path.join(IMAGE_DIR, os.path.basename(image_path)))
+                os.replace(metadata_path, os.path.join(IMAGE_DIR, os.path.basename(metadata_path)))
+                id_index[image_id] = ""
+                moved_count += 1
+        print(f"Moved {moved_count} images into \"{IMAGE_DIR}\".")
+    utils.write_id_index(IMAGE_DIR, id_index)
+    print(f"Wrote the index to \"{os.path.join(IMAGE_DIR, utils.ID_INDEX_FILENAME)}\".")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -1,5 +1,6 @@
+import os
 import sys
-import json
+import time
 import tqdm
 import utils
 import base64
@@ -8,12 +9,32 @@ import asyncio
 import aiofiles
 import argparse
 import mimetypes
+import concurrent
 from constants import *
 
 FEW_SHOT_EXAMPLES_PATH = "nl_llm_tag_few_shot_examples"
+JOURNAL_PATH = "nl_llm_tag_journal.txt"
+BATCH_DIR = "nl_llm_tag_batches"
+BATCH_STATE_PATH = os.path.join(BATCH_DIR, "pending_batches.json")
 MAX_TOKENS = None
 TEMPERATURE = 1
 TOP_P = 1
+CHAT_COMPLETIONS_ENDPOINT = "/chat/completions"
+BATCH_ENDPOINT = "/v1/chat/completions"
+MAX_RATE_LIMITED_RETRY = 20 # Rate limited requests fail over without using up a retry attempt, up to this many times.
+PROMPT_TAG_FILTER = utils.TagFilter(include=("artist", "character", "copyright", "general", "rating"), no_rating_prefix=True)
+SYSTEM_PROMPT = """Describe the given image for a request from the user using the provided tags as ground truth.
+"unknown" tag means the name can't be found, so you shouldn't mention it. If there are conflict between your image view and the tags, adhere to the tags.
+You should include the artist(s), character(s), copyright source(s), and NSFW rating which are specified along the image in your response, for names, you should capitalize first letter to follow grammar rules.
+Don't say the image is anime, illustration, etc., just describe what it has. Because it's assumed that most images are anime, except when the tags specify it's from real life then you should mention it.
+Never use woman or man, the tags always refer to them as girl or boy. If you need to describe a thing, use the words and wording styles from the tags unless necessary.
+You are required to be direct and vulgar when describing NSFW features and actions if the image is NSFW. If the tags contain "sex", it means the character(s) are having sex, and you should mention it.
+If there are multiple characters, when describing their positions, features or poses, never refer to them with their names, use relative positions like to the left of the image, above a certain object, etc..
+You should describe their names separately in a different sentence. If the tags talk about character(s) being a furry, you should mention it.
+Never start your response with "The image depicts...", imagine you are directly telling an image generator so that it generates the image above, but also don't start your response with "Generate an image...".
+For example, lets say if an image has a cat girl doing some things, you should start with "A cat girl with (appearance) doing (things)...", but don't follow this exactly, be creative.
+Your response should be long and detailed, containing background scene description, character position, pose, and more too if there's any, basically include everything the tags have told you.
+Don't use new lines, put your entire response into a single line. Start the description immediately, don't add starter or ending extra texts."""
 
 def process_tags(tags):
     if not tags:
@@ -21,11 +42,12 @@ def process_tags(tags):
     return ", ".join(tag.replace("_", " ") for tag in tags)
 
 async def get_user_prompt(metadata, image_path):
-    artist_tags_text = process_tags(utils.get_tags(metadata, include="artist"))
-    character_tags_text = process_tags(utils.get_tags(metadata, include="character"))
-    copyright_tags_text = process_tags(utils.get_tags(metadata, include="copyright"))
-    general_tags_text = process_tags(utils.get_tags(metadata, include="general"))
-    rating_tag_text = utils.get_tags(metadata, include="rating", no_rating_prefix=True)[0]
+    type_tags_dict = PROMPT_TAG_FILTER.get_type_tags_dict(metadata)
+    artist_tags_text = process_tags(type_tags_dict.get("artist"))
+    character_tags_text = process_tags(type_tags_dict.get("character"))
+    copyright_tags_text = process_tags(type_tags_dict.get("copyright"))
+    general_tags_text = process_tags(type_tags_dict.get("general"))
+    rating_tag_text = type_tags_dict["rating"][0]
 
     mime_type, _ = mimetypes.guess_type(image_path)
     async with aiofiles.open(image_path, "rb") as image_file:
@@ -43,77 +65,374 @@ NSFW Rating: {rating_tag_text}
 \"\"\""""},
     ]}
 
-async def nl_llm_tag(few_shot_examples, image_metadata_path_tuple, session, api_url, api_key, model_name, do_print):
-    metadata = utils.get_metadata(image_metadata_path_tuple[1])
+def get_post_extra_json(model_name):
+    post_extra_json = {}
+    if "gemini-2.5-pro" in model_name:
+        if model_name == "google/gemini-2.5-pro-preview":
+            post_extra_json.update({"provider": {"only": ["Google"]}})
+    else:
+        if MAX_TOKENS is not None:
+            post_extra_json["max_completion_tokens"] = MAX_TOKENS
+        if model_name.startswith("gpt-5"):
+            post_extra_json["reasoning_effort"] = "minimal"
+    return post_extra_json
+
+async def get_messages(few_shot_examples, metadata, image_path):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *few_shot_examples,
+        await get_user_prompt(metadata, image_path),
+    ]
+
+def get_request_json(messages, model_name):
+    return {"model": model_name, "temperature": TEMPERATURE, "top_p": TOP_P, "messages": messages, **get_post_extra_json(model_name)}
+
+def get_finish_reason(response_json):
+    choice = response_json["choices"][0]
+    return (choice.get("native_finish_reason") or choice["finish_reason"]).lower()
+
+def get_nl_desc(response_json, image_path):
+    finish_reason = get_finish_reason(response_json)
+    if finish_reason != "stop":
+        raise RuntimeError(f"Request for \"{image_path}\" finished with reason \"{finish_reason}\"!")
+    return response_json["choices"][0]["message"]["content"]
+
+def get_usage_metrics(response_json):
+    usage = response_json.get("usage") or {}
+    return {"prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens"), "finish_reason": get_finish_reason(response_json)}
+
+def get_response_cache_key(request_json, llm_tag_state):
+    # The user prompt holds both the image content and the tag context.
+    return utils.get_cache_key(request_json["model"], SYSTEM_PROMPT, llm_tag_state.few_shot_key, request_json["messages"][-1])
+
+async def nl_llm_tag(image_id, image_metadata_path_tuple, args, llm_tag_state):
+    request_metrics = {"image_id": image_id, "model": None, "status": "failed", "cache_hit": False, "retries": 0}
+    try:
+        encode_start_time = time.perf_counter()
+        metadata = utils.load_metadata(image_metadata_path_tuple[1])
+        messages = await get_messages(llm_tag_state.few_shot_examples, metadata, image_metadata_path_tuple[0])
+        request_metrics["encode_time"] = time.perf_counter() - encode_start_time
+        # The request is shaped for each model separately, as the endpoints can serve different models.
+        request_json_dict = {}
+        response_cache_key_dict = {}
+        result = None
+        if llm_tag_state.response_cache is not None:
+            for model_name in llm_tag_state.router.get_models():
+                request_json_dict[model_name] = get_request_json(messages, model_name)
+                response_cache_key_dict[model_name] = get_response_cache_key(request_json_dict[model_name], llm_tag_state)
+                result = llm_tag_state.response_cache.get(response_cache_key_dict[model_name])
+                if result is not None:
+                    request_metrics["model"] = model_name
+                    break
+            request_metrics["cache_hit"] = result is not None
+        if result is None:
+            payload_dict = {}
+            endpoint = None
+            i = 1 # 1 indexed.
+            rate_limited_count = 0
+            while True:
+                endpoint = await llm_tag_state.router.acquire(endpoint) # Prefers another endpoint than the one that just failed.
+                payload = payload_dict.get(endpoint.model)
+                if payload is None:
+                    payload = payload_dict[endpoint.model] = utils.dumps_json(request_json_dict.get(endpoint.model) or get_request_json(messages, endpoint.model)).encode("utf8")
+                request_metrics.update(model=endpoint.model, endpoint=endpoint.name, payload_bytes=len(payload))
+                headers = {"Content-Type": "application/json", **(utils.get_auth_headers(endpoint.key) or {})}
+                latency = None
+                error = None
+                try:
+                    request_start_time = time.perf_counter()
+                    async with llm_tag_state.session.post(endpoint.api + CHAT_COMPLETIONS_ENDPOINT, headers=headers, data=payload) as response:
+                        request_metrics["ttfb"] = time.perf_counter() - request_start_time
+                        await utils.check_api_response(response)
+                        j = await response.json()
+                    latency = request_metrics["latency"] = time.perf_counter() - request_start_time
+                except Exception as e:
+                    error = e
+                finally:
+                    llm_tag_state.router.release(endpoint, latency, error) # Also when the task is cancelled, so the endpoint gets its slot back.
+                if error is not None:
+                    if getattr(error, "status", None) == 429 and rate_limited_count < MAX_RATE_LIMITED_RETRY:
+                        rate_limited_count += 1
+                        request_metrics["rate_limited"] = rate_limited_count
+                        continue
+                    if i > MAX_RETRY:
+                        raise RuntimeError(f"All retry attempts failed for \"{image_metadata_path_tuple[0]}\"! Final error {error.__class__.__name__}: {error}") from error
+                    request_metrics["retries"] = i
+                    tqdm.tqdm.write(f"A {error.__class__.__name__} occurred for \"{image_metadata_path_tuple[0]}\" from {endpoint.name}: {error}\nPausing for 0.1 second before retrying attempt {i}/{MAX_RETRY}...")
+                    i += 1
+                    await asyncio.sleep(0.1)
+                    continue
+                break
+            request_metrics.update(get_usage_metrics(j))
+            result = get_nl_desc(j, image_metadata_path_tuple[0])
+            if endpoint.model in response_cache_key_dict:
+                llm_tag_state.response_cache.put(response_cache_key_dict[endpoint.model], result)
+
+        write_start_time = time.perf_counter()
+        metadata.nl_desc = result
+        async with aiofiles.open(image_metadata_path_tuple[1], "w", encoding="utf8") as result_metadata_file:
+            await result_metadata_file.write(utils.dumps_metadata(metadata))
+        request_metrics["write_time"] = time.perf_counter() - write_start_time
+        request_metrics["status"] = "ok"
+    finally:
+        llm_tag_state.metrics.record(request_metrics)
+    if args.print:
+        tqdm.tqdm.write(f"{image_metadata_path_tuple[0]}: {result}")
+
+async def nl_llm_tag_or_queue_retry(image_id, image_metadata_path_tuple, retry_queue, args, llm_tag_state):
+    try:
+        await utils.profile_coroutine("nl_llm_tag", nl_llm_tag(image_id, image_metadata_path_tuple, args, llm_tag_state))
+    except Exception as e:
+        tqdm.tqdm.write(f"Image {image_id} failed and is queued for retry. {e.__class__.__name__}: {e}")
+        retry_queue.append((image_id, image_metadata_path_tuple))
+        llm_tag_state.journal.mark_failed(image_id)
+        return
+    llm_tag_state.journal.mark_done(image_id)
+
+async def run_tasks(image_id_image_metadata_path_tuple_tuple_list, retry_queue, args, llm_tag_state, desc):
+    tasks = []
+    with tqdm.tqdm(total=len(image_id_image_metadata_path_tuple_tuple_list), desc=desc) as pbar:
+        for image_id, image_metadata_path_tuple in image_id_image_metadata_path_tuple_tuple_list:
+            while len(tasks) >= args.concurrency:
+                await asyncio.sleep(0.1)
+                for i in range(len(tasks) - 1, -1, -1):
+                    task = tasks[i]
+                    if task.done():
+                        await task
+                        del tasks[i]
+                        pbar.update(1)
+                pbar.set_postfix_str(llm_tag_state.metrics.get_postfix_text(), refresh=False)
+            tasks.append(asyncio.create_task(nl_llm_tag_or_queue_retry(image_id, image_metadata_path_tuple, retry_queue, args, llm_tag_state)))
+
+        while tasks:
+            await asyncio.sleep(0.1)
+            for i in range(len(tasks) - 1, -1, -1):
+                task = tasks[i]
+                if task.done():
+                    await task
+                    del tasks[i]
+                    pbar.update(1)
+            pbar.set_postfix_str(llm_tag_state.metrics.get_postfix_text(), refresh=False)
+
+def load_pending_batches():
+    if not os.path.isfile(BATCH_STATE_PATH):
+        return []
+    return utils.load_json_file(BATCH_STATE_PATH)
+
+def save_pending_batches(pending_batches):
+    temp_path = BATCH_STATE_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf8") as batch_state_file:
+        batch_state_file.write(utils.dumps_json(pending_batches))
+    os.replace(temp_path, BATCH_STATE_PATH)
+
+async def submit_batch_file(batch_file_path, pending_batches, session, args):
     for i in range(1, MAX_RETRY + 2): # 1 indexed.
         try:
-            post_extra_json = {}
-            if "gemini-2.5-pro" in model_name:
-                if model_name == "google/gemini-2.5-pro-preview":
-                    post_extra_json.update({"provider": {"only": ["Google"]}})
-            else:
-                if MAX_TOKENS is not None:
-                    post_extra_json["max_completion_tokens"] = MAX_TOKENS
-                if model_name.startswith("gpt-5"):
-                    post_extra_json["reasoning_effort"] = "minimal"
-            async with session.post(api_url, headers=None if api_key is None else {"Authorization": "Bearer " + api_key}, json={
-                "model": model_name, "temperature": TEMPERATURE, "top_p": TOP_P,
-                "messages": [
-                    {"role": "system", "content": """Describe the given image for a request from the user using the provided tags as ground truth.
-"unknown" tag means the name can't be found, so you shouldn't mention it. If there are conflict between your image view and the tags, adhere to the tags.
-You should include the artist(s), character(s), copyright source(s), and NSFW rating which are specified along the image in your response, for names, you should capitalize first letter to follow grammar rules.
-Don't say the image is anime, illustration, etc., just describe what it has. Because it's assumed that most images are anime, except when the tags specify it's from real life then you should mention it.
-Never use woman or man, the tags always refer to them as girl or boy. If you need to describe a thing, use the words and wording styles from the tags unless necessary.
-You are required to be direct and vulgar when describing NSFW features and actions if the image is NSFW. If the tags contain "sex", it means the character(s) are having sex, and you should mention it.
-If there are multiple characters, when describing their positions, features or poses, never refer to them with their names, use relative positions like to the left of the image, above a certain object, etc..
-You should describe their names separately in a different sentence. If the tags talk about character(s) being a furry, you should mention it.
-Never start your response with "The image depicts...", imagine you are directly telling an image generator so that it generates the image above, but also don't start your response with "Generate an image...".
-For example, lets say if an image has a cat girl doing some things, you should start with "A cat girl with (appearance) doing (things)...", but don't follow this exactly, be creative.
-Your response should be long and detailed, containing background scene description, character position, pose, and more too if there's any, basically include everything the tags have told you.
-Don't use new lines, put your entire response into a single line. Start the description immediately, don't add starter or ending extra texts."""},
-                    *few_shot_examples,
-                    await get_user_prompt(metadata, image_metadata_path_tuple[0]),
-                ],
-                **post_extra_json
-            }) as response:
-                if response.status < 200 or response.status >= 300:
-                    raise RuntimeError(f"API responded status code {response.status}, raw response: {await response.text()}")
-                j = await response.json()
+            input_file_id = await utils.upload_batch_file(session, args.api, args.key, batch_file_path)
+            batch = await utils.create_batch(session, args.api, args.key, input_file_id, BATCH_ENDPOINT)
             break
         except Exception as e:
             if i > MAX_RETRY:
-                raise RuntimeError(f"All retry attempts failed for \"{image_metadata_path_tuple[0]}\"! Final error {e.__class__.__name__}: {e}") from e
-            tqdm.tqdm.write(f"A {e.__class__.__name__} occurred for \"{image_metadata_path_tuple[0]}\": {e}\nPausing for 0.1 second before retrying attempt {i}/{MAX_RETRY}...")
-            await asyncio.sleep(0.1)
+                raise RuntimeError(f"All retry attempts failed for submitting \"{batch_file_path}\"! Final error {e.__class__.__name__}: {e}") from e
+            tqdm.tqdm.write(f"A {e.__class__.__name__} occurred for submitting \"{batch_file_path}\": {e}\nPausing for 1 second before retrying attempt {i}/{MAX_RETRY}...")
+            await asyncio.sleep(1)
+    pending_batches.append({"batch_id": batch["id"], "input_path": batch_file_path})
+    save_pending_batches(pending_batches)
+    tqdm.tqdm.write(f"Submitted batch {batch['id']} from \"{batch_file_path}\".")
 
-    choice = j["choices"][0]
-    # tqdm.tqdm.write(f"Request for image \"{image_metadata_path_tuple[0]}\" token usage (input -> output): {j["usage"]["prompt_tokens"]} -> {j["usage"]["completion_tokens"]}")
-    finish_reason = (choice.get("native_finish_reason") or choice["finish_reason"]).lower()
-    if finish_reason != "stop":
-        raise RuntimeError(f"Request for \"{image_metadata_path_tuple[0]}\" finished with reason \"{finish_reason}\"!")
-    result = choice["message"]["content"]
-    metadata["nl_desc"] = result
-    async with aiofiles.open(image_metadata_path_tuple[1], "w", encoding="utf8") as result_metadata_file:
-        await result_metadata_file.write(json.dumps(metadata, ensure_ascii=False, separators=(",", ":")))
-    if do_print:
-        tqdm.tqdm.write(f"{image_metadata_path_tuple[0]}: {result}")
+def write_nl_desc(metadata_path, result, metadata=None):
+    if metadata is None:
+        metadata = utils.load_metadata(metadata_path)
+    metadata.nl_desc = result
+    with open(metadata_path, "w", encoding="utf8") as result_metadata_file:
+        result_metadata_file.write(utils.dumps_metadata(metadata))
+
+async def build_and_submit_batches(image_id_image_metadata_path_tuple_tuple_list, pending_batches, args, llm_tag_state):
+    batch_file = None
+    batch_max_bytes = args.batch_max_mb * 1024 * 1024
+    for image_id, image_metadata_path_tuple in tqdm.tqdm(image_id_image_metadata_path_tuple_tuple_list, desc="Building batches"):
+        metadata = utils.load_metadata(image_metadata_path_tuple[1])
+        request_json = get_request_json(await get_messages(llm_tag_state.few_shot_examples, metadata, image_metadata_path_tuple[0]), args.model)
+        response_cache_key = "-"
+        if llm_tag_state.response_cache is not None:
+            response_cache_key = get_response_cache_key(request_json, llm_tag_state)
+            result = llm_tag_state.response_cache.get(response_cache_key)
+            if result is not None:
+                write_nl_desc(image_metadata_path_tuple[1], result, metadata)
+                llm_tag_state.metrics.record({"image_id": image_id, "model": args.model, "status": "ok", "cache_hit": True, "retries": 0})
+                llm_tag_state.journal.mark_done(image_id)
+                continue
+        line = (utils.dumps_json({"custom_id": image_id, "method": "POST", "url": BATCH_ENDPOINT, "body": request_json}) + "\n").encode("utf8")
+        if batch_file is not None and (batch_file_size + len(line) > batch_max_bytes or batch_request_count >= args.batch_max_requests):
+            batch_file.close()
+            batch_ids_file.close()
+            await submit_batch_file(batch_file_path, pending_batches, llm_tag_state.session, args)
+            batch_file = None
+        if batch_file is None:
+            batch_file_path = os.path.join(BATCH_DIR, f"batch_{int(time.time())}_{len(pending_batches)}.jsonl")
+            batch_file = open(batch_file_path, "wb")
+            # The custom IDs are kept in a sidecar file so merging doesn't need to parse the big input file again.
+            batch_ids_file = open(os.path.splitext(batch_file_path)[0] + ".ids", "w", encoding="utf8")
+            batch_file_size = 0
+            batch_request_count = 0
+        batch_file.write(line)
+        batch_ids_file.write(f"{image_id} {response_cache_key}\n")
+        batch_file_size += len(line)
+        batch_request_count += 1
+    if batch_file is not None:
+        batch_file.close()
+        batch_ids_file.close()
+        await submit_batch_file(batch_file_path, pending_batches, llm_tag_state.session, args)
+
+def merge_batch_result(image_metadata_path_tuple, response_json):
+    result = get_nl_desc(response_json, image_metadata_path_tuple[0])
+    write_nl_desc(image_metadata_path_tuple[1], result)
+    return result
+
+async def wait_for_merge(image_id, future):
+    # Pairs the result with its image ID, as asyncio.as_completed doesn't give back the futures it was given.
+    try:
+        return image_id, await asyncio.wrap_future(future), None
+    except Exception as e:
+        return image_id, None, e
+
+async def merge_batch(pending_batch, pending_batches, image_id_image_metadata_path_tuple_dict, retry_queue, thread_pool, args, llm_tag_state):
+    batch_id = pending_batch["batch_id"]
+    batch = await utils.wait_for_batch(llm_tag_state.session, args.api, args.key, batch_id, args.batch_poll_interval)
+    batch_ids_path = os.path.splitext(pending_batch["input_path"])[0] + ".ids"
+    with open(batch_ids_path, "r", encoding="utf8") as batch_ids_file:
+        image_id_response_cache_key_dict = dict(line.split() for line in batch_ids_file if line.strip())
+    remaining_image_ids = set(image_id_response_cache_key_dict)
+    usage_metrics_dict = {}
+    futures = {}
+    output_file_id = batch.get("output_file_id")
+    if output_file_id:
+        async for line in utils.iter_file_jsonl(llm_tag_state.session, args.api, args.key, output_file_id):
+            image_id = line.get("custom_id")
+            image_metadata_path_tuple = image_id_image_metadata_path_tuple_dict.get(image_id)
+            response = line.get("response")
+            if image_metadata_path_tuple is None or image_id not in remaining_image_ids or line.get("error") or not response or response.get("status_code") != 200:
+                continue
+            remaining_image_ids.remove(image_id)
+            try:
+                usage_metrics_dict[image_id] = get_usage_metrics(response["body"])
+            except Exception:
+                usage_metrics_dict[image_id] = {}
+            futures[thread_pool.submit(utils.profile_call, "merge_batch_result", merge_batch_result, image_metadata_path_tuple, response["body"])] = image_id
+    done_count = 0
+    # Awaited so the event loop keeps polling the other batches while this one merges.
+    for merge in asyncio.as_completed([wait_for_merge(image_id, future) for future, image_id in futures.items()]):
+        image_id, result, e = await merge
+        if e is not None:
+            tqdm.tqdm.write(f"Image {image_id} failed and is queued for retry. {e.__class__.__name__}: {e}")
+            remaining_image_ids.add(image_id)
+            continue
+        llm_tag_state.metrics.record({"image_id": image_id, "model": args.model, "status": "ok", "cache_hit": False, "retries": 0, "batch_id": batch_id, **usage_metrics_dict[image_id]})
+        llm_tag_state.journal.mark_done(image_id)
+        response_cache_key = image_id_response_cache_key_dict[image_id]
+        if llm_tag_state.response_cache is not None and response_cache_key != "-":
+            llm_tag_state.response_cache.put(response_cache_key, result)
+        done_count += 1
+        if args.print:
+            tqdm.tqdm.write(f"{image_id_image_metadata_path_tuple_dict[image_id][0]}: {result}")
+    for image_id in remaining_image_ids:
+        image_metadata_path_tuple = image_id_image_metadata_path_tuple_dict.get(image_id)
+        if image_metadata_path_tuple is not None:
+            retry_queue.append((image_id, image_metadata_path_tuple))
+        llm_tag_state.journal.mark_failed(image_id)
+    print(f"Batch {batch_id} ended with status \"{batch['status']}\", merged {done_count} results, {len(remaining_image_ids)} images failed.")
+    pending_batches.remove(pending_batch)
+    save_pending_batches(pending_batches)
+    for path in (pending_batch["input_path"], batch_ids_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+async def run_batches(image_id_image_metadata_path_tuple_tuple_list, image_id_image_metadata_path_tuple_dict, retry_queue, args, llm_tag_state):
+    pending_batches = load_pending_batches()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as thread_pool:
+        if pending_batches:
+            print(f"Found {len(pending_batches)} pending batches from the last run, merging them first...")
+            await asyncio.gather(*(merge_batch(
+                pending_batch, pending_batches, image_id_image_metadata_path_tuple_dict, retry_queue, thread_pool, args, llm_tag_state
+            ) for pending_batch in list(pending_batches)))
+            skip_image_ids = llm_tag_state.journal.done_image_ids | {e[0] for e in retry_queue}
+            image_id_image_metadata_path_tuple_tuple_list = [e for e in image_id_image_metadata_path_tuple_tuple_list if e[0] not in skip_image_ids]
+        await build_and_submit_batches(image_id_image_metadata_path_tuple_tuple_list, pending_batches, args, llm_tag_state)
+        print(f"Waiting for {len(pending_batches)} batches to finish...")
+        await asyncio.gather(*(merge_batch(
+            pending_batch, pending_batches, image_id_image_metadata_path_tuple_dict, retry_queue, thread_pool, args, llm_tag_state
+        ) for pending_batch in list(pending_batches)))
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Tag images with natural language using a LLM.")
     parser.add_argument("-a", "--api", default="https://api.openai.com/v1", help="OpenAI compatible API URL prefix, default to https://api.openai.com/v1")
     parser.add_argument("-k", "--key", help="API key for the API")
     parser.add_argument("-m", "--model", default="gpt-5", help="Model name to use, default to gpt-5")
-    parser.add_argument("-c", "--concurrency", type=int, default=MAX_TASKS, help=f"Max concurrent requests, default to {MAX_TASKS}")
+    parser.add_argument("-E", "--endpoints", help="Path to a JSON list of endpoints to spread the requests over instead of --api, --key and --model, each like {\"api\": ..., \"model\": ..., \"key\" or \"key_env\": ..., \"concurrency\": ..., \"rate_limit\": requests per second, \"weight\": ...}, rate limited or failing endpoints are backed off from and their requests fail over to the others, not supported in batch mode")
+    parser.add_argument("--routing", choices=utils.ROUTING_STRATEGIES, default="weighted", help="How to pick an endpoint with free capacity, weighted picks randomly by weight, least_latency picks the one with the lowest recent latency, default to weighted")
+    parser.add_argument("--transport", choices=utils.TRANSPORTS, default="aiohttp", help="HTTP client to request the API with, \"http2\" multiplexes the requests over a few HTTP/2 connections instead of opening one per request, it needs httpx[http2] and speaks HTTP/2 with prior knowledge to plain HTTP URLs, default to aiohttp")
+    parser.add_argument("-c", "--concurrency", type=int, help=f"Max concurrent requests, default to the sum of the endpoints' concurrency with --endpoints, otherwise {MAX_TASKS}")
     parser.add_argument("-p", "--print", action="store_true", help="Print the response if set")
+    parser.add_argument("-r", "--resume", action="store_true", help=f"If set, will skip images already done according to the progress journal \"{JOURNAL_PATH}\" or whose metadata already has a natural language description")
+    parser.add_argument("-R", "--retry-rounds", type=int, default=1, help="How many extra rounds to run over the images that failed, default to 1")
+    parser.add_argument("--id-list", help="Only tag the images whose IDs are in this file, one per line, e.g. made by query_tags.py, default to all images")
+    parser.add_argument("-b", "--batch", action="store_true", help="If set, will use the batch API instead of a request per image, batches which are still pending from the last run are merged first")
+    parser.add_argument("--batch-max-mb", type=int, default=200, help="Max size of each batch input file in MiB, default to 200")
+    parser.add_argument("--batch-max-requests", type=int, default=50000, help="Max requests in each batch input file, default to 50000")
+    parser.add_argument("--batch-poll-interval", type=float, default=60, help="Seconds between polling the status of submitted batches, default to 60")
+    parser.add_argument("--cache", help="Path to a SQLite response cache, responses are reused when the model, prompts, few shot examples, image content and tags are unchanged, default to no cache")
+    parser.add_argument("--cache-max-mb", type=int, default=1024, help="Max size of the response cache in MiB before evicting the least recently used responses, default to 1024")
+    parser.add_argument("--metrics-path", help="Append per request metrics (tokens, latency, payload size, retries, finish reason) to this JSONL file, default to not saving them")
+    utils.add_profile_args(parser)
     args = parser.parse_args()
-    args.api += "/chat/completions"
-    if args.concurrency < 1:
+    if args.concurrency is not None and args.concurrency < 1:
         print("Max concurrent requests must be positive!")
         sys.exit(1)
+    if args.transport not in utils.get_available_transports():
+        print("You need to pip install httpx[http2] to use the HTTP/2 transport!")
+        sys.exit(1)
+    if args.transport != "aiohttp" and args.batch:
+        print("The batch file uploads need the aiohttp transport!")
+        sys.exit(1)
+    if args.endpoints is not None:
+        if args.batch:
+            print("Endpoints can't be used in batch mode, use --api, --key and --model instead!")
+            sys.exit(1)
+        try:
+            args.endpoint_list = utils.load_endpoints(args.endpoints, MAX_TASKS)
+        except (OSError, ValueError) as e:
+            print(f"Failed to load the endpoints from \"{args.endpoints}\": {e}")
+            sys.exit(1)
+        if not args.endpoint_list:
+            print("You need at least 1 endpoint!")
+            sys.exit(1)
+    else:
+        args.endpoint_list = [utils.Endpoint(args.api, args.model, args.key, args.concurrency or MAX_TASKS)]
+    if args.concurrency is None:
+        args.concurrency = sum(endpoint.concurrency for endpoint in args.endpoint_list)
+    if args.retry_rounds < 0:
+        print("Retry rounds must be greater than or equal to 0!")
+        sys.exit(1)
+    if args.batch_max_mb < 1 or args.batch_max_requests < 1:
+        print("Batch max size and max requests must be positive!")
+        sys.exit(1)
+    if args.batch_poll_interval <= 0:
+        print("Batch poll interval must be positive!")
+        sys.exit(1)
+    if args.cache_max_mb < 1:
+        print("Response cache max size must be positive!")
+        sys.exit(1)
+    if args.id_list is not None and not os.path.isfile(args.id_list):
+        print(f"Your ID list \"{args.id_list}\" doesn't exist or isn't a file!")
+        sys.exit(1)
     return args
 
 async def main():
     args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    utils.set_transport(args.transport)
     print("Starting...\nGetting few shot examples...")
     try:
         few_shot_examples_dict = utils.get_image_id_image_metadata_path_tuple_dict(FEW_SHOT_EXAMPLES_PATH)
@@ -121,36 +440,60 @@ async def main():
         few_shot_examples_dict = {}
     few_shot_examples = []
     for few_shot_image_path, few_shot_metadata_path in few_shot_examples_dict.values():
-        few_shot_metadata = utils.get_metadata(few_shot_metadata_path)
+        few_shot_metadata = utils.load_metadata(few_shot_metadata_path)
         few_shot_examples.append(await get_user_prompt(few_shot_metadata, few_shot_image_path))
-        few_shot_examples.append({"role": "assistant", "content": few_shot_metadata["nl_desc"]})
+        few_shot_examples.append({"role": "assistant", "content": few_shot_metadata.nl_desc})
     print("Got", len(few_shot_examples_dict), "few shot examples.\nGetting paths...")
-    image_id_image_metadata_path_tuple_dict = utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR)
-    image_count = len(image_id_image_metadata_path_tuple_dict)
-    print("Got", image_count, "images.")
+    image_id_image_metadata_path_tuple_dict = utils.filter_image_id_dict(utils.get_image_id_image_metadata_path_tuple_dict(IMAGE_DIR), args.id_list)
+    print("Got", len(image_id_image_metadata_path_tuple_dict), "images.")
 
-    tasks = []
-    async with utils.get_session(0) as session:
-        with tqdm.tqdm(total=image_count, desc="Requesting") as pbar:
-            for image_metadata_path_tuple in image_id_image_metadata_path_tuple_dict.values():
-                while len(tasks) >= args.concurrency:
-                    await asyncio.sleep(0.1)
-                    for i in range(len(tasks) - 1, -1, -1):
-                        task = tasks[i]
-                        if task.done():
-                            await task
-                            del tasks[i]
-                            pbar.update(1)
-                tasks.append(asyncio.create_task(nl_llm_tag(few_shot_examples, image_metadata_path_tuple, session, args.api, args.key, args.model, args.print)))
-
-            while tasks:
-                await asyncio.sleep(0.1)
-                for i in range(len(tasks) - 1, -1, -1):
-                    task = tasks[i]
-                    if task.done():
-                        await task
-                        del tasks[i]
-                        pbar.update(1)
+    with utils.ProgressJournal(JOURNAL_PATH, args.resume) as journal:
+        if args.resume:
+            print("Skipping finished images...")
+            image_id_image_metadata_path_tuple_tuple_list = []
+            for image_id, image_metadata_path_tuple in image_id_image_metadata_path_tuple_dict.items():
+                if journal.is_done(image_id):
+                    continue
+                if image_id not in journal.failed_image_ids and utils.has_nl_desc(image_metadata_path_tuple[1]):
+                    continue
+                image_id_image_metadata_path_tuple_tuple_list.append((image_id, image_metadata_path_tuple))
+            print("Skipped", len(image_id_image_metadata_path_tuple_dict) - len(image_id_image_metadata_path_tuple_tuple_list), "finished images.")
+        else:
+            image_id_image_metadata_path_tuple_tuple_list = list(image_id_image_metadata_path_tuple_dict.items())
+
+        response_cache = utils.ResponseCache(args.cache, args.cache_max_mb * 1024 * 1024) if args.cache is not None else None
+        few_shot_key = utils.get_cache_key(few_shot_examples) if response_cache is not None else None
+        async with utils.get_session(0) as session:
+            llm_tag_state = utils.LLMTagState(
+                session, journal, few_shot_examples, few_shot_key, response_cache,
+                utils.LLMTagMetrics(utils.JsonlSink(args.metrics_path) if args.metrics_path is not None else None), utils.EndpointRouter(args.endpoint_list, args.routing),
+            )
+            retry_queue = []
+            if args.batch:
+                os.makedirs(BATCH_DIR, exist_ok=True)
+                await run_batches(image_id_image_metadata_path_tuple_tuple_list, image_id_image_metadata_path_tuple_dict, retry_queue, args, llm_tag_state)
+            else:
+                await run_tasks(image_id_image_metadata_path_tuple_tuple_list, retry_queue, args, llm_tag_state, "Requesting")
+            for retry_round in range(1, args.retry_rounds + 1):
+                if not retry_queue:
+                    break
+                image_id_image_metadata_path_tuple_tuple_list, retry_queue = retry_queue, []
+                print(f"Retrying {len(image_id_image_metadata_path_tuple_tuple_list)} failed images, round {retry_round}/{args.retry_rounds}...")
+                if args.batch:
+                    await run_batches(image_id_image_metadata_path_tuple_tuple_list, image_id_image_metadata_path_tuple_dict, retry_queue, args, llm_tag_state)
+                else:
+                    await run_tasks(image_id_image_metadata_path_tuple_tuple_list, retry_queue, args, llm_tag_state, f"Retrying {retry_round}/{args.retry_rounds}")
+        print("Request stats:", llm_tag_state.metrics.get_summary_text())
+        if args.endpoints is not None:
+            print("Endpoint stats:", llm_tag_state.router.get_summary_text())
+        llm_tag_state.metrics.close()
+        if response_cache is not None:
+            print("Response cache stats:", response_cache.get_stats_text())
+            response_cache.close()
+    if retry_queue:
+        print(f"{len(retry_queue)} images still failed, you can run again with --resume to retry them.")
+    else:
+        print("Finished.")
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,60 @@
+import sys
+import time
+import utils
+import argparse
+from constants import *
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=f"Search the scraped images with booru search syntax using the tag index in \"{TAG_INDEX_DIR}\" made by make_tag_index.py.")
+    parser.add_argument("-o", "--output", help="Write the matching image IDs to this file, one per line, for the --id-list argument of the other tools, default to printing them")
+    parser.add_argument("-n", "--limit", type=int, help="Only keep the first matching images in the sort order, default to all")
+    parser.add_argument("-c", "--count", action="store_true", help="If set, will only print the amount of matching images")
+    parser.add_argument("tags_to_search", nargs=argparse.REMAINDER, help="Tags to search for, supports -tag, ~tag, rating:, id: and score: filters and sort:id or sort:score, after every option and a \"--\" if the first one is a -tag, default to all")
+    utils.add_profile_args(parser)
+    args = parser.parse_args()
+    if args.tags_to_search[:1] == ["--"]: # Lets the first tag be a -tag.
+        del args.tags_to_search[0]
+    if any(tag.startswith("--") for tag in args.tags_to_search):
+        print("Options must come before the tags to search, everything after the first tag is taken as a tag!")
+        sys.exit(1)
+    if args.limit is not None and args.limit < 1:
+        print("Limit must be positive!")
+        sys.exit(1)
+    try:
+        import numpy
+    except ImportError:
+        print("You need to pip install numpy to query the tag index!")
+        sys.exit(1)
+    return args
+
+def main():
+    args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    try:
+        search_tags = utils.SearchTags(args.tags_to_search)
+    except (ValueError, NotImplementedError) as e:
+        print(e)
+        sys.exit(1)
+    tag_index = utils.load_tag_index(TAG_INDEX_DIR)
+    if tag_index is None:
+        print(f"No tag index found in \"{TAG_INDEX_DIR}\", please run make_tag_index.py first!")
+        sys.exit(1)
+    start_time = time.perf_counter()
+    image_ids = tag_index.query(search_tags, args.limit)
+    used_time = time.perf_counter() - start_time
+    # Status goes to stderr so the printed IDs can be piped.
+    print(f"Got {len(image_ids)} of {len(tag_index)} images in {used_time * 1000:.1f}ms.", file=sys.stderr)
+    if args.count:
+        return
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf8") as output_file:
+            output_file.writelines(f"{image_id}\n" for image_id in image_ids.tolist())
+    else:
+        sys.stdout.writelines(f"{image_id}\n" for image_id in image_ids.tolist())
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
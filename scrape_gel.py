@@ -2,15 +2,47 @@ import os
 import re
 import sys
 import time
-import json
 import utils
+import socket
 import asyncio
 import argparse
 import concurrent
 from constants import *
-from bs4 import BeautifulSoup
 
 IMAGE_ID_PATTERN = re.compile(r"id=(\d+)")
+THUMBNAIL_SCORE_PATTERN = re.compile(r"(?:^|\s)score:(-?\d+)(?:\s|$)")
+
+def get_soup(html):
+    from bs4 import BeautifulSoup # Imported here so the command line starts fast.
+    return BeautifulSoup(html, "html.parser")
+
+def get_thumbnail_posts(thumbnails_div):
+    # List of (Image URL, Image ID, Image score or None if the thumbnail doesn't show it), the listing page has enough for the keyset cursor.
+    thumbnail_posts = []
+    for a in thumbnails_div.find_all("a"):
+        image_url = a["href"]
+        img = a.find("img")
+        score_match = THUMBNAIL_SCORE_PATTERN.search(img.get("title", "")) if img is not None else None
+        thumbnail_posts.append((image_url, IMAGE_ID_PATTERN.search(image_url).group(1), int(score_match.group(1)) if score_match is not None else None))
+    return thumbnail_posts
+
+def get_image_score(soup, image_id):
+    score_span = soup.find("span", id="psc" + image_id)
+    try:
+        return int(score_span.contents[0])
+    except (AttributeError, IndexError, ValueError) as e:
+        raise RuntimeError("Error while getting the image score: " + str(e)) from e
+
+async def get_post_score(session, image_url, image_id):
+    # Score from the post page for when the thumbnail title doesn't show it, None if the post page doesn't either.
+    async with session.get(image_url) as response:
+        utils.check_status(response)
+        html = await response.text()
+    try:
+        return get_image_score(get_soup(html), image_id)
+    except RuntimeError as e:
+        print(f"Image {image_id}: {e}")
+        return None
 
 def get_type_tags_dict(soup):
     tag_ul = soup.find("ul", id="tag-list")
@@ -39,117 +71,140 @@ def get_type_tags_dict(soup):
 
 async def process_link(scrape_args, scrape_state):
     image_id = IMAGE_ID_PATTERN.search(scrape_args.target).group(1)
-    scrape_state.last_reached_image_id = image_id
-    image_id_already_exists = image_id in scrape_state.existing_image_ids
-    if image_id_already_exists and not image_id.endswith("99"):
+    if image_id in scrape_state.existing_image_ids:
         # print(f"Image {image_id} already exists, skipped.")
+        scrape_state.metrics.count_skip("exists")
         return
     scrape_state.existing_image_ids.add(image_id)
     error = None
+    # Results of the finished stages are kept across retry attempts, so a retry only redoes the stage that failed.
+    metadata = None
+    image_download = None
+    quota_tag_ids = None
     for i in range(1, MAX_RETRY + 2): # 1 indexed.
         try:
             if utils.get_sigint_count() >= 1 or isinstance(scrape_args.max_scrape_count, int) and scrape_state.scraped_image_count >= scrape_args.max_scrape_count:
                 break
-            # print(f"Processing image {image_id}...")
-            query_start_time = time.time()
-            async with scrape_state.session.get(scrape_args.target) as response:
-                html = await response.text()
-            query_used_time = time.time() - query_start_time
-            soup = BeautifulSoup(html, "html.parser")
-
-            video_container = soup.find("video", id="gelcomVideoPlayer")
-            if video_container:
-                print(f"Image {image_id} is a video, skipped.")
-                return
-            image_container = soup.find("section", class_=["image-container", "note-container"])
-            if not image_container:
-                raise RuntimeError("No image container found.")
+            if metadata is None:
+                # print(f"Processing image {image_id}...")
+                query_start_time = time.perf_counter()
+                async with scrape_state.session.get(scrape_args.target) as response:
+                    utils.check_status(response)
+                    html = await response.text()
+                scrape_state.metrics.observe("query", time.perf_counter() - query_start_time)
+                soup = get_soup(html)
 
-            score_span = soup.find("span", id="psc" + image_id)
-            try:
-                image_score = int(score_span.contents[0])
-            except (AttributeError, IndexError, ValueError) as e:
-                raise RuntimeError("Error while getting the image score: " + str(e)) from e
-            scrape_state.last_reached_image_score = image_score
-            if image_id_already_exists:
-                # print(f"Image {image_id} already exists, skipped.")
-                return
+                video_container = soup.find("video", id="gelcomVideoPlayer")
+                if video_container:
+                    print(f"Image {image_id} is a video, skipped.")
+                    scrape_state.metrics.count_skip("video")
+                    return
+                image_container = soup.find("section", class_=["image-container", "note-container"])
+                if not image_container:
+                    raise RuntimeError("No image container found.")
 
-            if not scrape_args.use_low_quality:
-                image_download_url = soup.find("a", string="Original image")["href"]
-            else:
-                image_download_url = image_container.find("img", id="image")["src"]
+                image_score = get_image_score(soup, image_id)
 
-            image_ext = os.path.splitext(image_download_url)[1].lower()
-            if image_ext not in IMAGE_EXT:
-                print(f"Image {image_id} is not an image, skipped.")
-                return
+                if not scrape_args.use_low_quality:
+                    image_download_url = soup.find("a", string="Original image")["href"]
+                else:
+                    image_download_url = image_container.find("img", id="image")["src"]
 
-            type_tags_dict, tag_count = get_type_tags_dict(soup)
-            if tag_count < scrape_args.min_tags:
-                # print(f"Image {image_id} doesn't have enough tags({tag_count} < {scrape_args.min_tags}), skipped.")
-                return
+                image_ext = os.path.splitext(image_download_url)[1].lower()
+                if image_ext not in IMAGE_EXT:
+                    print(f"Image {image_id} is not an image, skipped.")
+                    scrape_state.metrics.count_skip("not_image")
+                    return
 
-            rating = image_container.get("data-rating")
-            if not rating:
-                raise RuntimeError("No rating found.")
-            if rating == "safe":
-                rating = "general"
+                type_tags_dict, tag_count = get_type_tags_dict(soup)
+                if tag_count < scrape_args.min_tags:
+                    # print(f"Image {image_id} doesn't have enough tags({tag_count} < {scrape_args.min_tags}), skipped.")
+                    scrape_state.metrics.count_skip("min_tags")
+                    return
 
-            metadata = json.dumps({"image_id": image_id, "score": image_score, "rating": rating, "tags": type_tags_dict}, ensure_ascii=False, separators=(",", ":"))
+                rating = image_container.get("data-rating")
+                if not rating:
+                    raise RuntimeError("No rating found.")
+                if rating == "safe":
+                    rating = "general"
 
-            image_path = os.path.join(IMAGE_DIR, image_id + image_ext)
-            metadata_path = os.path.join(IMAGE_DIR, image_id + ".json")
+                image_path = os.path.join(scrape_state.image_dir, image_id + image_ext)
+                metadata_path = os.path.join(scrape_state.image_dir, image_id + ".json")
+                image_download = utils.PartialDownload(image_download_url)
+                metadata = utils.Metadata(image_id, image_score, rating, type_tags_dict)
+                if scrape_state.tag_quota is not None:
+                    quota_tag_ids = scrape_state.tag_quota.reserve(metadata)
+                    if quota_tag_ids is None:
+                        # print(f"Image {image_id} only has tags whose buckets are full, skipped.")
+                        scrape_state.metrics.count_skip("quota_full")
+                        return
 
-            download_start_time = time.time()
-            async with scrape_state.session.get(image_download_url) as img_response:
-                img_data = await img_response.read()
-            download_used_time = time.time() - download_start_time
+            download_start_time = time.perf_counter()
+            received_size = len(image_download.data)
+            try:
+                img_data = await image_download.read(scrape_state.session)
+            finally:
+                scrape_state.metrics.add_bytes(max(len(image_download.data) - received_size, 0))
+            scrape_state.metrics.observe("download", time.perf_counter() - download_start_time)
 
-            if not await utils.submit_validation(scrape_state.thread_pool, img_data, metadata, image_path, metadata_path, scrape_args.width, scrape_args.height, scrape_args.convert_to_avif):
+            if not await utils.submit_validation(scrape_state.thread_pool, img_data, metadata, image_path, metadata_path, scrape_args.width, scrape_args.height, scrape_args.convert_to_avif, scrape_state.metrics, scrape_state.metadata_writer, scrape_args.bucket_area, scrape_args.bucket_mode, scrape_state.post_stages):
+                scrape_state.metrics.count_skip("invalid_image")
+                if quota_tag_ids is not None:
+                    scrape_state.tag_quota.release(quota_tag_ids)
                 return
             scrape_state.scraped_image_count += 1
-            total_query_time = scrape_state.avg_query_time[0] * scrape_state.avg_query_time[1] + query_used_time
-            total_download_time = scrape_state.avg_download_time[0] * scrape_state.avg_download_time[1] + download_used_time
-            scrape_state.avg_query_time[1] += 1
-            scrape_state.avg_download_time[1] += 1
-            scrape_state.avg_query_time[0] = total_query_time / scrape_state.avg_query_time[1]
-            scrape_state.avg_download_time[0] = total_download_time / scrape_state.avg_download_time[1]
-            interval = 1000
-            if scrape_state.scraped_image_count % interval != 0:
-                return
-            print(
-                f"Scraped {scrape_state.scraped_image_count}/{scrape_args.max_scrape_count} images,",
-                f"stats for the last {interval} images: [Average query time: {scrape_state.avg_query_time[0]:.3f}s | Average download time: {scrape_state.avg_download_time[0]:.3f}s]",
-            )
-            scrape_state.avg_query_time = [0.0, 0]
-            scrape_state.avg_download_time = [0.0, 0]
+            if scrape_state.metrics.should_export(scrape_state.scraped_image_count):
+                scrape_state.metrics.export(scrape_state.scraped_image_count, scrape_args.max_scrape_count)
             return
         except Exception as e:
             error = e
-            if i > MAX_RETRY:
+            scrape_state.metrics.count_error(e)
+            if i > MAX_RETRY or not utils.is_retryable_error(e):
                 break
+            scrape_state.metrics.count_retry()
             # print(f"A {e.__class__.__name__} occurred with image {image_id}: {e}\nPausing for 0.1 second before retrying attempt {i}/{MAX_RETRY}...")
             await asyncio.sleep(0.1)
-    if not image_id_already_exists:
-        scrape_state.existing_image_ids.remove(image_id)
-    if error is not None:
-        print(f"All retry attempts failed, image {image_id} skipped. Final error {error.__class__.__name__}: {error}")
-    else:
+    scrape_state.existing_image_ids.remove(image_id)
+    if quota_tag_ids is not None:
+        scrape_state.tag_quota.release(quota_tag_ids)
+    if error is None:
         print(f"Task for image {image_id} cancelled.")
+    elif not utils.is_retryable_error(error):
+        print(f"Image {image_id} skipped because of a permanent error {error.__class__.__name__}: {error}")
+    else:
+        print(f"All retry attempts failed, image {image_id} skipped. Final error {error.__class__.__name__}: {error}")
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Scrape images from Gelbooru.")
     parser.add_argument("-s", "--site", default="https://gelbooru.com", help="Domain to scrape from, default to https://gelbooru.com")
     parser.add_argument("-W", "--width", type=int, help="Scale the width of the image to the specified value, must either provide both width and height or not provide both")
     parser.add_argument("-H", "--height", type=int, help="Scale the height of the image to the specified value, must either provide both width and height or not provide both")
+    parser.add_argument("-b", "--bucket-area", type=int, help="Resize the image to the nearest aspect ratio bucket with about this many pixels instead of an exact size, e.g. 1048576 for 1024x1024, can't be used with width and height")
+    parser.add_argument("--bucket-mode", choices=utils.BUCKET_MODES, default="crop", help="Whether to crop or pad the image to fit its bucket, default to crop")
     parser.add_argument("-a", "--avif", action="store_true", help="If set, will convert the image into avif, need to have pillow-avif-plugin installed")
     parser.add_argument("-l", "--low-quality", action="store_true", help="If set, will download the sample instead of the original image")
+    parser.add_argument("--transport", choices=utils.TRANSPORTS, default="aiohttp", help="HTTP client to scrape with, \"http2\" multiplexes the requests over a few HTTP/2 connections instead of opening one per request, it needs httpx[http2] and speaks HTTP/2 with prior knowledge to plain HTTP URLs, default to aiohttp")
     parser.add_argument("-t", "--min-tags", type=int, default=0, help="Filter out images with less than the specified amount of tags, default to 0")
     parser.add_argument("-m", "--max-scrape-count", type=int, help="Stop after scraping the set amount of images, may not be exact because of the asynchronous nature of this script, default to infinite")
     parser.add_argument("-c", "--continuous-scraping", action="store_true", help="If set, will scraping continuously even when reaching the 20000 images Gelbooru search depth cap by adjusting search tags")
-    parser.add_argument("tags_to_search", nargs=argparse.REMAINDER, help="List of tags to search for, default to all")
+    parser.add_argument("--metrics-interval", type=int, default=1000, help="Print the scrape stats every time this amount of images are scraped, default to 1000")
+    parser.add_argument("--metrics-path", help="Also append the scrape stats to this JSONL file, default to not saving them")
+    parser.add_argument("--prometheus-path", help="Also write the scrape stats to this Prometheus textfile collector file, default to not writing it")
+    parser.add_argument("-f", "--fsync", choices=utils.FSYNC_POLICIES, default="none", help="When to fsync images and metadata, \"periodic\" syncs once per metadata write batch, default to none")
+    parser.add_argument("--metadata-batch-size", type=int, default=256, help="Maximum amount of metadata files written in one batch by the metadata writer, default to 256")
+    parser.add_argument("-q", "--work-queue", help="Run as a worker of a distributed crawl, scraping the work units of this queue made by make_work_queue.py into its own subdirectory of the image dir, default to not using a work queue")
+    parser.add_argument("-w", "--worker-id", default=socket.gethostname(), help="Name of this worker and its image subdirectory, must be unique for each worker, default to the host name")
+    parser.add_argument("--lease-duration", type=float, default=300, help="Seconds a leased work unit is kept without a heartbeat before other workers can take it over, default to 300")
+    parser.add_argument("--tag-quota", type=int, help=f"Only download posts having a tag from \"{MODEL_TAGS_PATH}\" whose bucket has less than this many images, counting the images already scraped, to get close to what balance_tags.py would select without downloading the images it would throw away, default to downloading every post")
+    parser.add_argument("--tag-quota-path", help="File of \"tag target\" lines giving some tags a different quota than --tag-quota, default to the same quota for every tag")
+    parser.add_argument("--post-stage", action="append", choices=utils.POST_STAGE_NAMES, help=f"Run this stage on each image right after it's saved, can be given several times: \"caption\" writes the TXT tags like convert.py -n, \"tag_counts\" keeps the tag counts make_model_tags.py uses instead of reading every metadata file, \"hash\" records the SHA-256 of the downloaded images and reports duplicates, \"tag_ids\" merges the new images into the tag ID arrays in \"{TAG_IDS_DIR}\" at exit instead of running make_tag_ids.py, their state is checkpointed in \"{POST_STAGES_DIR}\", default to none")
+    parser.add_argument("--post-stage-checkpoint-interval", type=int, default=1000, help="Checkpoint the post stages every time this amount of images are saved, default to 1000")
+    parser.add_argument("tags_to_search", nargs=argparse.REMAINDER, help="List of tags to search for, after every option, default to all")
+    utils.add_profile_args(parser)
     args = parser.parse_args()
+    if any(tag.startswith("--") for tag in args.tags_to_search):
+        print("Options must come before the tags to search, everything after the first tag is taken as a tag!")
+        sys.exit(1)
     if args.width is None or args.height is None:
         if args.width is not None or args.height is not None:
             print("You must either provide both width and height or not provide both at the same time!")
@@ -161,6 +216,13 @@ def parse_args():
         if args.height < 1:
             print("Height must be greater than or equal to 1!")
             sys.exit(1)
+    if args.bucket_area is not None:
+        if args.width is not None:
+            print("You can't use bucketing and width and height at the same time!")
+            sys.exit(1)
+        if args.bucket_area < 64 * 64:
+            print("Bucket area must be greater than or equal to 4096!")
+            sys.exit(1)
     if args.avif:
         try:
             import pillow_avif
@@ -173,48 +235,103 @@ def parse_args():
     if isinstance(args.max_scrape_count, int) and args.max_scrape_count <= 0:
         print("Maximum scrape count must be greater than 0!")
         sys.exit(1)
+    if args.metrics_interval <= 0:
+        print("Metrics interval must be greater than 0!")
+        sys.exit(1)
+    if args.metadata_batch_size <= 0:
+        print("Metadata batch size must be greater than 0!")
+        sys.exit(1)
+    if args.work_queue is not None:
+        if not os.path.isfile(args.work_queue):
+            print(f"Your work queue \"{args.work_queue}\" doesn't exist or isn't a file!")
+            sys.exit(1)
+        if args.tags_to_search:
+            print("The tags to search come from the work queue, you can't provide them when using one!")
+            sys.exit(1)
+        if not args.worker_id or args.worker_id in (".", "..") or os.sep in args.worker_id or "/" in args.worker_id:
+            print("Worker ID must be a valid directory name!")
+            sys.exit(1)
+    if args.lease_duration <= 0:
+        print("Lease duration must be greater than 0!")
+        sys.exit(1)
+    if args.transport not in utils.get_available_transports():
+        print("You need to pip install httpx[http2] to use the HTTP/2 transport!")
+        sys.exit(1)
+    if args.post_stage_checkpoint_interval <= 0:
+        print("Post stage checkpoint interval must be greater than 0!")
+        sys.exit(1)
+    if args.post_stage is not None and "tag_ids" in args.post_stage:
+        try:
+            import numpy
+        except ImportError:
+            print("You need to pip install numpy to use the tag_ids post stage!")
+            sys.exit(1)
+        if not os.path.isfile(MODEL_TAGS_PATH):
+            print(f"The tag_ids post stage needs the model tags \"{MODEL_TAGS_PATH}\", please place one there!")
+            sys.exit(1)
+    if args.tag_quota is None:
+        if args.tag_quota_path is not None:
+            print("You can't specify the tag quota path without the tag quota!")
+            sys.exit(1)
+    else:
+        if args.tag_quota <= 0:
+            print("Tag quota must be greater than 0!")
+            sys.exit(1)
+        if not os.path.isfile(MODEL_TAGS_PATH):
+            print(f"The tag quota needs the model tags \"{MODEL_TAGS_PATH}\", please place one there!")
+            sys.exit(1)
+        if args.tag_quota_path is not None and not os.path.isfile(args.tag_quota_path):
+            print(f"Your tag quota path \"{args.tag_quota_path}\" doesn't exist or isn't a file!")
+            sys.exit(1)
     return args
 
-async def main():
-    args = parse_args()
-    print("Starting...")
+async def scrape_search(args, search_tags, scrape_state, session_args, tasks):
+    # Returns True if the search reached its end and False if it stopped early.
     page_number = 0
-    search_tags = utils.SearchTags(args.tags_to_search)
-
-    os.makedirs(IMAGE_DIR, exist_ok=True)
-    existing_image_ids = utils.get_existing_image_id_set(IMAGE_DIR)
-    utils.register_sigint_callback()
-
-    session_args = [TIMEOUT, {"fringeBenefits": "yup"}]
-    scrape_state = utils.ScrapeState(concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()), utils.get_session(*session_args), existing_image_ids)
     session_refresh_counter = 0
-    tasks = []
+    last_image_url = None
     while True:
         try:
+            scrape_state.update_metadata_failures()
             if utils.get_sigint_count() >= 1 or isinstance(args.max_scrape_count, int) and scrape_state.scraped_image_count >= args.max_scrape_count:
                 break
+            if scrape_state.tag_quota is not None and scrape_state.tag_quota.is_all_full():
+                print("Every tag bucket is full, stopping...")
+                break
             request_url = f"{args.site}/index.php?page=post&s=list&tags={search_tags.to_search_string()}&pid={page_number}"
             print(f"Going to {request_url}")
             async with scrape_state.session.get(request_url) as response:
                 html = await response.text()
-            soup = BeautifulSoup(html, "html.parser")
+            soup = get_soup(html)
             thumbnails_div = soup.find("div", class_="thumbnail-container")
             if not thumbnails_div:
                 raise RuntimeError("Thumbnails division not found.")
             notice_error = thumbnails_div.find("div", class_="notice error")
             if notice_error and args.continuous_scraping:
                 print("Reached restricted depth, adjusting search tags to continue scraping...")
-                search_tags.update_bound(scrape_state)
+                if search_tags.sort_tag.sort_type == "score" and scrape_state.last_reached_image_score is None and last_image_url is not None:
+                    scrape_state.last_reached_image_score = await get_post_score(scrape_state.session, last_image_url, scrape_state.last_reached_image_id)
+                try:
+                    search_tags.update_bound(scrape_state)
+                except ValueError as e:
+                    # Retrying would only walk the same restricted page again.
+                    print(f"Can't continue past the restricted depth: {e} Stopping...")
+                    return False
                 page_number = 0
                 continue
-            image_urls = [a["href"] for a in thumbnails_div.find_all("a")]
-            image_url_count = len(image_urls)
+            thumbnail_posts = get_thumbnail_posts(thumbnails_div)
+            image_url_count = len(thumbnail_posts)
             if image_url_count == 0:
+                if search_tags.finish_tie_group():
+                    print("Finished the posts sharing the last reached score, continuing past that score...")
+                    page_number = 0
+                    continue
                 print("Website returned 0 image urls.")
-                break
+                return True
             print(f"Got {image_url_count} posts.")
             page_number += image_url_count
-            for image_url in image_urls:
+            last_image_url, scrape_state.last_reached_image_id, scrape_state.last_reached_image_score = thumbnail_posts[-1]
+            for image_url, _, _ in thumbnail_posts:
                 if utils.get_sigint_count() >= 1 or isinstance(args.max_scrape_count, int) and scrape_state.scraped_image_count >= args.max_scrape_count:
                     break
                 while len(tasks) >= MAX_TASKS:
@@ -226,7 +343,7 @@ async def main():
                         if task.done():
                             await task
                             del tasks[i]
-                tasks.append(asyncio.create_task(process_link(utils.ScrapeArgs(image_url, args.width, args.height, args.avif, args.low_quality, args.min_tags, args.max_scrape_count), scrape_state)))
+                tasks.append(asyncio.create_task(utils.profile_coroutine("process_link", process_link(utils.ScrapeArgs(image_url, args.width, args.height, args.avif, args.low_quality, args.min_tags, args.max_scrape_count, bucket_area=args.bucket_area, bucket_mode=args.bucket_mode), scrape_state))))
             if utils.get_sigint_count() >= 1 or isinstance(args.max_scrape_count, int) and scrape_state.scraped_image_count >= args.max_scrape_count:
                 break
             session_refresh_counter += 1
@@ -245,6 +362,68 @@ async def main():
         except Exception as e:
             print(f"An error occurred: {e}\nPausing for 0.1 second before retrying...")
             await asyncio.sleep(0.1)
+    return False
+
+async def get_max_image_id(site, tags_to_search):
+    search_tags = utils.SearchTags(tags_to_search)
+    search_tags.sort_tag = utils.SortTag()
+    session = utils.get_session(TIMEOUT, {"fringeBenefits": "yup"})
+    try:
+        async with session.get(f"{site}/index.php?page=post&s=list&tags={search_tags.to_search_string()}&pid=0") as response:
+            utils.check_status(response)
+            html = await response.text()
+    finally:
+        await session.close()
+    thumbnails_div = get_soup(html).find("div", class_="thumbnail-container")
+    if not thumbnails_div:
+        raise RuntimeError("Thumbnails division not found.")
+    return max((int(image_id) for _, image_id, _ in get_thumbnail_posts(thumbnails_div)), default=None)
+
+async def main():
+    args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    utils.set_transport(args.transport)
+    print("Starting...")
+    work_queue = None
+    image_dir = IMAGE_DIR
+    if args.work_queue is not None:
+        work_queue = utils.WorkQueue(args.work_queue)
+        if work_queue.get_info("scraper") != "gel":
+            print(f"The work queue \"{args.work_queue}\" isn't made for Gelbooru!")
+            sys.exit(1)
+        image_dir = os.path.join(IMAGE_DIR, args.worker_id)
+
+    os.makedirs(image_dir, exist_ok=True)
+    existing_image_ids = utils.get_existing_image_id_set(IMAGE_DIR)
+    if work_queue is not None:
+        existing_image_ids |= utils.get_shard_existing_image_id_set(IMAGE_DIR)
+    tag_quota = None
+    if args.tag_quota is not None:
+        print("Counting the tags of the existing images for the tag quota...")
+        tag_quota = utils.TagQuota(utils.load_tag_vocabulary(MODEL_TAGS_PATH), args.tag_quota, utils.load_tag_targets(args.tag_quota_path) if args.tag_quota_path is not None else None)
+        print(f"Counted {tag_quota.count_existing([IMAGE_DIR] + (utils.get_shard_dirs(IMAGE_DIR) if work_queue is not None else []))} images, {tag_quota.get_stats_text()}.")
+    metadata_writer = utils.MetadataWriter(args.fsync, args.metadata_batch_size)
+    post_stages = None
+    if args.post_stage is not None:
+        print("Starting the post stages...")
+        post_stages = utils.make_post_stages(dict.fromkeys(args.post_stage), POST_STAGES_DIR, metadata_writer, args.post_stage_checkpoint_interval, MODEL_TAGS_PATH, TAG_IDS_DIR)
+        post_stages.start([IMAGE_DIR] + (utils.get_shard_dirs(IMAGE_DIR) if work_queue is not None else []))
+    utils.register_sigint_callback()
+
+    session_args = [TIMEOUT, {"fringeBenefits": "yup"}]
+    scrape_state = utils.ScrapeState(concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()), utils.get_session(*session_args), existing_image_ids, metrics=utils.ScrapeMetrics(
+        utils.JsonlSink(args.metrics_path) if args.metrics_path is not None else None, args.prometheus_path, args.metrics_interval,
+    ), metadata_writer=metadata_writer, image_dir=image_dir, tag_quota=tag_quota, post_stages=post_stages)
+    tasks = []
+    if work_queue is None:
+        await scrape_search(args, utils.SearchTags(args.tags_to_search), scrape_state, session_args, tasks)
+    else:
+        tags_to_search = work_queue.get_info("tags").split()
+        await utils.run_worker(
+            work_queue, args.worker_id, IMAGE_DIR, lambda unit: scrape_search(args, utils.SearchTags(tags_to_search + unit.get_id_tags()), scrape_state, session_args, tasks), scrape_state, tasks,
+            lambda: utils.get_sigint_count() >= 1 or isinstance(args.max_scrape_count, int) and scrape_state.scraped_image_count >= args.max_scrape_count, args.lease_duration,
+        )
+        work_queue.close()
     if utils.get_sigint_count() >= 1:
         print("Script interrupted by user, gracefully exiting...\nYou can interrupt again to exit semi-forcefully, but it will break image checks!")
     else:
@@ -257,6 +436,17 @@ async def main():
                 await task
                 del tasks[i]
     await scrape_state.session.close()
+    scrape_state.metadata_writer.close()
+    scrape_state.update_metadata_failures()
+    if scrape_state.metadata_writer.error_count > 0:
+        print(f"{scrape_state.metadata_writer.error_count} images were removed because their metadata failed to write, they will be scraped again next time.")
+    if post_stages is not None:
+        post_stages.close()
+        print(f"Post stages: {post_stages.get_stats_text()}.")
+    scrape_state.metrics.export(scrape_state.scraped_image_count, args.max_scrape_count)
+    scrape_state.metrics.close()
+    if tag_quota is not None:
+        print(f"Tag quota: {tag_quota.get_stats_text()}.")
     if utils.get_sigint_count() >= 1:
         if utils.get_sigint_count() >= 2:
             print("Another interrupt received, exiting semi-forcefully...\nYou can interrupt again for truly forceful exit, but it most likely will break a lot of things!")
@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import tqdm
+import utils
+import tarfile
+import argparse
+from constants import *
+import concurrent.futures
+
+IMAGES_PER_TASK = 64
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resize and transcode already scraped images, from an image directory or tar chunks.")
+    parser.add_argument("-i", "--input-dir", default=IMAGE_DIR, help=f"Input directory with the images, or with the tar chunks if --tars is set, default to \"{IMAGE_DIR}\"")
+    parser.add_argument("-o", "--output-dir", default="transcoded", help="Output directory for the transcoded images and their metadata, default to \"transcoded\"")
+    parser.add_argument("--id-list", help="Only transcode the images whose IDs are in this file, one per line, e.g. made by query_tags.py, default to all images")
+    parser.add_argument("-t", "--tars", action="store_true", help="If set, the input directory contains tar chunks made by compress.py")
+    parser.add_argument("-W", "--width", type=int, help="Scale the width of the image to the specified value, must either provide both width and height or not provide both")
+    parser.add_argument("-H", "--height", type=int, help="Scale the height of the image to the specified value, must either provide both width and height or not provide both")
+    parser.add_argument("-b", "--bucket-area", type=int, help="Resize the image to the nearest aspect ratio bucket with about this many pixels instead of an exact size, e.g. 1048576 for 1024x1024, can't be used with width and height")
+    parser.add_argument("--bucket-mode", choices=utils.BUCKET_MODES, default="crop", help="Whether to crop or pad the image to fit its bucket, default to crop")
+    parser.add_argument("-f", "--format", choices=sorted(utils.IMAGE_FORMAT_EXT), help="Convert the images to this format, default to keeping their format")
+    parser.add_argument("-q", "--quality", type=int, help="Encoder quality for avif, webp and jpeg, default to 50 for avif and 90 for the others")
+    parser.add_argument("-s", "--speed", type=int, help="Encoder speed, avif speed (0-10, higher is faster), webp method (0-6, lower is faster) or png compress level (0-9, lower is faster), default to the encoder's default")
+    parser.add_argument("-e", "--exact", action="store_true", help="If set, won't use JPEG draft mode and reducing for faster but slightly less exact downscaling")
+    parser.add_argument("-F", "--force", action="store_true", help="If set, will transcode images even if their output is newer than them")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Amount of worker processes, default to the CPU count")
+    utils.add_profile_args(parser)
+    args = parser.parse_args()
+    if args.width is None or args.height is None:
+        if args.width is not None or args.height is not None:
+            print("You must either provide both width and height or not provide both at the same time!")
+            sys.exit(1)
+    else:
+        if args.width < 1:
+            print("Width must be greater than or equal to 1!")
+            sys.exit(1)
+        if args.height < 1:
+            print("Height must be greater than or equal to 1!")
+            sys.exit(1)
+    if args.bucket_area is not None:
+        if args.width is not None:
+            print("You can't use bucketing and width and height at the same time!")
+            sys.exit(1)
+        if args.bucket_area < 64 * 64:
+            print("Bucket area must be greater than or equal to 4096!")
+            sys.exit(1)
+    if args.format == "avif":
+        try:
+            import pillow_avif
+        except ImportError:
+            from PIL import features
+            if not features.check("avif"):
+                print("You need to pip install pillow-avif-plugin or update Pillow to use avif conversion!")
+                sys.exit(1)
+    if args.workers < 1:
+        print("Workers must be greater than or equal to 1!")
+        sys.exit(1)
+    if not os.path.isdir(args.input_dir):
+        print(f"Your input dir \"{args.input_dir}\" doesn't exist or isn't a directory!")
+        sys.exit(1)
+    if args.id_list is not None and not os.path.isfile(args.id_list):
+        print(f"Your ID list \"{args.id_list}\" doesn't exist or isn't a file!")
+        sys.exit(1)
+    if os.path.abspath(args.input_dir) == os.path.abspath(args.output_dir):
+        print("The output dir must be different from the input dir!")
+        sys.exit(1)
+    return args
+
+def is_up_to_date(output_path, source_mtime):
+    return os.path.isfile(output_path) and os.path.getmtime(output_path) >= source_mtime
+
+def transcode_image(read_image, read_metadata, image_name, source_mtime, args):
+    # Returns (Status, Input bytes, Output bytes).
+    output_image_path = utils.get_image_format_path(os.path.join(args.output_dir, image_name), args.format)
+    output_metadata_path = os.path.join(args.output_dir, os.path.splitext(image_name)[0] + ".json")
+    if not args.force and is_up_to_date(output_image_path, source_mtime) and is_up_to_date(output_metadata_path, source_mtime):
+        return "skipped", 0, 0
+    try:
+        image_data = read_image() # Can fail too, for a truncated tar member or a file deleted since it was listed.
+        _, bucket = utils.transform_image(
+            image_data, output_image_path, args.width, args.height, args.format, args.quality, args.speed, not args.exact, bucket_area=args.bucket_area, bucket_mode=args.bucket_mode,
+        )
+        metadata_data = read_metadata()
+        if bucket is not None:
+            metadata = utils.loads_json(metadata_data)
+            metadata["bucket"] = list(bucket)
+            metadata_data = utils.dumps_json(metadata).encode("utf8")
+        # Written after the image so an interrupted run never leaves metadata for a broken image.
+        with open(output_metadata_path, "wb") as metadata_file:
+            metadata_file.write(metadata_data)
+    except Exception as e:
+        print(f"Error transcoding image {image_name}: {e}")
+        for path in (output_image_path, output_metadata_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return "failed", 0, 0
+    return "done", len(image_data), os.path.getsize(output_image_path)
+
+def read_file(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+def add_result(results, result):
+    status, input_bytes, output_bytes = result
+    results[status] += 1
+    results["input_bytes"] += input_bytes
+    results["output_bytes"] += output_bytes
+
+def transcode_paths(image_metadata_path_tuple_list, args):
+    results = {"done": 0, "skipped": 0, "failed": 0, "input_bytes": 0, "output_bytes": 0}
+    for image_path, metadata_path in image_metadata_path_tuple_list:
+        try:
+            source_mtime = max(os.path.getmtime(image_path), os.path.getmtime(metadata_path))
+        except OSError as e:
+            print(f"Error transcoding image {os.path.basename(image_path)}: {e}")
+            results["failed"] += 1
+            continue
+        add_result(results, transcode_image(lambda: read_file(image_path), lambda: read_file(metadata_path), os.path.basename(image_path), source_mtime, args))
+    return results
+
+def transcode_tar(tar_path, args):
+    results = {"done": 0, "skipped": 0, "failed": 0, "input_bytes": 0, "output_bytes": 0}
+    image_ids = utils.load_id_list(args.id_list) if args.id_list is not None else None
+    tar = None
+    try:
+        tar = tarfile.open(tar_path, "r")
+        members = [member for member in tar.getmembers() if member.isfile()]
+    except (tarfile.TarError, OSError) as e:
+        print(f"Error reading tar chunk {tar_path}: {e}")
+        if tar is not None:
+            tar.close()
+        results["failed_tasks"] = 1
+        return results
+    with tar:
+        metadata_member_dict = {os.path.splitext(member.name)[0]: member for member in members if member.name.endswith(".json")}
+        for member in members:
+            image_id, ext = os.path.splitext(member.name)
+            metadata_member = metadata_member_dict.get(image_id)
+            if ext == ".json" or metadata_member is None or image_ids is not None and os.path.basename(image_id) not in image_ids:
+                continue
+            source_mtime = max(member.mtime, metadata_member.mtime)
+            read_image = lambda: tar.extractfile(member).read()
+            read_metadata = lambda: tar.extractfile(metadata_member).read()
+            add_result(results, transcode_image(read_image, read_metadata, os.path.basename(member.name), source_mtime, args))
+    return results
+
+def main():
+    args = parse_args()
+    utils.start_profiling(args.profile, args.profile_interval, args.profile_memory_interval)
+    print("Starting...\nGetting paths...")
+    os.makedirs(args.output_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    results = {"done": 0, "skipped": 0, "failed": 0, "input_bytes": 0, "output_bytes": 0, "failed_tasks": 0}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        if args.tars:
+            tar_paths = sorted(os.path.join(args.input_dir, f) for f in os.listdir(args.input_dir) if f.endswith(".tar"))
+            print("Got", len(tar_paths), "tar chunks.")
+            total = None
+            for tar_path in tar_paths:
+                futures.append(executor.submit(transcode_tar, tar_path, args))
+        else:
+            image_metadata_path_tuple_list = [e[1] for e in sorted(utils.filter_image_id_dict(utils.get_image_id_image_metadata_path_tuple_dict(args.input_dir), args.id_list).items(), key=lambda x: x[0])]
+            print("Got", len(image_metadata_path_tuple_list), "images.")
+            total = len(image_metadata_path_tuple_list)
+            for i in range(0, len(image_metadata_path_tuple_list), IMAGES_PER_TASK):
+                futures.append(executor.submit(transcode_paths, image_metadata_path_tuple_list[i:i + IMAGES_PER_TASK], args))
+        with tqdm.tqdm(total=total, desc="Transcoding", unit="img") as pbar:
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    task_results = future.result()
+                except Exception as e: # Only the images of that task are lost, the rest keep going.
+                    print(f"Error in a transcoding task: {e.__class__.__name__}: {e}")
+                    results["failed_tasks"] += 1
+                    continue
+                for k, v in task_results.items():
+                    results[k] += v
+                pbar.update(task_results["done"] + task_results["skipped"] + task_results["failed"])
+    if args.bucket_area is not None:
+        print("Writing the bucket index...")
+        bucket_index = utils.write_bucket_index(args.output_dir)
+        print("Got", len(bucket_index), "buckets:", ", ".join(f"{bucket}: {len(image_ids)}" for bucket, image_ids in bucket_index.items()))
+    used_time = time.perf_counter() - start_time
+    saved_bytes = results["input_bytes"] - results["output_bytes"]
+    failed_tasks_text = f", {results['failed_tasks']} tasks failed" if results["failed_tasks"] > 0 else ""
+    saved_percent = saved_bytes / results["input_bytes"] * 100 if results["input_bytes"] > 0 else 0
+    print(
+        f"Transcoded {results['done']} images ({results['skipped']} up to date, {results['failed']} failed{failed_tasks_text}) in {used_time:.1f}s, {results['done'] / used_time:.1f} images/s,",
+        f"{results['input_bytes'] / 1024 / 1024:.1f}MiB -> {results['output_bytes'] / 1024 / 1024:.1f}MiB, saved {saved_bytes / 1024 / 1024:.1f}MiB ({saved_percent:.1f}%).",
+    )
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user, exiting...")
+        sys.exit(1)
@@ -1,5 +1,47 @@
-from .utils import *
-from .search_tags import *
-from .scrape_args import *
-from .scrape_state import *
-from .sigint_handler import *
+import importlib
+
+# Submodules are imported on first use of one of their names, so tools that don't need aiohttp or PIL don't pay for importing them.
+SUBMODULE_NAMES = {
+    "json_codec": ("JSON_BACKENDS", "get_available_json_backends", "get_json_backend", "set_json_backend", "dumps_json", "loads_json", "load_json_file", "Metadata", "load_metadata", "dumps_metadata"),
+    "utils": (
+        "IMAGE_FORMAT_EXT", "get_image_format_path", "get_save_kwargs", "transform_image", "validate_image", "submit_validation",
+        "get_image_id_image_metadata_path_tuple_dict", "get_existing_image_id_set", "load_id_list", "filter_image_id_dict", "get_session", "get_model_tags",
+    ),
+    "tag_filter": ("get_metadata_struct", "TagFilter", "get_tag_filter", "get_tags"),
+    "tag_vocabulary": ("TAG_VOCABULARY_MAGIC", "TAG_VOCABULARY_HEADER", "get_tag_vocabulary_path", "write_tag_vocabulary", "TagVocabulary", "load_tag_vocabulary"),
+    "tag_id_arrays": ("TAG_ID_ARRAY_NAMES", "TagIdArrays", "load_tag_id_arrays", "save_tag_id_arrays"),
+    "tag_index": ("TAG_INDEX_ARRAY_NAMES", "TAG_INDEX_RATINGS", "contains_sorted", "compare_column", "TagIndex", "make_postings", "load_tag_index", "save_tag_index"),
+    "tag_quota": ("load_tag_targets", "TagQuota"),
+    "buckets": ("BUCKET_MODES", "BUCKET_INDEX_FILENAME", "get_buckets", "get_nearest_bucket", "resize_to_bucket", "make_bucket_index", "write_bucket_index", "load_bucket_index"),
+    "search_tags": ("COMPARE_FILTER_TAG_PATTERN", "WHITE_SPACE_PATTERN", "SortTag", "CompareFilterTag", "SearchTags"),
+    "scrape_args": ("ScrapeArgs",),
+    "scrape_state": ("ScrapeState",),
+    "sigint_handler": ("get_sigint_count", "sigint_handler", "register_sigint_callback"),
+    "progress_journal": ("NL_DESC_KEY_BYTES", "has_nl_desc", "ProgressJournal"),
+    "openai_api": ("TERMINAL_BATCH_STATUSES", "get_auth_headers", "APIResponseError", "check_api_response", "upload_batch_file", "create_batch", "get_batch", "wait_for_batch", "iter_file_jsonl"),
+    "response_cache": ("get_cache_key", "ResponseCache"),
+    "endpoint_router": ("ROUTING_STRATEGIES", "Endpoint", "EndpointRouter", "load_endpoints"),
+    "llm_tag_state": ("LLMTagState",),
+    "metrics": ("RollingWindow", "Histogram", "JsonlSink", "format_count", "LLMTagMetrics", "SCRAPE_STAGES", "ScrapeMetrics"),
+    "metadata_writer": ("FSYNC_POLICIES", "fsync_path", "fsync_dir", "MetadataWriter"),
+    "shards": ("ID_INDEX_FILENAME", "get_shard_dirs", "get_shard_existing_image_id_set", "make_id_index", "write_id_index", "load_id_index"),
+    "work_queue": ("WorkUnit", "WorkQueue", "keep_lease", "wait_for_tasks", "run_worker"),
+    "transport": ("TRANSPORTS", "get_available_transports", "get_transport", "set_transport", "HTTPXResponse", "HTTPXSession"),
+    "profiler": ("FOLDED_STACKS_FILENAME", "STAGES_FILENAME", "MEMORY_FILENAME", "add_profile_args", "StageStats", "Profiler", "start_profiling", "profile_coroutine", "profile_call"),
+    "post_stages": (
+        "POST_STAGE_NAMES", "get_post_stage_state_path", "load_tag_counts", "PostStage", "CaptionStage", "TagCountStage", "HashStage", "TagIdStage", "PostStages", "make_post_stages",
+    ),
+    "download": ("RETRYABLE_STATUS_CODES", "CONTENT_RANGE_PATTERN", "PermanentError", "HTTPStatusError", "is_retryable_error", "check_status", "PartialDownload"),
+}
+NAME_SUBMODULE_DICT = {name: submodule for submodule, names in SUBMODULE_NAMES.items() for name in names}
+
+def __getattr__(name):
+    submodule = NAME_SUBMODULE_DICT.get(name)
+    if submodule is None:
+        raise AttributeError(f"module \"{__name__}\" has no attribute \"{name}\"")
+    value = getattr(importlib.import_module("." + submodule, __name__), name)
+    globals()[name] = value # Cached so later lookups don't go through here.
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(NAME_SUBMODULE_DICT))
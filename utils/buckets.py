@@ -0,0 +1,71 @@
+import os
+import math
+import functools
+from .json_codec import dumps_json, load_json_file
+from .utils import get_image_id_image_metadata_path_tuple_dict
+
+BUCKET_MODES = ("crop", "pad")
+BUCKET_INDEX_FILENAME = "bucket_index.json"
+
+@functools.lru_cache(maxsize=16)
+def get_buckets(area, step=64, max_aspect_ratio=4.0):
+    # Resolutions with sides divisible by step and close to but not over the target pixel area.
+    buckets = set()
+    width = step
+    while width * step <= area:
+        height = area // width // step * step
+        if max(width / height, height / width) <= max_aspect_ratio:
+            buckets.add((width, height))
+            buckets.add((height, width))
+        width += step
+    if not buckets:
+        raise ValueError(f"No buckets fit a pixel area of {area} with a step of {step}!")
+    return tuple(sorted(buckets))
+
+def get_nearest_bucket(width, height, buckets):
+    aspect_ratio = math.log(width / height)
+    return min(buckets, key=lambda bucket: abs(math.log(bucket[0] / bucket[1]) - aspect_ratio))
+
+def resize_to_bucket(img, bucket, bucket_mode="crop", fast_downscale=False):
+    # Scales the image to cover (crop) or fit inside (pad) the bucket, keeping the aspect ratio, then crops or pads the rest.
+    from PIL import Image
+    scale_function = max if bucket_mode == "crop" else min
+    scale = scale_function(bucket[0] / img.width, bucket[1] / img.height)
+    if fast_downscale:
+        img.draft(None, (math.ceil(img.width * scale), math.ceil(img.height * scale))) # Only does something before the image is loaded.
+        scale = scale_function(bucket[0] / img.width, bucket[1] / img.height)
+    reducing_gap = 3.0 if fast_downscale else None
+    if bucket_mode == "crop":
+        crop_width, crop_height = bucket[0] / scale, bucket[1] / scale
+        left, top = (img.width - crop_width) / 2, (img.height - crop_height) / 2
+        return img.resize(bucket, box=(left, top, left + crop_width, top + crop_height), reducing_gap=reducing_gap)
+    size = (max(1, min(bucket[0], round(img.width * scale))), max(1, min(bucket[1], round(img.height * scale))))
+    img = img.resize(size, reducing_gap=reducing_gap)
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    padded_img = Image.new(img.mode, bucket)
+    padded_img.paste(img, ((bucket[0] - size[0]) // 2, (bucket[1] - size[1]) // 2))
+    return padded_img
+
+def make_bucket_index(image_dir):
+    # Key: Bucket as "WIDTHxHEIGHT", Value: Sorted list of image IDs in it.
+    bucket_index = {}
+    for image_id, (_, metadata_path) in get_image_id_image_metadata_path_tuple_dict(image_dir).items():
+        bucket = load_json_file(metadata_path).get("bucket")
+        if bucket is None:
+            continue
+        bucket_index.setdefault(f"{bucket[0]}x{bucket[1]}", []).append(image_id)
+    for image_ids in bucket_index.values():
+        image_ids.sort(key=lambda image_id: (len(image_id), image_id))
+    return dict(sorted(bucket_index.items()))
+
+def write_bucket_index(image_dir):
+    bucket_index = make_bucket_index(image_dir)
+    index_path = os.path.join(image_dir, BUCKET_INDEX_FILENAME)
+    with open(index_path + ".tmp", "w", encoding="utf8") as index_file:
+        index_file.write(dumps_json(bucket_index))
+    os.replace(index_path + ".tmp", index_path)
+    return bucket_index
+
+def load_bucket_index(image_dir):
+    return load_json_file(os.path.join(image_dir, BUCKET_INDEX_FILENAME))
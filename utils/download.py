@@ -0,0 +1,64 @@
+import re
+
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429, 500, 502, 503, 504))
+CONTENT_RANGE_PATTERN = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+class PermanentError(Exception):
+    # Raised for failures that would fail the same way again, so they don't use up retry attempts.
+    pass
+
+class HTTPStatusError(Exception):
+
+    def __init__(self, status, url):
+        super().__init__(f"Server responded status code {status} for \"{url}\".")
+        self.status = status
+
+def is_retryable_error(error):
+    if isinstance(error, PermanentError):
+        return False
+    if isinstance(error, HTTPStatusError):
+        return error.status in RETRYABLE_STATUS_CODES or error.status >= 500
+    return True # Network errors, timeouts and pages cut short are worth another try.
+
+def check_status(response):
+    if response.status < 200 or response.status >= 300:
+        raise HTTPStatusError(response.status, response.url)
+
+class PartialDownload:
+    # Keeps the bytes received so far across retry attempts, so a retry only requests the rest with a Range request.
+
+    def __init__(self, url, chunk_size=65536):
+        self.url = url
+        self.chunk_size = chunk_size
+        self.data = bytearray()
+        self.total_size = None
+        self.validator = None # ETag or Last-Modified of the partial data, sent as If-Range so a changed file is downloaded again in full.
+        self.resume_count = 0
+
+    async def read(self, session):
+        headers = {}
+        if self.data:
+            headers["Range"] = f"bytes={len(self.data)}-"
+            if self.validator is not None:
+                headers["If-Range"] = self.validator
+        async with session.get(self.url, headers=headers) as response:
+            if response.status == 206 and self.data:
+                re_match = CONTENT_RANGE_PATTERN.search(response.headers.get("Content-Range", ""))
+                if re_match is None or int(re_match.group(1)) != len(self.data):
+                    self.data.clear()
+                    raise RuntimeError("Server responded an unexpected content range, downloading again from the start.")
+                if re_match.group(3) != "*":
+                    self.total_size = int(re_match.group(3))
+                self.resume_count += 1
+            elif response.status == 416 and self.data and len(self.data) == self.total_size:
+                return bytes(self.data) # Everything was already received.
+            else:
+                check_status(response)
+                self.data.clear() # The server ignored the range or it's the first request.
+                self.total_size = response.content_length if "Content-Encoding" not in response.headers else None # Compressed lengths don't match the decoded bytes.
+            self.validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                self.data += chunk
+        if self.total_size is not None and len(self.data) != self.total_size:
+            raise RuntimeError(f"Download ended after {len(self.data)} of {self.total_size} bytes.")
+        return bytes(self.data)
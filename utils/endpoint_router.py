@@ -0,0 +1,141 @@
+import os
+import time
+import random
+import asyncio
+from .json_codec import load_json_file
+
+ROUTING_STRATEGIES = ("weighted", "least_latency")
+LATENCY_SMOOTHING = 0.2 # Weight of the newest latency in the moving average.
+MAX_COOLDOWN = 60 # Cap of the Retry-After the endpoints can ask for.
+MAX_BACKOFF = 4 # Cap of the exponential backoff when they don't ask for any.
+
+class Endpoint:
+    # One API URL, key and model with its own concurrency and request rate budget.
+
+    def __init__(self, api, model, key=None, concurrency=50, rate_limit=None, weight=1.0, name=None):
+        self.api = api
+        self.model = model
+        self.key = key
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit # Requests per second, None for no limit.
+        self.weight = weight
+        self.name = name or f"{api} {model}"
+        self.in_flight = 0
+        self.tokens = float(rate_limit) if rate_limit is not None else None # Token bucket allowing bursts of up to a second of requests.
+        self.token_time = time.monotonic()
+        self.latency = None
+        self.cooldown_until = 0
+        self.failure_streak = 0
+        self.request_count = 0
+        self.error_count = 0
+        self.rate_limited_count = 0
+
+    def refill_tokens(self, now):
+        if self.tokens is not None:
+            self.tokens = min(self.tokens + (now - self.token_time) * self.rate_limit, max(self.rate_limit, 1))
+            self.token_time = now
+
+    def get_wait_time(self, now):
+        # Seconds until this endpoint can take a request, None if it's waiting for a request to finish.
+        if self.in_flight >= self.concurrency:
+            return None
+        self.refill_tokens(now)
+        token_wait_time = (1 - self.tokens) / self.rate_limit if self.tokens is not None and self.tokens < 1 else 0
+        return max(self.cooldown_until - now, token_wait_time, 0)
+
+    def get_summary_text(self):
+        latency_text = f"{self.latency:.2f}s" if self.latency is not None else "-"
+        return f"{self.name}: {self.request_count} requests, {self.error_count} errors, {self.rate_limited_count} rate limited, latency {latency_text}"
+
+class EndpointRouter:
+
+    def __init__(self, endpoints, strategy="weighted"):
+        if not endpoints:
+            raise ValueError("You need at least 1 endpoint!")
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"Unknown routing strategy \"{strategy}\", must be one of {', '.join(ROUTING_STRATEGIES)}!")
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.released = asyncio.Event()
+
+    def get_models(self):
+        return list(dict.fromkeys(endpoint.model for endpoint in self.endpoints))
+
+    def choose(self, endpoints):
+        if self.strategy == "least_latency":
+            # Untried endpoints first, and endpoints that are already busy count as slower so the load still spreads.
+            return min(endpoints, key=lambda endpoint: ((endpoint.latency or 0) * (endpoint.in_flight + 1), endpoint.in_flight))
+        return random.choices(endpoints, [endpoint.weight for endpoint in endpoints])[0]
+
+    async def acquire(self, avoid_endpoint=None):
+        # Waits for an endpoint with free concurrency and rate budget, preferring others over avoid_endpoint, like the one that just failed.
+        while True:
+            now = time.monotonic()
+            wait_times = [(endpoint, endpoint.get_wait_time(now)) for endpoint in self.endpoints]
+            ready_endpoints = [endpoint for endpoint, wait_time in wait_times if wait_time == 0]
+            if len(ready_endpoints) > 1 and avoid_endpoint in ready_endpoints:
+                ready_endpoints.remove(avoid_endpoint)
+            if ready_endpoints:
+                endpoint = self.choose(ready_endpoints)
+                endpoint.in_flight += 1
+                if endpoint.tokens is not None:
+                    endpoint.tokens -= 1
+                endpoint.request_count += 1
+                return endpoint
+            timed_wait_times = [wait_time for _, wait_time in wait_times if wait_time is not None]
+            self.released.clear()
+            try:
+                await asyncio.wait_for(self.released.wait(), min(timed_wait_times) if timed_wait_times else None)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def is_endpoint_error(error):
+        # Rate limits, server errors and network errors say the endpoint is in trouble, other 4xx like a bad image are only about that request.
+        status = getattr(error, "status", None)
+        return status is None or status == 429 or status >= 500
+
+    def release(self, endpoint, latency=None, error=None):
+        # Called without latency and error for cancelled requests.
+        endpoint.in_flight -= 1
+        if latency is not None:
+            endpoint.failure_streak = 0
+            endpoint.latency = latency if endpoint.latency is None else endpoint.latency + (latency - endpoint.latency) * LATENCY_SMOOTHING
+        if error is not None:
+            if getattr(error, "status", None) == 429:
+                endpoint.rate_limited_count += 1
+            else:
+                endpoint.error_count += 1
+            if self.is_endpoint_error(error):
+                # Backs off exponentially from the endpoint, so requests fail over to the others meanwhile.
+                now = time.monotonic()
+                retry_after = getattr(error, "retry_after", None)
+                if now >= endpoint.cooldown_until:
+                    # Requests in flight together fail together, so only the first failure after a cooldown counts towards the backoff.
+                    endpoint.failure_streak += 1
+                    endpoint.cooldown_until = now + min(0.5 * 2 ** (endpoint.failure_streak - 1), MAX_BACKOFF)
+                if retry_after is not None:
+                    endpoint.cooldown_until = max(endpoint.cooldown_until, now + min(retry_after, MAX_COOLDOWN))
+        self.released.set()
+
+    def get_summary_text(self):
+        return "; ".join(endpoint.get_summary_text() for endpoint in self.endpoints)
+
+def load_endpoints(endpoints_path, default_concurrency=50):
+    # A JSON list of {"api", "model", and optionally "key" or "key_env", "concurrency", "rate_limit", "weight", "name"}.
+    endpoints = []
+    for i, endpoint_dict in enumerate(load_json_file(endpoints_path)):
+        if not isinstance(endpoint_dict, dict) or not endpoint_dict.get("api") or not endpoint_dict.get("model"):
+            raise ValueError(f"Endpoint {i} needs at least \"api\" and \"model\"!")
+        key = endpoint_dict.get("key")
+        if key is None and endpoint_dict.get("key_env") is not None:
+            key = os.environ.get(endpoint_dict["key_env"])
+            if key is None:
+                raise ValueError(f"The environment variable \"{endpoint_dict['key_env']}\" of endpoint {i} isn't set!")
+        concurrency = endpoint_dict.get("concurrency", default_concurrency)
+        rate_limit = endpoint_dict.get("rate_limit")
+        weight = endpoint_dict.get("weight", 1.0)
+        if not isinstance(concurrency, int) or concurrency < 1 or rate_limit is not None and rate_limit <= 0 or weight <= 0:
+            raise ValueError(f"Endpoint {i} needs a positive concurrency, rate limit and weight!")
+        endpoints.append(Endpoint(endpoint_dict["api"], endpoint_dict["model"], key, concurrency, rate_limit, weight, endpoint_dict.get("name")))
+    return endpoints
@@ -0,0 +1,90 @@
+import os
+import json
+from typing import Optional, Any
+from dataclasses import dataclass, field
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+JSON_BACKENDS = ("orjson", "msgspec", "json") # In order of preference.
+
+def get_available_json_backends():
+    return [name for name in JSON_BACKENDS if name == "json" or globals()[name] is not None]
+
+_JSON_BACKEND = get_available_json_backends()[0]
+
+def get_json_backend():
+    return _JSON_BACKEND
+
+def set_json_backend(name):
+    global _JSON_BACKEND
+    if name not in get_available_json_backends():
+        raise ValueError(f"JSON backend \"{name}\" is not available, available backends: {', '.join(get_available_json_backends())}")
+    _JSON_BACKEND = name
+
+def dumps_json(obj):
+    # Compact and non ASCII characters kept as is, all backends give the same output for metadata.
+    match _JSON_BACKEND:
+        case "orjson":
+            return orjson.dumps(obj).decode("utf8")
+        case "msgspec":
+            return msgspec.json.encode(obj).decode("utf8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def loads_json(data):
+    match _JSON_BACKEND:
+        case "orjson":
+            return orjson.loads(data)
+        case "msgspec":
+            return msgspec.json.decode(data)
+    return json.loads(data)
+
+def load_json_file(path):
+    with open(path, "rb") as json_file:
+        return loads_json(json_file.read())
+
+METADATA_KEYS = frozenset(("image_id", "score", "rating", "tags", "nl_desc"))
+
+@dataclass
+class Metadata:
+    image_id: Optional[str]
+    score: Optional[int]
+    rating: Optional[str]
+    tags: dict[str, list[str]]
+    nl_desc: Optional[str] = None
+    extra: dict[str, Any] = field(default_factory=dict) # Keys this struct doesn't know, kept so rewriting the file doesn't lose them.
+
+    @classmethod
+    def from_dict(cls, metadata_dict):
+        # Doesn't copy the dict, only its unknown keys go into extra.
+        extra = {key: value for key, value in metadata_dict.items() if key not in METADATA_KEYS}
+        return cls(metadata_dict.get("image_id"), metadata_dict.get("score"), metadata_dict.get("rating"), metadata_dict.get("tags", {}), metadata_dict.get("nl_desc"), extra)
+
+    def to_dict(self):
+        # Missing fields are left out like they were in the file.
+        metadata_dict = {}
+        if self.image_id is not None:
+            metadata_dict["image_id"] = self.image_id
+        if self.score is not None:
+            metadata_dict["score"] = self.score
+        if self.rating is not None:
+            metadata_dict["rating"] = self.rating
+        metadata_dict["tags"] = self.tags
+        metadata_dict.update(self.extra)
+        if self.nl_desc is not None:
+            metadata_dict["nl_desc"] = self.nl_desc
+        return metadata_dict
+
+def load_metadata(metadata_path):
+    if not os.path.isfile(metadata_path):
+        raise FileNotFoundError(f"\"{metadata_path}\" is not a file!")
+    return Metadata.from_dict(load_json_file(metadata_path))
+
+def dumps_metadata(metadata):
+    return dumps_json(metadata.to_dict() if isinstance(metadata, Metadata) else metadata)
@@ -0,0 +1,17 @@
+from typing import Optional, Any
+from aiohttp import ClientSession
+from dataclasses import dataclass, field
+from .metrics import LLMTagMetrics
+from .response_cache import ResponseCache
+from .endpoint_router import EndpointRouter
+from .progress_journal import ProgressJournal
+
+@dataclass
+class LLMTagState:
+    session: ClientSession
+    journal: ProgressJournal
+    few_shot_examples: list[dict[str, Any]]
+    few_shot_key: Optional[str] = None
+    response_cache: Optional[ResponseCache] = None
+    metrics: LLMTagMetrics = field(default_factory=LLMTagMetrics)
+    router: Optional[EndpointRouter] = None
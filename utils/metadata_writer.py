@@ -0,0 +1,149 @@
+import os
+import time
+import queue
+import threading
+
+FSYNC_POLICIES = ("none", "periodic", "each")
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def fsync_dir(dir_path):
+    if not hasattr(os, "O_DIRECTORY"): # Directories can't be opened for fsync on Windows.
+        return
+    fd = os.open(dir_path or ".", os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class MetadataWriter:
+    # Writes metadata files on its own thread in batches, always after their image is written,
+    # so a crash can leave an image without metadata (which gets scraped again) but never the opposite.
+
+    def __init__(self, fsync_policy="none", batch_size=256, flush_interval=1.0):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy \"{fsync_policy}\", must be one of {', '.join(FSYNC_POLICIES)}!")
+        self.fsync_policy = fsync_policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written_count = 0
+        self.failures = [] # (Image path, metadata path, metadata) of the failed writes, their files are removed.
+        self.failures_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="MetadataWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, image_path, metadata_path, metadata):
+        if self.fsync_policy == "each":
+            fsync_path(image_path) # Done by the calling image worker so the writer thread doesn't become the bottleneck.
+        self.queue.put((image_path, metadata_path, metadata))
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            batch = [item]
+            flushed = None
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    if self.fsync_policy == "periodic":
+                        # Waits for more so each fsync round covers as many images as possible.
+                        item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    else:
+                        item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    flushed = item
+                    break
+                batch.append(item)
+            self.write_batch(batch)
+            if flushed is not None:
+                flushed.set()
+
+    def write_batch(self, batch):
+        if self.fsync_policy == "periodic":
+            batch = [item for item in batch if self.sync_image(item)]
+            self.sync_dirs(image_path for image_path, _, _ in batch)
+        for image_path, metadata_path, metadata in batch:
+            try:
+                with open(metadata_path, "w", encoding="utf8") as metadata_file:
+                    metadata_file.write(metadata)
+                    if self.fsync_policy == "each":
+                        metadata_file.flush()
+                        os.fsync(metadata_file.fileno())
+                self.written_count += 1
+            except Exception as e:
+                print(f"Error writing metadata file {metadata_path}: {e}")
+                self.remove_files(image_path, metadata_path, metadata)
+        if self.fsync_policy != "none":
+            self.sync_dirs(metadata_path for _, metadata_path, _ in batch)
+
+    def sync_image(self, item):
+        image_path, metadata_path, metadata = item
+        try:
+            fsync_path(image_path)
+            return True
+        except Exception as e:
+            print(f"Error syncing image file {image_path}: {e}")
+            self.remove_files(image_path, metadata_path, metadata)
+            return False
+
+    def sync_dirs(self, paths):
+        for dir_path in {os.path.dirname(path) for path in paths}:
+            try:
+                fsync_dir(dir_path)
+            except Exception as e:
+                print(f"Error syncing directory {dir_path}: {e}")
+
+    def remove_files(self, image_path, metadata_path, metadata):
+        with self.failures_lock:
+            self.failures.append((image_path, metadata_path, metadata))
+        for path in (image_path, metadata_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Error deleting file {path}: {e}")
+
+    @property
+    def error_count(self):
+        return len(self.failures)
+
+    def get_failures(self, start=0):
+        # The failed writes from index start on, so each caller can keep track of the ones it has already accounted for.
+        with self.failures_lock:
+            return self.failures[start:]
+
+    def flush(self, failures_start=0):
+        # Blocks until everything submitted so far is written, without stopping the writer, returns get_failures(failures_start) after that.
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait()
+        return self.get_failures(failures_start)
+
+    def close(self):
+        # Blocks until everything submitted so far is written.
+        self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,255 @@
+import os
+import json
+import math
+import time
+import threading
+from typing import Optional
+from collections import deque
+from dataclasses import dataclass, field
+
+class RollingWindow:
+
+    def __init__(self, size=1000):
+        self.values = deque(maxlen=size)
+
+    def add(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def percentile(self, percent):
+        if not self.values:
+            return None
+        sorted_values = sorted(self.values)
+        return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+    def get_text(self, unit="s"):
+        p50 = self.percentile(50)
+        if p50 is None:
+            return "-"
+        return f"{p50:.2f}/{self.percentile(95):.2f}{unit}"
+
+class Histogram:
+    # Log spaced buckets so memory stays constant no matter how many values are added.
+
+    def __init__(self, min_value=1e-4, max_value=1e4, buckets_per_decade=20):
+        self.min_value = min_value
+        self.buckets_per_decade = buckets_per_decade
+        self.bucket_count = math.ceil(math.log10(max_value / min_value) * buckets_per_decade) + 2
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value <= self.min_value:
+            index = 0
+        else:
+            index = min(self.bucket_count - 1, 1 + int(math.log10(value / self.min_value) * self.buckets_per_decade))
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        if self.count <= 0:
+            return None
+        target = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count > 0:
+                # Upper bound of the bucket, capped by the largest value seen.
+                return min(self.max, self.min_value * 10 ** (index / self.buckets_per_decade))
+        return self.max
+
+    def get_text(self, unit="s"):
+        if self.count <= 0:
+            return "-"
+        return f"{self.percentile(50):.3f}/{self.percentile(95):.3f}/{self.max:.3f}{unit}"
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.total, "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99), "max": self.max}
+
+class JsonlSink:
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf8")
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def format_count(count):
+    for unit in ("", "k", "M", "B"):
+        if abs(count) < 1000:
+            return f"{count:.0f}{unit}" if unit == "" else f"{count:.1f}{unit}"
+        count /= 1000
+    return f"{count:.1f}T"
+
+@dataclass
+class LLMTagMetrics:
+    sink: Optional[JsonlSink] = None
+    encode_time: RollingWindow = field(default_factory=RollingWindow)
+    ttfb: RollingWindow = field(default_factory=RollingWindow)
+    latency: RollingWindow = field(default_factory=RollingWindow)
+    write_time: RollingWindow = field(default_factory=RollingWindow)
+    request_count: int = 0
+    failed_count: int = 0
+    cache_hit_count: int = 0
+    retry_count: int = 0
+    payload_bytes: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    finish_reason_counts: dict[str, int] = field(default_factory=dict)
+
+    def record(self, request_metrics):
+        self.request_count += 1
+        if request_metrics.get("status") != "ok":
+            self.failed_count += 1
+        if request_metrics.get("cache_hit"):
+            self.cache_hit_count += 1
+        self.encode_time.add(request_metrics.get("encode_time"))
+        self.ttfb.add(request_metrics.get("ttfb"))
+        self.latency.add(request_metrics.get("latency"))
+        self.write_time.add(request_metrics.get("write_time"))
+        self.retry_count += request_metrics.get("retries") or 0
+        self.payload_bytes += request_metrics.get("payload_bytes") or 0
+        self.prompt_tokens += request_metrics.get("prompt_tokens") or 0
+        self.completion_tokens += request_metrics.get("completion_tokens") or 0
+        finish_reason = request_metrics.get("finish_reason")
+        if finish_reason is not None:
+            self.finish_reason_counts[finish_reason] = self.finish_reason_counts.get(finish_reason, 0) + 1
+        if self.sink is not None:
+            self.sink.write({"time": time.time(), **request_metrics})
+
+    def get_postfix_text(self):
+        return (
+            f"lat p50/95 {self.latency.get_text()} ttfb {self.ttfb.get_text()} enc {self.encode_time.get_text()} write {self.write_time.get_text()} "
+            f"tok {format_count(self.prompt_tokens)}->{format_count(self.completion_tokens)} retries {self.retry_count}"
+        )
+
+    def get_summary_text(self):
+        finish_reasons_text = ", ".join(f"{k}: {v}" for k, v in sorted(self.finish_reason_counts.items())) or "none"
+        return (
+            f"{self.request_count} requests ({self.failed_count} failed, {self.cache_hit_count} cache hits, {self.retry_count} retries), "
+            f"{format_count(self.prompt_tokens)} prompt tokens, {format_count(self.completion_tokens)} completion tokens, "
+            f"{self.payload_bytes / 1024 / 1024:.1f}MiB sent, latency p50/95 {self.latency.get_text()}, TTFB p50/95 {self.ttfb.get_text()}, "
+            f"encode p50/95 {self.encode_time.get_text()}, write p50/95 {self.write_time.get_text()}, finish reasons: {finish_reasons_text}"
+        )
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+
+SCRAPE_STAGES = ("query", "download", "validate", "encode", "write") # Validate decodes and resizes, encode is the CPU of saving in the output format and write only the disk.
+
+class ScrapeMetrics:
+
+    def __init__(self, jsonl_sink=None, prometheus_path=None, interval=1000):
+        self.jsonl_sink = jsonl_sink
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stage_histograms = {stage: Histogram() for stage in SCRAPE_STAGES}
+        self.total_bytes = 0
+        self.retry_count = 0
+        self.error_counts: dict[str, int] = {}
+        self.skip_counts: dict[str, int] = {}
+        self.metadata_error_count = 0 # Images the metadata writer removed after they were counted as scraped.
+        self.interval_start_time = time.time()
+        self.interval_bytes = 0
+        self.last_export_image_count = 0
+
+    def observe(self, stage, seconds):
+        self.stage_histograms[stage].add(seconds)
+
+    def add_bytes(self, byte_count):
+        with self.lock:
+            self.total_bytes += byte_count
+            self.interval_bytes += byte_count
+
+    def count_retry(self):
+        with self.lock:
+            self.retry_count += 1
+
+    def count_error(self, error):
+        name = error.__class__.__name__
+        with self.lock:
+            self.error_counts[name] = self.error_counts.get(name, 0) + 1
+
+    def count_skip(self, reason):
+        with self.lock:
+            self.skip_counts[reason] = self.skip_counts.get(reason, 0) + 1
+
+    def count_metadata_errors(self, count):
+        with self.lock:
+            self.metadata_error_count += count
+
+    def should_export(self, scraped_image_count):
+        return scraped_image_count % self.interval == 0
+
+    def export(self, scraped_image_count, max_scrape_count=None):
+        now = time.time()
+        with self.lock:
+            elapsed = max(now - self.interval_start_time, 1e-9)
+            bytes_per_second = self.interval_bytes / elapsed
+            snapshot = {
+                "time": now, "scraped_image_count": scraped_image_count, "interval_seconds": elapsed, "bytes_per_second": bytes_per_second,
+                "total_bytes": self.total_bytes, "retries": self.retry_count, "errors": dict(self.error_counts), "skips": dict(self.skip_counts),
+                "metadata_errors": self.metadata_error_count,
+                "stages": {stage: histogram.to_dict() for stage, histogram in self.stage_histograms.items()},
+            }
+            stages_text = " | ".join(f"{stage.capitalize()} p50/p95/max: {histogram.get_text()}" for stage, histogram in self.stage_histograms.items())
+            for histogram in self.stage_histograms.values():
+                histogram.reset()
+            self.interval_start_time = now
+            self.interval_bytes = 0
+            interval_image_count = scraped_image_count - self.last_export_image_count
+            self.last_export_image_count = scraped_image_count
+        print(
+            f"Scraped {scraped_image_count}/{max_scrape_count} images,",
+            f"stats for the last {interval_image_count} images: [{stages_text} | {bytes_per_second / 1024 / 1024:.2f}MiB/s |",
+            f"Retries: {snapshot['retries']} | Errors: {snapshot['errors'] or 'none'} | Skips: {snapshot['skips'] or 'none'} | Metadata errors: {snapshot['metadata_errors']}]",
+        )
+        if self.jsonl_sink is not None:
+            self.jsonl_sink.write(snapshot)
+        if self.prometheus_path is not None:
+            self.write_prometheus_textfile(snapshot)
+
+    def write_prometheus_textfile(self, snapshot):
+        lines = [
+            "# TYPE aisp_scraped_images_total counter", f"aisp_scraped_images_total {snapshot['scraped_image_count']}",
+            "# TYPE aisp_downloaded_bytes_total counter", f"aisp_downloaded_bytes_total {snapshot['total_bytes']}",
+            "# TYPE aisp_download_bytes_per_second gauge", f"aisp_download_bytes_per_second {snapshot['bytes_per_second']}",
+            "# TYPE aisp_retries_total counter", f"aisp_retries_total {snapshot['retries']}",
+            "# TYPE aisp_errors_total counter", *(f"aisp_errors_total{{class=\"{k}\"}} {v}" for k, v in snapshot["errors"].items()),
+            "# TYPE aisp_skips_total counter", *(f"aisp_skips_total{{reason=\"{k}\"}} {v}" for k, v in snapshot["skips"].items()),
+            "# TYPE aisp_metadata_errors_total counter", f"aisp_metadata_errors_total {snapshot['metadata_errors']}",
+            "# TYPE aisp_stage_seconds gauge",
+        ]
+        for stage, stage_dict in snapshot["stages"].items():
+            if stage_dict["count"] <= 0:
+                continue
+            for quantile in ("p50", "p95", "p99", "max"):
+                lines.append(f"aisp_stage_seconds{{stage=\"{stage}\",quantile=\"{quantile}\"}} {stage_dict[quantile]}")
+        # Written to a temp file first so the exporter never reads a partial file.
+        temp_path = self.prometheus_path + ".tmp"
+        with open(temp_path, "w", encoding="utf8") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prometheus_path)
+
+    def close(self):
+        if self.jsonl_sink is not None:
+            self.jsonl_sink.close()
@@ -0,0 +1,66 @@
+import os
+import json
+import asyncio
+import aiohttp
+
+TERMINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def get_auth_headers(api_key):
+    return None if api_key is None else {"Authorization": "Bearer " + api_key}
+
+class APIResponseError(RuntimeError):
+
+    def __init__(self, status, text, retry_after=None):
+        super().__init__(f"API responded status code {status}, raw response: {text}")
+        self.status = status
+        self.retry_after = retry_after # Seconds from the Retry-After header, None if it's missing.
+
+async def check_api_response(response):
+    if response.status < 200 or response.status >= 300:
+        retry_after = response.headers.get("Retry-After")
+        retry_after = float(retry_after) if retry_after is not None and retry_after.replace(".", "", 1).isdecimal() else None
+        raise APIResponseError(response.status, await response.text(), retry_after)
+
+async def upload_batch_file(session, api_url, api_key, batch_file_path):
+    with open(batch_file_path, "rb") as batch_file:
+        form = aiohttp.FormData()
+        form.add_field("purpose", "batch")
+        form.add_field("file", batch_file, filename=os.path.basename(batch_file_path), content_type="application/jsonl")
+        async with session.post(api_url + "/files", headers=get_auth_headers(api_key), data=form) as response:
+            await check_api_response(response)
+            return (await response.json())["id"]
+
+async def create_batch(session, api_url, api_key, input_file_id, endpoint, completion_window="24h"):
+    async with session.post(api_url + "/batches", headers=get_auth_headers(api_key), json={
+        "input_file_id": input_file_id, "endpoint": endpoint, "completion_window": completion_window,
+    }) as response:
+        await check_api_response(response)
+        return await response.json()
+
+async def get_batch(session, api_url, api_key, batch_id):
+    async with session.get(api_url + "/batches/" + batch_id, headers=get_auth_headers(api_key)) as response:
+        await check_api_response(response)
+        return await response.json()
+
+async def wait_for_batch(session, api_url, api_key, batch_id, poll_interval):
+    while True:
+        try:
+            batch = await get_batch(session, api_url, api_key, batch_id)
+            if batch["status"] in TERMINAL_BATCH_STATUSES:
+                return batch
+        except Exception as e:
+            print(f"A {e.__class__.__name__} occurred while polling batch {batch_id}: {e}")
+        await asyncio.sleep(poll_interval)
+
+async def iter_file_jsonl(session, api_url, api_key, file_id):
+    async with session.get(api_url + "/files/" + file_id + "/content", headers=get_auth_headers(api_key)) as response:
+        await check_api_response(response)
+        buffer = b""
+        async for chunk in response.content.iter_any(): # Result lines can exceed the line length limit of readline.
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if buffer.strip():
+            yield json.loads(buffer)
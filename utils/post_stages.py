@@ -0,0 +1,422 @@
+import os
+import random
+import hashlib
+import threading
+from .profiler import profile_call
+from .tag_filter import TagFilter
+from .json_codec import Metadata, dumps_json, loads_json, load_json_file, load_metadata
+from .utils import get_image_id_image_metadata_path_tuple_dict
+
+POST_STAGE_NAMES = ("caption", "tag_counts", "hash", "tag_ids")
+
+def get_post_stage_state_path(state_dir, name):
+    return os.path.join(state_dir, name + ".json")
+
+def get_post_stage_journal_path(state_dir, name):
+    return os.path.join(state_dir, name + ".jsonl")
+
+def load_post_stage(stage, state_dir):
+    # The compacted state, then the records journaled since, returns whether there was any.
+    state_path = get_post_stage_state_path(state_dir, stage.name)
+    journal_path = get_post_stage_journal_path(state_dir, stage.name)
+    stage.load_state(load_json_file(state_path) if os.path.isfile(state_path) else None)
+    if os.path.isfile(journal_path):
+        with open(journal_path, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    record = loads_json(line)
+                except ValueError: # Can be a partially written last line after a crash.
+                    continue
+                stage.replay(record)
+    return os.path.isfile(state_path) or os.path.isfile(journal_path)
+
+def load_tag_counts(state_dir):
+    # State of the tag_counts stage, or None if it never ran.
+    stage = TagCountStage()
+    if not load_post_stage(stage, state_dir):
+        return None
+    return {"image_ids": stage.image_ids, "counts": stage.counts}
+
+class PostStage:
+    # Runs on each image right after it's saved, with its metadata still in memory.
+    # process is called from several validation workers at once, so stages keep their state behind self.lock.
+    # Checkpoints only append the records of the images processed since the last one to a journal, the full state is written when compacting at start and close.
+
+    name = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = [] # JSON serializable records for the journal, added with self.lock held.
+
+    def load_state(self, state):
+        pass
+
+    def replay(self, record):
+        pass
+
+    def take_records(self):
+        # Called with self.lock held.
+        records = self.records
+        self.records = []
+        return records
+
+    def get_state(self):
+        # JSON serializable full state for compacting, None if there's nothing to keep.
+        return None
+
+    def discard(self, image_id, metadata, metadata_path):
+        # Called with self.lock held, for an image processed before its metadata failed to write, its image and metadata files are already removed.
+        pass
+
+    def start(self, image_dirs):
+        pass
+
+    def process(self, image_id, metadata, image_data, image_path, metadata_path):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def get_stats_text(self):
+        return self.name
+
+class CaptionStage(PostStage):
+    # The TXT tags convert.py makes, so it only has to run to delete the JSON metadata.
+
+    name = "caption"
+
+    def __init__(self, exclude=None, include=None, no_rating_prefix=False):
+        super().__init__()
+        self.tag_filter = TagFilter(exclude, include, no_rating_prefix)
+        self.written_count = 0
+
+    def process(self, image_id, metadata, image_data, image_path, metadata_path):
+        tags = self.tag_filter.get_tags(metadata)
+        random.shuffle(tags)
+        with open(os.path.splitext(metadata_path)[0] + ".txt", "w", encoding="utf8") as tags_file:
+            tags_file.write(", ".join(tag.replace("_", " ") for tag in tags))
+        with self.lock:
+            self.written_count += 1
+
+    def discard(self, image_id, metadata, metadata_path):
+        try:
+            os.remove(os.path.splitext(metadata_path)[0] + ".txt")
+            self.written_count -= 1
+        except FileNotFoundError:
+            pass
+
+    def get_stats_text(self):
+        return f"{self.written_count} captions written"
+
+class TagCountStage(PostStage):
+    # Image count of each tag like make_model_tags.py counts, grouped by tag type so its include and exclude still apply,
+    # with the counted image IDs so it can tell whether the counts cover the image dir.
+
+    name = "tag_counts"
+
+    def __init__(self):
+        super().__init__()
+        self.tag_filter = TagFilter()
+        self.image_ids = set()
+        self.counts = {} # Key: Tag type, Value: {Tag: Image count}.
+        self.loaded = False
+
+    def load_state(self, state):
+        if state is None:
+            return
+        self.image_ids = set(state["image_ids"])
+        self.counts = state["counts"]
+        self.loaded = True
+
+    def replay(self, record):
+        self.add(*record)
+        self.loaded = True
+
+    def get_state(self):
+        return {"image_ids": list(self.image_ids), "counts": self.counts}
+
+    def start(self, image_dirs):
+        if self.loaded:
+            return
+        # The images scraped before the first run are counted once here, so the counts cover every image from then on.
+        for image_dir in image_dirs:
+            for image_id, (_, metadata_path) in get_image_id_image_metadata_path_tuple_dict(image_dir).items():
+                self.add(image_id, self.tag_filter.get_type_tags_dict(load_metadata(metadata_path)))
+
+    def add(self, image_id, type_tags_dict, journal=False):
+        with self.lock:
+            if image_id in self.image_ids: # Scraped again after a crash lost its metadata, or replayed after a crash halfway through compacting.
+                return
+            self.image_ids.add(image_id)
+            for tag_type, type_tags in type_tags_dict.items():
+                tag_count_dict = self.counts.setdefault(tag_type, {})
+                for tag in type_tags:
+                    tag_count_dict[tag] = tag_count_dict.get(tag, 0) + 1
+            if journal:
+                self.records.append([image_id, type_tags_dict])
+
+    def process(self, image_id, metadata, image_data, image_path, metadata_path):
+        self.add(image_id, self.tag_filter.get_type_tags_dict(metadata), True)
+
+    def discard(self, image_id, metadata, metadata_path):
+        if image_id not in self.image_ids:
+            return
+        self.image_ids.remove(image_id)
+        for tag_type, type_tags in self.tag_filter.get_type_tags_dict(metadata).items():
+            tag_count_dict = self.counts.get(tag_type, {})
+            for tag in type_tags:
+                if tag_count_dict.get(tag, 0) > 1:
+                    tag_count_dict[tag] -= 1
+                else:
+                    tag_count_dict.pop(tag, None)
+
+    def get_stats_text(self):
+        return f"{len(self.image_ids)} images tag counted"
+
+class HashStage(PostStage):
+    # SHA-256 of the downloaded bytes before any resizing or conversion, to find the same image posted under several IDs.
+
+    name = "hash"
+
+    def __init__(self):
+        super().__init__()
+        self.image_id_hash_dict = {}
+        self.hash_image_id_dict = {}
+        self.duplicate_count = 0
+
+    def load_state(self, state):
+        if state is None:
+            return
+        self.image_id_hash_dict = state["hashes"]
+        for image_id, digest in self.image_id_hash_dict.items():
+            self.hash_image_id_dict.setdefault(digest, image_id)
+
+    def replay(self, record):
+        image_id, digest = record
+        self.image_id_hash_dict[image_id] = digest
+        self.hash_image_id_dict.setdefault(digest, image_id)
+
+    def get_state(self):
+        return {"hashes": self.image_id_hash_dict}
+
+    def process(self, image_id, metadata, image_data, image_path, metadata_path):
+        digest = hashlib.sha256(image_data).hexdigest() # Outside the lock, as hashlib releases the GIL for large inputs.
+        with self.lock:
+            self.image_id_hash_dict[image_id] = digest
+            self.records.append([image_id, digest])
+            if self.hash_image_id_dict.setdefault(digest, image_id) != image_id:
+                self.duplicate_count += 1
+                print(f"Image {image_id} has the same content as image {self.hash_image_id_dict[digest]}.")
+
+    def discard(self, image_id, metadata, metadata_path):
+        digest = self.image_id_hash_dict.pop(image_id, None)
+        if digest is not None and self.hash_image_id_dict.get(digest) == image_id:
+            del self.hash_image_id_dict[digest]
+
+    def get_stats_text(self):
+        return f"{len(self.image_id_hash_dict)} images hashed, {self.duplicate_count} duplicates found"
+
+class TagIdStage(PostStage):
+    # Tag ID rows of the new images, merged into the tag ID arrays of make_tag_ids.py when the scraper finishes.
+
+    name = "tag_ids"
+
+    def __init__(self, vocabulary, tag_ids_dir):
+        super().__init__()
+        self.vocabulary = vocabulary
+        self.vocabulary_fingerprint = vocabulary.get_fingerprint() # Kept as it hashes the whole vocabulary.
+        self.tag_id_dict = vocabulary.get_tag_id_dict()
+        self.tag_ids_dir = tag_ids_dir
+        self.tag_filter = TagFilter()
+        self.rows = {} # Key: Image ID, Value: (Metadata path, Sorted tag IDs).
+        self.merged_count = 0
+        self.state_matches = False
+
+    def load_state(self, state):
+        # Rows left by a run which didn't finish, dropped if the model tags changed since.
+        self.state_matches = state is not None and state["vocabulary"] == self.vocabulary_fingerprint
+        if self.state_matches:
+            self.rows = {image_id: tuple(row) for image_id, row in state["rows"].items()}
+
+    def replay(self, record):
+        # The journal always follows a state compacted by the same run, so its records are dropped together with its rows.
+        if self.state_matches:
+            image_id, metadata_path, tag_ids = record
+            self.rows[image_id] = (metadata_path, tag_ids)
+
+    def get_state(self):
+        return {"vocabulary": self.vocabulary_fingerprint, "rows": self.rows}
+
+    def process(self, image_id, metadata, image_data, image_path, metadata_path):
+        if not image_id.isdecimal():
+            return
+        tag_ids = sorted({self.tag_id_dict[tag] for tag in self.tag_filter.get_tags(metadata) if tag in self.tag_id_dict})
+        with self.lock:
+            self.rows[image_id] = (metadata_path, tag_ids)
+            self.records.append([image_id, metadata_path, tag_ids])
+
+    def discard(self, image_id, metadata, metadata_path):
+        self.rows.pop(image_id, None)
+
+    def finish(self):
+        # Called after every metadata file is written, as the rows need their mtimes.
+        import numpy as np
+        from .tag_id_arrays import TagIdArrays, load_tag_id_arrays, save_tag_id_arrays
+        with self.lock:
+            if not self.rows:
+                return
+            new_rows = {}
+            for image_id, (metadata_path, tag_ids) in self.rows.items():
+                try:
+                    new_rows[int(image_id)] = (os.stat(metadata_path).st_mtime_ns, np.array(tag_ids, dtype=np.int32))
+                except FileNotFoundError: # Its metadata failed to write.
+                    continue
+            rows = []
+            old_tag_id_arrays = load_tag_id_arrays(self.tag_ids_dir, self.vocabulary, mmap=False)
+            if old_tag_id_arrays is not None:
+                for row, image_id in enumerate(old_tag_id_arrays.image_ids.tolist()):
+                    if image_id not in new_rows:
+                        rows.append((image_id, int(old_tag_id_arrays.mtimes[row]), old_tag_id_arrays.get_row_tag_ids(row)))
+            rows += [(image_id, mtime, tag_ids) for image_id, (mtime, tag_ids) in new_rows.items()]
+            rows.sort(key=lambda x: x[0])
+            indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+            np.cumsum([len(tag_ids) for _, _, tag_ids in rows], out=indptr[1:])
+            save_tag_id_arrays(self.tag_ids_dir, TagIdArrays(
+                np.array([image_id for image_id, _, _ in rows], dtype=np.int64), np.array([mtime for _, mtime, _ in rows], dtype=np.int64), indptr,
+                np.concatenate([tag_ids for _, _, tag_ids in rows]).astype(np.int32, copy=False) if rows else np.empty(0, dtype=np.int32),
+            ), self.vocabulary)
+            self.merged_count += len(new_rows)
+            self.rows.clear()
+
+    def get_stats_text(self):
+        return f"{self.merged_count} rows merged into the tag ID arrays"
+
+class PostStages:
+    # Runs the stages on each image in the validation worker that saved it and journals their new records into state_dir every checkpoint_interval images,
+    # so they pick up where they left off after a crash and the offline passes over the whole image dir aren't needed.
+
+    def __init__(self, stages, state_dir, metadata_writer=None, checkpoint_interval=1000):
+        self.stages = stages
+        self.state_dir = state_dir
+        self.metadata_writer = metadata_writer
+        self.checkpoint_interval = checkpoint_interval
+        self.processed_count = 0
+        self.count_lock = threading.Lock()
+        self.checkpoint_lock = threading.Lock()
+        self.metadata_failure_count = 0 # Failed metadata writes already discarded from the stages.
+        os.makedirs(state_dir, exist_ok=True)
+        for stage in stages:
+            load_post_stage(stage, state_dir)
+
+    def start(self, image_dirs):
+        for stage in self.stages:
+            stage.start(image_dirs)
+        self.compact()
+
+    def process(self, metadata, image_data, image_path, metadata_path):
+        # Errors are only printed, a stage failing shouldn't throw away an image which was saved fine.
+        if isinstance(metadata, str):
+            metadata = Metadata.from_dict(loads_json(metadata))
+        image_id = os.path.splitext(os.path.basename(metadata_path))[0] # Same as the image dir listings use.
+        for stage in self.stages:
+            try:
+                profile_call("post_stage_" + stage.name, stage.process, image_id, metadata, image_data, image_path, metadata_path)
+            except Exception as e:
+                print(f"Error running post stage {stage.name} on image {image_id}: {e}")
+        with self.count_lock:
+            self.processed_count += 1
+            should_checkpoint = self.processed_count % self.checkpoint_interval == 0
+        if should_checkpoint:
+            self.checkpoint()
+
+    def checkpoint(self, flush=True):
+        if not self.checkpoint_lock.acquire(blocking=False): # Another worker is already on it.
+            return
+        try:
+            stage_records = []
+            for stage in self.stages:
+                with stage.lock:
+                    stage_records.append((stage.name, stage.take_records()))
+            # Flushed after taking the records, so the journal never has an image whose metadata isn't written yet or failed to write.
+            if self.metadata_writer is not None:
+                failed_image_ids = self.discard_metadata_failures(self.metadata_writer.flush(self.metadata_failure_count) if flush else self.metadata_writer.get_failures(self.metadata_failure_count))
+            else:
+                failed_image_ids = set()
+            for name, records in stage_records:
+                # Serialized outside the lock, the stage doesn't touch the records it handed over.
+                journal_text = "".join(dumps_json(record) + "\n" for record in records if record[0] not in failed_image_ids)
+                if not journal_text:
+                    continue
+                with open(get_post_stage_journal_path(self.state_dir, name), "a", encoding="utf8") as journal_file:
+                    journal_file.write(journal_text)
+        except Exception as e:
+            print(f"Error checkpointing the post stages: {e}")
+        finally:
+            self.checkpoint_lock.release()
+
+    def discard_metadata_failures(self, failures):
+        # Takes the images the metadata writer removed back out of the stages, failures from get_failures(self.metadata_failure_count), returns their image IDs.
+        self.metadata_failure_count += len(failures)
+        image_ids = set()
+        for _, metadata_path, metadata in failures:
+            image_id = os.path.splitext(os.path.basename(metadata_path))[0]
+            image_ids.add(image_id)
+            metadata = Metadata.from_dict(loads_json(metadata))
+            for stage in self.stages:
+                try:
+                    with stage.lock:
+                        stage.records = [record for record in stage.records if record[0] != image_id]
+                        stage.discard(image_id, metadata, metadata_path)
+                except Exception as e:
+                    print(f"Error discarding image {image_id} from post stage {stage.name}: {e}")
+        return image_ids
+
+    def compact(self):
+        # Writes the full state of each stage and empties its journal, only at start and close when no workers are running, as it's as large as the state.
+        # A crash between the two replays records the state already has, which the stages ignore.
+        for stage in self.stages:
+            try:
+                with stage.lock:
+                    state = stage.get_state()
+                    stage.take_records()
+                if state is not None:
+                    state_path = get_post_stage_state_path(self.state_dir, stage.name)
+                    with open(state_path + ".tmp", "w", encoding="utf8") as state_file:
+                        state_file.write(dumps_json(state))
+                    os.replace(state_path + ".tmp", state_path)
+                journal_path = get_post_stage_journal_path(self.state_dir, stage.name)
+                if os.path.isfile(journal_path):
+                    os.remove(journal_path)
+            except Exception as e:
+                print(f"Error compacting post stage {stage.name}: {e}")
+
+    def close(self):
+        # Must be called after the metadata writer is closed.
+        if self.metadata_writer is not None:
+            self.discard_metadata_failures(self.metadata_writer.get_failures(self.metadata_failure_count))
+        for stage in self.stages:
+            try:
+                stage.finish()
+            except Exception as e:
+                print(f"Error finishing post stage {stage.name}: {e}")
+        self.compact()
+
+    def get_stats_text(self):
+        return ", ".join(stage.get_stats_text() for stage in self.stages)
+
+def make_post_stages(names, state_dir, metadata_writer=None, checkpoint_interval=1000, model_tags_path=None, tag_ids_dir=None):
+    stages = []
+    for name in names:
+        match name:
+            case "caption":
+                stages.append(CaptionStage())
+            case "tag_counts":
+                stages.append(TagCountStage())
+            case "hash":
+                stages.append(HashStage())
+            case "tag_ids":
+                from .tag_vocabulary import load_tag_vocabulary
+                stages.append(TagIdStage(load_tag_vocabulary(model_tags_path), tag_ids_dir))
+            case _:
+                raise ValueError(f"Unknown post stage \"{name}\", must be one of {', '.join(POST_STAGE_NAMES)}!")
+    return PostStages(stages, state_dir, metadata_writer, checkpoint_interval)
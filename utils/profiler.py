@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import atexit
+import argparse
+import threading
+from collections import Counter
+from .json_codec import dumps_json
+
+ACTIVE_PROFILER = None
+FOLDED_STACKS_FILENAME = "stacks.folded"
+STAGES_FILENAME = "stages.json"
+MEMORY_FILENAME = "memory.txt"
+# (File name, Function name) of the leaf frames of threads blocked waiting, left out of the top frames of the summary but kept in the stacks.
+IDLE_FRAMES = {("threading.py", "wait"), ("selectors.py", "select"), ("thread.py", "_worker"), ("queue.py", "get")}
+
+def non_negative_float(value):
+    value = float(value)
+    if value < 0:
+        raise argparse.ArgumentTypeError("must be greater than or equal to 0")
+    return value
+
+def add_profile_args(parser):
+    parser.add_argument("--profile", metavar="PROFILE_DIR", help=f"Profile this run into this directory: sampled stacks of every thread in \"{FOLDED_STACKS_FILENAME}\" for flamegraph.pl or speedscope, wall and CPU time of the pipeline stages in \"{STAGES_FILENAME}\" and memory snapshots in \"{MEMORY_FILENAME}\", with a summary printed at exit, default to not profiling")
+    parser.add_argument("--profile-interval", type=non_negative_float, default=0.02, help="Seconds between stack samples when profiling, 0 to not sample, default to 0.02")
+    parser.add_argument("--profile-memory-interval", type=non_negative_float, default=0, help="Seconds between tracemalloc snapshots when profiling, tracing slows down allocation heavy code a lot so it's only for looking into memory use, default to 0 for not tracing")
+
+class StageStats:
+
+    def __init__(self):
+        self.count = 0
+        self.wall_time = 0.0
+        self.max_wall_time = 0.0
+        self.cpu_time = None # Only for stages running in their own thread, as coroutines share theirs.
+
+    def add(self, wall_time, cpu_time=None):
+        self.count += 1
+        self.wall_time += wall_time
+        self.max_wall_time = max(self.max_wall_time, wall_time)
+        if cpu_time is not None:
+            self.cpu_time = (self.cpu_time or 0.0) + cpu_time
+
+    def to_dict(self):
+        return {"count": self.count, "wall_time": self.wall_time, "mean_wall_time": self.wall_time / max(self.count, 1), "max_wall_time": self.max_wall_time, "cpu_time": self.cpu_time}
+
+class Profiler:
+
+    def __init__(self, profile_dir, sample_interval=0.02, memory_interval=0, top_count=20):
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.memory_interval = memory_interval
+        self.top_count = top_count
+        self.stage_stats_dict = {}
+        self.stage_lock = threading.Lock()
+        # Key: (Thread name, Code objects from the outermost frame in), Value: Sample count. Formatted only at exit to keep sampling cheap.
+        self.stack_counts = Counter()
+        self.sample_count = 0
+        self.memory_snapshot_count = 0
+        self.last_memory_statistics = []
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.start_time = None
+        self.start_cpu_time = None
+
+    def record(self, stage, wall_time, cpu_time=None):
+        with self.stage_lock:
+            stage_stats = self.stage_stats_dict.get(stage)
+            if stage_stats is None:
+                stage_stats = self.stage_stats_dict[stage] = StageStats()
+            stage_stats.add(wall_time, cpu_time)
+
+    def sample(self):
+        profiler_thread_ids = {thread.ident for thread in self.threads}
+        thread_names = {}
+        next_thread_names_time = 0
+        while not self.stop_event.wait(self.sample_interval):
+            now = time.monotonic()
+            if now >= next_thread_names_time:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                next_thread_names_time = now + 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in profiler_thread_ids:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                self.stack_counts[(thread_names.get(thread_id, str(thread_id)), tuple(codes))] += 1
+            self.sample_count += 1
+
+    def snapshot_memory(self):
+        import tracemalloc
+        with open(os.path.join(self.profile_dir, MEMORY_FILENAME), "w", encoding="utf8") as memory_file:
+            while not self.stop_event.wait(self.memory_interval):
+                self.write_memory_snapshot(memory_file)
+            self.write_memory_snapshot(memory_file)
+        tracemalloc.stop()
+
+    def write_memory_snapshot(self, memory_file):
+        # Written as they're taken, so a run which gets killed still leaves its snapshots.
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        current_size, peak_size = tracemalloc.get_traced_memory()
+        self.memory_snapshot_count += 1
+        self.last_memory_statistics = snapshot.statistics("lineno")[:self.top_count]
+        memory_file.write(f"Snapshot {self.memory_snapshot_count} at {time.perf_counter() - self.start_time:.1f}s, traced {current_size / 1024 / 1024:.1f}MiB, peak {peak_size / 1024 / 1024:.1f}MiB:\n")
+        for statistic in self.last_memory_statistics:
+            memory_file.write(f"  {statistic}\n")
+        memory_file.flush()
+
+    def start(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.start_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+        if self.sample_interval > 0:
+            self.threads.append(threading.Thread(target=self.sample, name="profiler_sampler", daemon=True))
+        if self.memory_interval > 0:
+            import tracemalloc
+            tracemalloc.start()
+            self.threads.append(threading.Thread(target=self.snapshot_memory, name="profiler_memory", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    @staticmethod
+    def get_frame_name(code):
+        # co_qualname is Python 3.11+.
+        return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        wall_time = time.perf_counter() - self.start_time
+        cpu_time = time.process_time() - self.start_cpu_time
+        self_counts = Counter()
+        idle_count = 0
+        with open(os.path.join(self.profile_dir, FOLDED_STACKS_FILENAME), "w", encoding="utf8") as folded_stacks_file:
+            for (thread_name, codes), count in self.stack_counts.items():
+                frame_names = [self.get_frame_name(code) for code in codes]
+                folded_stacks_file.write(";".join([thread_name, *frame_names]).replace(" ", "_") + f" {count}\n")
+                if not codes:
+                    continue
+                if (os.path.basename(codes[-1].co_filename), codes[-1].co_name) in IDLE_FRAMES:
+                    idle_count += count
+                else:
+                    self_counts[frame_names[-1]] += count
+        with self.stage_lock:
+            stages = {stage: stage_stats.to_dict() for stage, stage_stats in self.stage_stats_dict.items()}
+        with open(os.path.join(self.profile_dir, STAGES_FILENAME), "w", encoding="utf8") as stages_file:
+            stages_file.write(dumps_json({"wall_time": wall_time, "cpu_time": cpu_time, "sample_count": self.sample_count, "stages": stages}))
+
+        print(f"Profile summary, {wall_time:.1f}s wall, {cpu_time:.1f}s CPU, written to \"{self.profile_dir}\":")
+        for stage, stage_dict in sorted(stages.items(), key=lambda x: x[1]["wall_time"], reverse=True)[:self.top_count]:
+            cpu_text = f", {stage_dict['cpu_time']:.2f}s CPU" if stage_dict["cpu_time"] is not None else ""
+            print(f"  Stage {stage}: {stage_dict['count']} calls, {stage_dict['wall_time']:.2f}s wall, mean {stage_dict['mean_wall_time'] * 1000:.1f}ms, max {stage_dict['max_wall_time'] * 1000:.1f}ms{cpu_text}")
+        total_sample_count = sum(self_counts.values()) + idle_count
+        if total_sample_count > 0:
+            print(f"  {idle_count / total_sample_count * 100:5.1f}% of thread samples idle waiting")
+        for frame_name, count in self_counts.most_common(self.top_count):
+            print(f"  {count / total_sample_count * 100:5.1f}% of thread samples in {frame_name}")
+        for statistic in self.last_memory_statistics:
+            print(f"  Memory {statistic}")
+
+def start_profiling(profile_dir, sample_interval=0.02, memory_interval=0):
+    # Profiles until the interpreter exits, does nothing if profile_dir is None.
+    global ACTIVE_PROFILER
+    if profile_dir is None or ACTIVE_PROFILER is not None:
+        return ACTIVE_PROFILER
+    ACTIVE_PROFILER = Profiler(profile_dir, sample_interval, memory_interval)
+    ACTIVE_PROFILER.start()
+    atexit.register(ACTIVE_PROFILER.stop)
+    return ACTIVE_PROFILER
+
+async def time_coroutine(stage, coroutine):
+    start_time = time.perf_counter()
+    try:
+        return await coroutine
+    finally:
+        ACTIVE_PROFILER.record(stage, time.perf_counter() - start_time)
+
+def profile_coroutine(stage, coroutine):
+    # Wall time of the coroutine, the coroutine is returned as is when not profiling.
+    if ACTIVE_PROFILER is None:
+        return coroutine
+    return time_coroutine(stage, coroutine)
+
+def profile_call(stage, function, *args, **kwargs):
+    # Wall and CPU time of a function running in a worker thread.
+    if ACTIVE_PROFILER is None:
+        return function(*args, **kwargs)
+    start_time = time.perf_counter()
+    start_cpu_time = time.thread_time()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        ACTIVE_PROFILER.record(stage, time.perf_counter() - start_time, time.thread_time() - start_cpu_time)
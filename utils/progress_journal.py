@@ -0,0 +1,51 @@
+import os
+
+NL_DESC_KEY_BYTES = b"\"nl_desc\":"
+
+def has_nl_desc(metadata_path):
+    # Raw byte search so finished images can be detected without parsing the JSON.
+    with open(metadata_path, "rb") as metadata_file:
+        return NL_DESC_KEY_BYTES in metadata_file.read()
+
+class ProgressJournal:
+
+    def __init__(self, journal_path, resume=False):
+        self.journal_path = journal_path
+        self.done_image_ids: set[str] = set()
+        self.failed_image_ids: set[str] = set()
+        if resume and os.path.isfile(journal_path):
+            with open(journal_path, "r", encoding="utf8") as journal_file:
+                for line in journal_file:
+                    line = line.split()
+                    if len(line) != 2: # Can be a partially written last line after a crash.
+                        continue
+                    status, image_id = line
+                    match status:
+                        case "done":
+                            self.done_image_ids.add(image_id)
+                            self.failed_image_ids.discard(image_id)
+                        case "failed":
+                            if image_id not in self.done_image_ids:
+                                self.failed_image_ids.add(image_id)
+        self.journal_file = open(journal_path, "a" if resume else "w", encoding="utf8", buffering=1)
+
+    def is_done(self, image_id):
+        return image_id in self.done_image_ids
+
+    def mark_done(self, image_id):
+        self.done_image_ids.add(image_id)
+        self.failed_image_ids.discard(image_id)
+        self.journal_file.write(f"done {image_id}\n")
+
+    def mark_failed(self, image_id):
+        self.failed_image_ids.add(image_id)
+        self.journal_file.write(f"failed {image_id}\n")
+
+    def close(self):
+        self.journal_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
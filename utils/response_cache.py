@@ -0,0 +1,83 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+def get_cache_key(*parts):
+    hasher = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf8")
+        hasher.update(len(part).to_bytes(8, "little")) # Length prefixed so the parts can't run into each other.
+        hasher.update(part)
+    return hasher.hexdigest()
+
+class ResponseCache:
+
+    def __init__(self, cache_path, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, response):
+        size = len(key) + len(response.encode("utf8"))
+        with self.lock:
+            row = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)", (key, response, size, time.time()))
+            self.total_bytes += size - (row[0] if row is not None else 0)
+            if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+                self.evict(self.max_bytes * 9 // 10)
+
+    def evict(self, target_bytes):
+        # Least recently used first, down to a bit under the cap so it doesn't evict on every put.
+        self.connection.execute("BEGIN")
+        try:
+            while self.total_bytes > target_bytes:
+                rows = self.connection.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 1000").fetchall()
+                if not rows:
+                    break
+                for key, size in rows:
+                    if self.total_bytes <= target_bytes:
+                        break
+                    self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.total_bytes -= size
+                    self.evictions += 1
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            raise
+
+    def get_stats_text(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups > 0 else 0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {self.evictions} evictions, {self.total_bytes / 1024 / 1024:.1f}MiB cached"
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
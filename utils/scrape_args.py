@@ -11,3 +11,5 @@ class ScrapeArgs:
     min_tags: int = 0
     max_scrape_count: Optional[int] = None
     tag_type_dict: Optional[dict[str, str]] = None
+    bucket_area: Optional[int] = None
+    bucket_mode: str = "crop"
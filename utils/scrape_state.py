@@ -1,7 +1,13 @@
+import os
 from typing import Optional
 from aiohttp import ClientSession
 from dataclasses import dataclass, field
 from concurrent.futures import ThreadPoolExecutor
+from .metrics import ScrapeMetrics
+from .tag_quota import TagQuota
+from .post_stages import PostStages
+from .metadata_writer import MetadataWriter
+from .json_codec import Metadata, loads_json
 
 @dataclass
 class ScrapeState:
@@ -11,5 +17,23 @@ class ScrapeState:
     scraped_image_count: int = 0
     last_reached_image_id: Optional[str] = None
     last_reached_image_score: Optional[int] = None
-    avg_query_time: list[float, int] = field(default_factory=lambda: [0.0, 0])
-    avg_download_time: list[float, int] = field(default_factory=lambda: [0.0, 0])
+    metrics: ScrapeMetrics = field(default_factory=ScrapeMetrics)
+    metadata_writer: Optional[MetadataWriter] = None
+    image_dir: str = "images"
+    tag_quota: Optional[TagQuota] = None
+    post_stages: Optional[PostStages] = None
+    metadata_failure_count: int = 0 # Failed metadata writes already taken back.
+
+    def take_back_metadata_failures(self, failures):
+        # The images the metadata writer removed after they were counted as scraped, failures from get_failures(self.metadata_failure_count).
+        self.metadata_failure_count += len(failures)
+        for _, metadata_path, metadata in failures:
+            self.scraped_image_count -= 1
+            self.existing_image_ids.discard(os.path.splitext(os.path.basename(metadata_path))[0]) # So it can be scraped again.
+            if self.tag_quota is not None:
+                self.tag_quota.release(self.tag_quota.get_tag_ids(Metadata.from_dict(loads_json(metadata))))
+        self.metrics.count_metadata_errors(len(failures))
+        return len(failures)
+
+    def update_metadata_failures(self):
+        return self.take_back_metadata_failures(self.metadata_writer.get_failures(self.metadata_failure_count)) if self.metadata_writer is not None else 0
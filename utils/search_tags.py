@@ -79,6 +79,9 @@ class SearchTags:
         self.sort_tag: SortTag = None
         self.compare_filter_tags: list[CompareFilterTag] = []
         self.sort_associated_compare_filter_tag: Optional[CompareFilterTag] = None
+        # Set while walking the rest of the posts that share the score the keyset cursor stopped at.
+        self.tie_group_score: Optional[int] = None
+        self.tie_group_compare_filter_tag: Optional[CompareFilterTag] = None
         for tag in tags:
             tag = tag.strip().lower()
             if not tag:
@@ -107,23 +110,38 @@ class SearchTags:
                 del self.compare_filter_tags[i]
 
     def update_bound(self, scrape_state):
+        # Keyset cursor on (score, ID), the bounds are exclusive so restarting from page 0 never walks already seen posts again.
+        if scrape_state.last_reached_image_id is None:
+            raise ValueError("Last reached image ID isn't set!")
         match self.sort_tag.sort_type:
             case "id":
-                if scrape_state.last_reached_image_id is None:
-                    raise ValueError("Last reached image ID isn't set!")
-                self.sort_associated_compare_filter_tag = CompareFilterTag("id", self.sort_tag.descending, True, scrape_state.last_reached_image_id)
+                self.sort_associated_compare_filter_tag = CompareFilterTag("id", self.sort_tag.descending, False, scrape_state.last_reached_image_id)
             case "score":
                 if scrape_state.last_reached_image_score is None:
                     raise ValueError("Last reached image score isn't set!")
-                self.sort_associated_compare_filter_tag = CompareFilterTag("score", self.sort_tag.descending, True, str(scrape_state.last_reached_image_score))
+                # Posts with the same score are ordered by ID, so the ones after the cursor are walked by ID first, then finish_tie_group moves past that score.
+                self.tie_group_score = scrape_state.last_reached_image_score
+                self.tie_group_compare_filter_tag = CompareFilterTag("id", self.sort_tag.descending, False, scrape_state.last_reached_image_id)
             case _:
                 raise NotImplementedError(f"Bound update for sort type \"{self.sort_tag.sort_type}\" is not implemented!")
 
+    def finish_tie_group(self):
+        # Returns False if there's no tie group being walked, which means the search is exhausted.
+        if self.tie_group_score is None:
+            return False
+        self.sort_associated_compare_filter_tag = CompareFilterTag("score", self.sort_tag.descending, False, str(self.tie_group_score))
+        self.tie_group_score = None
+        self.tie_group_compare_filter_tag = None
+        return True
+
     def to_search_string(self):
-        tag_texts = [str(self.sort_tag)]
+        if self.tie_group_score is None:
+            tag_texts = [str(self.sort_tag)]
+        else:
+            tag_texts = [str(SortTag("id", self.sort_tag.descending)), f"score:{self.tie_group_score}", str(self.tie_group_compare_filter_tag)]
         for compare_filter_tag in self.compare_filter_tags:
             tag_texts.append(str(compare_filter_tag))
-        if self.sort_associated_compare_filter_tag is not None:
+        if self.sort_associated_compare_filter_tag is not None and self.tie_group_score is None:
             tag_texts.append(str(self.sort_associated_compare_filter_tag))
         tag_texts += self.general_tags
         return "+".join(urllib.parse.quote(tag_text, safe="") for tag_text in tag_texts)
@@ -0,0 +1,41 @@
+import os
+from .json_codec import dumps_json, load_json_file
+from .utils import get_image_id_image_metadata_path_tuple_dict
+
+ID_INDEX_FILENAME = "id_index.json"
+
+def get_shard_dirs(image_dir):
+    # Every worker of a distributed crawl writes to its own subdirectory of the image directory.
+    if not os.path.isdir(image_dir):
+        return []
+    return sorted(entry.path for entry in os.scandir(image_dir) if entry.is_dir())
+
+def get_shard_existing_image_id_set(image_dir):
+    existing_image_ids = set()
+    for shard_dir in get_shard_dirs(image_dir):
+        existing_image_ids.update(get_image_id_image_metadata_path_tuple_dict(shard_dir))
+    return existing_image_ids
+
+def make_id_index(image_dir):
+    # Key: Image ID, Value: Name of the worker subdirectory it's in, or "" if it's directly in the image directory.
+    # An image in several places is indexed where it's found first, directly in the image directory then the subdirectories in name order.
+    # Returns the index and a list of (Image ID, Image path, Metadata path) of the duplicates.
+    id_index = {}
+    duplicates = []
+    for shard_dir in [image_dir] + get_shard_dirs(image_dir):
+        shard_name = os.path.relpath(shard_dir, image_dir) if shard_dir != image_dir else ""
+        for image_id, (image_path, metadata_path) in get_image_id_image_metadata_path_tuple_dict(shard_dir).items():
+            if image_id in id_index:
+                duplicates.append((image_id, image_path, metadata_path))
+                continue
+            id_index[image_id] = shard_name
+    return dict(sorted(id_index.items(), key=lambda x: (len(x[0]), x[0]))), duplicates
+
+def write_id_index(image_dir, id_index):
+    index_path = os.path.join(image_dir, ID_INDEX_FILENAME)
+    with open(index_path + ".tmp", "w", encoding="utf8") as index_file:
+        index_file.write(dumps_json(id_index))
+    os.replace(index_path + ".tmp", index_path)
+
+def load_id_index(image_dir):
+    return load_json_file(os.path.join(image_dir, ID_INDEX_FILENAME))
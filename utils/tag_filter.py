@@ -0,0 +1,54 @@
+import functools
+from .json_codec import Metadata, load_metadata
+
+def get_metadata_struct(metadata_or_path):
+    if isinstance(metadata_or_path, Metadata):
+        return metadata_or_path
+    if isinstance(metadata_or_path, dict):
+        return Metadata.from_dict(metadata_or_path)
+    return load_metadata(metadata_or_path)
+
+class TagFilter:
+    # Built once from the include or exclude tag groups so getting the tags of each image doesn't copy the metadata.
+
+    def __init__(self, exclude=None, include=None, no_rating_prefix=False):
+        if exclude is not None and include is not None:
+            raise ValueError("You can't set both exclude and include, please only set one.")
+        self.exclude = frozenset([exclude] if isinstance(exclude, str) else exclude) if exclude is not None else None
+        self.include = frozenset([include] if isinstance(include, str) else include) if include is not None else None
+        self.rating_prefix = "" if no_rating_prefix else "rating:"
+        self.include_rating = self.accepts("rating")
+
+    def accepts(self, tag_type):
+        if self.exclude is not None:
+            return tag_type not in self.exclude
+        if self.include is not None:
+            return tag_type in self.include
+        return True
+
+    def get_tags(self, metadata_or_path):
+        metadata = get_metadata_struct(metadata_or_path)
+        tags = []
+        for tag_type, type_tags in metadata.tags.items():
+            if self.accepts(tag_type):
+                tags += type_tags
+        if self.include_rating:
+            tags.append(self.rating_prefix + metadata.rating)
+        return tags
+
+    def get_type_tags_dict(self, metadata_or_path):
+        # Same filtering as get_tags but keeps the tags grouped by type, with the rating under "rating".
+        metadata = get_metadata_struct(metadata_or_path)
+        type_tags_dict = {tag_type: type_tags for tag_type, type_tags in metadata.tags.items() if self.accepts(tag_type)}
+        if self.include_rating:
+            type_tags_dict["rating"] = [self.rating_prefix + metadata.rating]
+        return type_tags_dict
+
+@functools.lru_cache(maxsize=64)
+def get_tag_filter(exclude=None, include=None, no_rating_prefix=False):
+    return TagFilter(exclude, include, no_rating_prefix)
+
+def get_tags(metadata_or_path, exclude=None, include=None, no_rating_prefix=False):
+    # Kept for one off calls, loops should build a TagFilter once and reuse it.
+    to_key = lambda groups: (groups,) if isinstance(groups, str) else tuple(groups) if groups is not None else None
+    return get_tag_filter(to_key(exclude), to_key(include), no_rating_prefix).get_tags(metadata_or_path)
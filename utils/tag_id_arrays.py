@@ -0,0 +1,62 @@
+import os
+from .json_codec import dumps_json, load_json_file
+
+# Per image tag IDs in CSR form, row i holds the sorted tag IDs of image_ids[i] in indices[indptr[i]:indptr[i + 1]].
+TAG_ID_ARRAY_NAMES = ("image_ids", "mtimes", "indptr", "indices")
+
+class TagIdArrays:
+
+    def __init__(self, image_ids, mtimes, indptr, indices):
+        self.image_ids = image_ids
+        self.mtimes = mtimes # Metadata file mtimes in nanoseconds, to tell which rows are stale.
+        self.indptr = indptr
+        self.indices = indices
+        self.image_id_row_dict = None
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def get_row(self, image_id):
+        if self.image_id_row_dict is None:
+            self.image_id_row_dict = {str(image_id): row for row, image_id in enumerate(self.image_ids.tolist())}
+        return self.image_id_row_dict.get(str(image_id))
+
+    def get_row_tag_ids(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def get_tag_ids(self, image_id):
+        row = self.get_row(image_id)
+        if row is None:
+            return None
+        return self.get_row_tag_ids(row)
+
+def load_tag_id_arrays(tag_ids_dir, vocabulary=None, mmap=True):
+    # Returns None when there are no arrays, or they were made with another vocabulary or are inconsistent.
+    import numpy as np
+    state_path = os.path.join(tag_ids_dir, "state.json")
+    if not os.path.isfile(state_path):
+        return None
+    state = load_json_file(state_path)
+    if vocabulary is not None and state.get("vocabulary") != vocabulary.get_fingerprint():
+        return None
+    try:
+        arrays = [np.load(os.path.join(tag_ids_dir, name + ".npy"), mmap_mode="r" if mmap else None) for name in TAG_ID_ARRAY_NAMES]
+    except (OSError, ValueError):
+        return None
+    image_ids, mtimes, indptr, indices = arrays
+    if not len(image_ids) == len(mtimes) == len(indptr) - 1 == state.get("image_count") or indptr[-1] != len(indices):
+        return None
+    return TagIdArrays(*arrays)
+
+def save_tag_id_arrays(tag_ids_dir, tag_id_arrays, vocabulary):
+    import numpy as np
+    os.makedirs(tag_ids_dir, exist_ok=True)
+    state_path = os.path.join(tag_ids_dir, "state.json")
+    if os.path.isfile(state_path):
+        os.remove(state_path) # So a crash halfway through leaves arrays that won't be loaded.
+    for name in TAG_ID_ARRAY_NAMES:
+        temp_path = os.path.join(tag_ids_dir, name + ".tmp.npy")
+        np.save(temp_path, getattr(tag_id_arrays, name))
+        os.replace(temp_path, os.path.join(tag_ids_dir, name + ".npy"))
+    with open(state_path, "w", encoding="utf8") as state_file:
+        state_file.write(dumps_json({"vocabulary": vocabulary.get_fingerprint(), "image_count": len(tag_id_arrays)}))
@@ -0,0 +1,155 @@
+import os
+from .json_codec import dumps_json, load_json_file
+
+# Inverted tag index of the local dataset, rows are sorted by image ID and hold the columns image_ids, mtimes, scores and ratings.
+# Row r has the tag IDs indices[indptr[r]:indptr[r + 1]], and tag t (named tags[t]) is on the ascending rows postings[posting_indptr[t]:posting_indptr[t + 1]].
+TAG_INDEX_ARRAY_NAMES = ("image_ids", "mtimes", "scores", "ratings", "indptr", "indices", "posting_indptr", "postings")
+TAG_INDEX_RATINGS = ("general", "sensitive", "questionable", "explicit")
+
+def contains_sorted(sorted_values, values):
+    # Mask of which values are in sorted_values, binary searching so a short list against a long one stays cheap.
+    import numpy as np
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_values, values)
+    return sorted_values[np.minimum(positions, len(sorted_values) - 1)] == values
+
+def compare_column(column, less_than, with_equal, target):
+    if less_than:
+        return column <= target if with_equal else column < target
+    return column >= target if with_equal else column > target
+
+class TagIndex:
+
+    def __init__(self, image_ids, mtimes, scores, ratings, indptr, indices, posting_indptr, postings, tags):
+        self.image_ids = image_ids
+        self.mtimes = mtimes # Metadata file mtimes in nanoseconds, to tell which rows are stale.
+        self.scores = scores
+        self.ratings = ratings # Index into TAG_INDEX_RATINGS, -1 for unknown ratings.
+        self.indptr = indptr
+        self.indices = indices
+        self.posting_indptr = posting_indptr
+        self.postings = postings
+        self.tags = tags
+        self.tag_id_dict = {tag: tag_id for tag_id, tag in enumerate(tags)}
+        self.image_id_row_dict = None
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def get_row(self, image_id):
+        if self.image_id_row_dict is None:
+            self.image_id_row_dict = {str(image_id): row for row, image_id in enumerate(self.image_ids.tolist())}
+        return self.image_id_row_dict.get(str(image_id))
+
+    def get_row_tag_ids(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def get_tag_rows(self, tag):
+        import numpy as np
+        tag_id = self.tag_id_dict.get(tag)
+        if tag_id is None:
+            return np.empty(0, dtype=np.int64)
+        return self.postings[self.posting_indptr[tag_id]:self.posting_indptr[tag_id + 1]]
+
+    def filter_rows(self, rows, tag):
+        # Applies one metatag or tag of a search to the candidate rows, "-" excludes.
+        negated = tag.startswith("-")
+        if negated:
+            tag = tag[1:]
+        if tag.startswith("rating:"):
+            rating = tag[7:]
+            mask = self.ratings[rows] == (TAG_INDEX_RATINGS.index(rating) if rating in TAG_INDEX_RATINGS else -2)
+        elif tag.startswith(("id:", "score:")) and tag.split(":", 1)[1].lstrip("-").isdecimal():
+            compare_type, target = tag.split(":", 1)
+            mask = (self.image_ids if compare_type == "id" else self.scores)[rows] == int(target)
+        else:
+            mask = contains_sorted(self.get_tag_rows(tag), rows)
+        return rows[~mask if negated else mask]
+
+    def query(self, search_tags, limit=None):
+        # Evaluates a SearchTags, returns the matching image IDs in its sort order.
+        import numpy as np
+        plain_tags = []
+        or_tags = []
+        other_tags = []
+        for tag in search_tags.general_tags:
+            if tag.startswith("~"):
+                or_tags.append(tag[1:])
+            elif tag.startswith("-") or ":" in tag and tag.split(":", 1)[0] in ("rating", "id", "score"):
+                other_tags.append(tag)
+            else:
+                plain_tags.append(tag)
+        # Starts from the shortest posting list so every later step only narrows a small candidate set.
+        posting_lists = sorted((self.get_tag_rows(tag) for tag in plain_tags), key=len)
+        if or_tags:
+            posting_lists.insert(0, np.unique(np.concatenate([self.get_tag_rows(tag) for tag in or_tags])))
+        rows = posting_lists[0] if posting_lists else np.arange(len(self), dtype=np.int64)
+        for posting_list in posting_lists[1:]:
+            if len(rows) == 0:
+                break
+            rows = rows[contains_sorted(posting_list, rows)]
+        for tag in other_tags:
+            rows = self.filter_rows(rows, tag)
+        compare_filter_tags = list(search_tags.compare_filter_tags)
+        if search_tags.sort_associated_compare_filter_tag is not None:
+            compare_filter_tags.append(search_tags.sort_associated_compare_filter_tag)
+        for compare_filter_tag in compare_filter_tags:
+            match compare_filter_tag.compare_type:
+                case "id":
+                    column = self.image_ids
+                case "score":
+                    column = self.scores
+                case _:
+                    raise NotImplementedError(f"Compare filter type \"{compare_filter_tag.compare_type}\" is not implemented!")
+            rows = rows[compare_column(column[rows], compare_filter_tag.less_than, compare_filter_tag.with_equal, int(compare_filter_tag.target))]
+        if search_tags.sort_tag.sort_type == "score":
+            rows = rows[np.lexsort((rows, self.scores[rows]))] # Ties ordered by ID like the boorus do, rows are in ID order.
+        if search_tags.sort_tag.descending:
+            rows = rows[::-1]
+        if limit is not None:
+            rows = rows[:limit]
+        return self.image_ids[rows]
+
+def make_postings(indptr, indices, tag_count):
+    # Transposes the per row tag IDs into per tag rows, a stable sort keeps the rows of each tag ascending.
+    import numpy as np
+    entry_rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+    postings = entry_rows[np.argsort(indices, kind="stable")]
+    posting_indptr = np.zeros(tag_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=tag_count), out=posting_indptr[1:])
+    return posting_indptr, postings
+
+def load_tag_index(tag_index_dir, mmap=True):
+    # Returns None when there's no index, or it's inconsistent.
+    import numpy as np
+    state_path = os.path.join(tag_index_dir, "state.json")
+    if not os.path.isfile(state_path):
+        return None
+    state = load_json_file(state_path)
+    try:
+        arrays = [np.load(os.path.join(tag_index_dir, name + ".npy"), mmap_mode="r" if mmap else None) for name in TAG_INDEX_ARRAY_NAMES]
+        tags = load_json_file(os.path.join(tag_index_dir, "tags.json"))
+    except (OSError, ValueError):
+        return None
+    image_ids, mtimes, scores, ratings, indptr, indices, posting_indptr, postings = arrays
+    if not len(image_ids) == len(mtimes) == len(scores) == len(ratings) == len(indptr) - 1 == state.get("image_count") or indptr[-1] != len(indices):
+        return None
+    if not len(tags) == len(posting_indptr) - 1 == state.get("tag_count") or posting_indptr[-1] != len(postings):
+        return None
+    return TagIndex(*arrays, tags)
+
+def save_tag_index(tag_index_dir, tag_index):
+    import numpy as np
+    os.makedirs(tag_index_dir, exist_ok=True)
+    state_path = os.path.join(tag_index_dir, "state.json")
+    if os.path.isfile(state_path):
+        os.remove(state_path) # So a crash halfway through leaves an index that won't be loaded.
+    for name in TAG_INDEX_ARRAY_NAMES:
+        temp_path = os.path.join(tag_index_dir, name + ".tmp.npy")
+        np.save(temp_path, getattr(tag_index, name))
+        os.replace(temp_path, os.path.join(tag_index_dir, name + ".npy"))
+    with open(os.path.join(tag_index_dir, "tags.json"), "w", encoding="utf8") as tags_file:
+        tags_file.write(dumps_json(tag_index.tags))
+    with open(state_path, "w", encoding="utf8") as state_file:
+        state_file.write(dumps_json({"image_count": len(tag_index), "tag_count": len(tag_index.tags)}))
@@ -0,0 +1,66 @@
+from .tag_filter import TagFilter
+from .utils import get_image_id_image_metadata_path_tuple_dict
+
+def load_tag_targets(tag_targets_path):
+    # "tag target" lines, for tags which should get a different amount of images than the rest.
+    tag_target_dict = {}
+    with open(tag_targets_path, "r", encoding="utf8") as tag_targets_file:
+        for line_number, line in enumerate(tag_targets_file, 1):
+            line = line.split()
+            if not line:
+                continue
+            if len(line) != 2 or not line[1].isdecimal():
+                raise ValueError(f"Line {line_number} of \"{tag_targets_path}\" isn't a tag and a target count!")
+            tag_target_dict[line[0]] = int(line[1])
+    return tag_target_dict
+
+class TagQuota:
+    # Live fill of the per tag buckets of balance_tags.py, so the scrapers can skip posts before downloading their images.
+    # A post is kept while any of its model tags is under its target, like the round robin keeps every image of the rare tags and only a share of the common ones.
+
+    def __init__(self, vocabulary, target, tag_target_dict=None):
+        self.tag_id_dict = vocabulary.get_tag_id_dict()
+        self.targets = [target] * len(vocabulary) # Index: Tag ID.
+        for tag, tag_target in (tag_target_dict or {}).items():
+            tag_id = self.tag_id_dict.get(tag)
+            if tag_id is not None:
+                self.targets[tag_id] = tag_target
+        self.fills = [0] * len(vocabulary)
+        self.full_count = sum(tag_target <= 0 for tag_target in self.targets)
+        self.tag_filter = TagFilter() # Same tags as balance_tags.py buckets the images by.
+
+    def get_tag_ids(self, metadata_or_path):
+        return list({tag_id for tag_id in map(self.tag_id_dict.get, self.tag_filter.get_tags(metadata_or_path)) if tag_id is not None})
+
+    def add(self, tag_ids, count=1):
+        for tag_id in tag_ids:
+            was_full = self.fills[tag_id] >= self.targets[tag_id]
+            self.fills[tag_id] += count
+            self.full_count += (self.fills[tag_id] >= self.targets[tag_id]) - was_full
+
+    def reserve(self, metadata):
+        # Counts the post in its buckets and returns its tag IDs for release, or None if all its buckets are full and it should be skipped.
+        # Posts are counted before their download finishes so concurrent tasks don't overfill the buckets.
+        tag_ids = self.get_tag_ids(metadata)
+        if not any(self.fills[tag_id] < self.targets[tag_id] for tag_id in tag_ids):
+            return None
+        self.add(tag_ids)
+        return tag_ids
+
+    def release(self, tag_ids):
+        # For reserved posts which ended up not saved.
+        self.add(tag_ids, -1)
+
+    def count_existing(self, image_dirs):
+        image_count = 0
+        for image_dir in image_dirs:
+            for _, metadata_path in get_image_id_image_metadata_path_tuple_dict(image_dir).values():
+                self.add(self.get_tag_ids(metadata_path))
+                image_count += 1
+        return image_count
+
+    def is_all_full(self):
+        return self.full_count >= len(self.fills)
+
+    def get_stats_text(self):
+        return f"{self.full_count}/{len(self.fills)} tag buckets full"
@@ -0,0 +1,107 @@
+import os
+import mmap
+import struct
+import hashlib
+from array import array
+from .utils import get_model_tags
+
+# Binary form of model_tags.txt: a header, the string table offsets in tag ID order, the tag IDs sorted by tag
+# for binary search lookups, and the UTF-8 string table. Integers are 32 bit in native byte order.
+TAG_VOCABULARY_MAGIC = b"AISPTAG1"
+TAG_VOCABULARY_HEADER = struct.Struct("=8sII") # Magic, tag count, string table size.
+
+def get_tag_vocabulary_path(model_tags_path):
+    return os.path.splitext(model_tags_path)[0] + ".bin"
+
+def write_tag_vocabulary(tags, vocabulary_path):
+    encoded_tags = [tag.encode("utf8") for tag in tags]
+    offsets = array("I", [0])
+    for encoded_tag in encoded_tags:
+        offsets.append(offsets[-1] + len(encoded_tag))
+    sorted_ids = array("I", sorted(range(len(encoded_tags)), key=lambda i: encoded_tags[i]))
+    temp_path = vocabulary_path + ".tmp"
+    with open(temp_path, "wb") as vocabulary_file:
+        vocabulary_file.write(TAG_VOCABULARY_HEADER.pack(TAG_VOCABULARY_MAGIC, len(encoded_tags), offsets[-1]))
+        vocabulary_file.write(offsets.tobytes())
+        vocabulary_file.write(sorted_ids.tobytes())
+        vocabulary_file.write(b"".join(encoded_tags))
+    os.replace(temp_path, vocabulary_path)
+
+class TagVocabulary:
+
+    def __init__(self, vocabulary_path):
+        with open(vocabulary_path, "rb") as vocabulary_file:
+            self.mmap = mmap.mmap(vocabulary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.tag_count, string_table_size = TAG_VOCABULARY_HEADER.unpack_from(self.mmap)
+        if magic != TAG_VOCABULARY_MAGIC:
+            self.mmap.close()
+            raise ValueError(f"\"{vocabulary_path}\" is not a tag vocabulary file!")
+        offsets_start = TAG_VOCABULARY_HEADER.size
+        sorted_ids_start = offsets_start + (self.tag_count + 1) * 4
+        self.strings_start = sorted_ids_start + self.tag_count * 4
+        if len(self.mmap) != self.strings_start + string_table_size:
+            self.mmap.close()
+            raise ValueError(f"\"{vocabulary_path}\" is truncated or corrupted!")
+        self.view = memoryview(self.mmap)
+        self.offsets = self.view[offsets_start:sorted_ids_start].cast("I")
+        self.sorted_ids = self.view[sorted_ids_start:self.strings_start].cast("I")
+        self.tag_id_dict = None
+
+    def __len__(self):
+        return self.tag_count
+
+    def get_fingerprint(self):
+        # Files derived from this vocabulary store it to notice when the vocabulary changed.
+        return hashlib.sha256(self.mmap).hexdigest()
+
+    def get_tag_bytes(self, tag_id):
+        return self.mmap[self.strings_start + self.offsets[tag_id]:self.strings_start + self.offsets[tag_id + 1]]
+
+    def get_tag(self, tag_id):
+        return self.get_tag_bytes(tag_id).decode("utf8")
+
+    def get_tags(self):
+        string_table = self.mmap[self.strings_start:].decode("utf8") if self.tag_count > 0 else ""
+        if string_table.isascii(): # Offsets are in bytes, which only match string indexes when everything is ASCII.
+            return [string_table[self.offsets[i]:self.offsets[i + 1]] for i in range(self.tag_count)]
+        return [self.get_tag(i) for i in range(self.tag_count)]
+
+    def get_id(self, tag):
+        # Binary search on the mmap, for one off lookups without building the whole dict.
+        tag = tag.encode("utf8")
+        low, high = 0, self.tag_count
+        while low < high:
+            middle = (low + high) // 2
+            middle_tag = self.get_tag_bytes(self.sorted_ids[middle])
+            if middle_tag < tag:
+                low = middle + 1
+            elif middle_tag > tag:
+                high = middle
+            else:
+                return self.sorted_ids[middle]
+        return None
+
+    def get_tag_id_dict(self):
+        # For hot loops which look up every tag of every image, built once on first use.
+        if self.tag_id_dict is None:
+            self.tag_id_dict = {tag: i for i, tag in enumerate(self.get_tags())}
+        return self.tag_id_dict
+
+    def close(self):
+        self.offsets.release()
+        self.sorted_ids.release()
+        self.view.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def load_tag_vocabulary(model_tags_path):
+    # (Re)generates the binary vocabulary when it's missing or older than the text model tags.
+    vocabulary_path = get_tag_vocabulary_path(model_tags_path)
+    if not os.path.isfile(vocabulary_path) or os.path.isfile(model_tags_path) and os.path.getmtime(vocabulary_path) < os.path.getmtime(model_tags_path):
+        write_tag_vocabulary(get_model_tags(model_tags_path), vocabulary_path)
+    return TagVocabulary(vocabulary_path)
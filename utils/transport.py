@@ -0,0 +1,115 @@
+import importlib.util
+from .json_codec import loads_json
+
+# "aiohttp" opens a HTTP/1.1 connection per concurrent request, "http2" multiplexes the requests to each host over a few HTTP/2 connections with httpx.
+TRANSPORTS = ("aiohttp", "http2")
+
+def get_available_transports():
+    return [name for name in TRANSPORTS if name == "aiohttp" or importlib.util.find_spec("httpx") is not None and importlib.util.find_spec("h2") is not None]
+
+_TRANSPORT = "aiohttp"
+
+def get_transport():
+    return _TRANSPORT
+
+def set_transport(name):
+    global _TRANSPORT
+    if name not in get_available_transports():
+        raise ValueError(f"Transport \"{name}\" is not available, available transports: {', '.join(get_available_transports())}")
+    _TRANSPORT = name
+
+class HTTPXResponseContent:
+
+    def __init__(self, response):
+        self.response = response
+
+    async def iter_chunked(self, chunk_size):
+        async for chunk in self.response.aiter_bytes(chunk_size):
+            yield chunk
+
+    async def iter_any(self):
+        async for chunk in self.response.aiter_bytes():
+            yield chunk
+
+class HTTPXResponse:
+    # The part of aiohttp's ClientResponse the tools use, over a streamed httpx response.
+
+    def __init__(self, response):
+        self.response = response
+        self.status = response.status_code
+        self.headers = response.headers
+        self.url = response.url
+        self.content = HTTPXResponseContent(response)
+
+    @property
+    def content_length(self):
+        content_length = self.headers.get("Content-Length")
+        return int(content_length) if content_length is not None and content_length.isdecimal() else None
+
+    async def read(self):
+        return await self.response.aread()
+
+    async def text(self):
+        await self.response.aread()
+        return self.response.text
+
+    async def json(self):
+        return loads_json(await self.response.aread())
+
+# Times a GET is resent when its connection goes away before it gets a response, servers like nginx close HTTP/2 connections gracefully after 1000 requests
+# and httpcore fails the streams still queued on them instead of moving them to a new connection.
+MAX_GOAWAY_RETRY = 3
+
+class HTTPXRequestContext:
+
+    def __init__(self, client, method, url, headers=None, data=None, json=None):
+        if data is not None and not isinstance(data, (bytes, bytearray, str)):
+            raise NotImplementedError("The HTTP/2 transport only sends bytes or JSON bodies!")
+        self.request = client.build_request(method, url, headers=headers, content=data, json=json)
+        self.client = client
+        self.response = None
+
+    async def __aenter__(self):
+        import httpx
+        for i in range(1, MAX_GOAWAY_RETRY + 2): # 1 indexed.
+            try:
+                self.response = await self.client.send(self.request, stream=True)
+                break
+            except httpx.RemoteProtocolError as e:
+                if self.request.method != "GET" or "ConnectionTerminated" not in str(e) or i > MAX_GOAWAY_RETRY:
+                    raise
+        return HTTPXResponse(self.response)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.response.aclose()
+
+class HTTPXSession:
+    # Same interface as the aiohttp ClientSession get_session returns, so the tools don't care which transport they run on.
+
+    def __init__(self, timeout=None, cookies=None):
+        import httpx # Imported here as only the HTTP/2 transport needs it.
+        # HTTP/2 is negotiated with ALPN over TLS, plain HTTP like local stand-in servers speaks it with prior knowledge.
+        # Redirects are followed like aiohttp does, httpx doesn't by default.
+        self.client = httpx.AsyncClient(
+            http2=True, follow_redirects=True, cookies=cookies, timeout=httpx.Timeout(timeout or None), limits=httpx.Limits(max_connections=None, max_keepalive_connections=None),
+            mounts={"http://": httpx.AsyncHTTPTransport(http1=False, http2=True, limits=httpx.Limits(max_connections=None, max_keepalive_connections=None))},
+        )
+
+    def get(self, url, headers=None):
+        return HTTPXRequestContext(self.client, "GET", url, headers)
+
+    def post(self, url, headers=None, data=None, json=None):
+        return HTTPXRequestContext(self.client, "POST", url, headers, data, json)
+
+    @property
+    def closed(self):
+        return self.client.is_closed
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -1,28 +1,96 @@
 import os
 import io
-import copy
-import json
-import asyncio
-import aiohttp
-from PIL import Image
+import time
+from .profiler import profile_call
+from .transport import HTTPXSession, get_transport
+from .json_codec import dumps_metadata
 
-def validate_image(image_data, metadata, image_path, metadata_path, width=None, height=None, convert_to_avif=False):
-    try:
-        with io.BytesIO(image_data) as image_filelike:
-            with Image.open(image_filelike) as img:
-                save_kwargs = {}
-                if isinstance(width, int) and width > 0 and isinstance(height, int) and height > 0:
+IMAGE_FORMAT_EXT = {"avif": ".avif", "webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+
+def get_image_format_path(image_path, image_format=None):
+    if image_format is None:
+        return image_path
+    return os.path.splitext(image_path)[0] + IMAGE_FORMAT_EXT[image_format]
+
+def get_save_kwargs(image_format=None, quality=None, speed=None):
+    save_kwargs = {}
+    match image_format:
+        case "avif":
+            try:
+                import pillow_avif
+            except ImportError:
+                pass # Pillow 11.3 and later supports AVIF by itself.
+            save_kwargs["quality"] = quality if quality is not None else 50
+            if speed is not None:
+                save_kwargs["speed"] = speed
+        case "webp":
+            save_kwargs["quality"] = quality if quality is not None else 90
+            if speed is not None:
+                save_kwargs["method"] = speed
+        case "jpeg":
+            save_kwargs["quality"] = quality if quality is not None else 90
+        case "png":
+            if speed is not None:
+                save_kwargs["compress_level"] = speed
+    return save_kwargs
+
+def transform_image(image_data, image_path, width=None, height=None, image_format=None, quality=None, speed=None, fast_downscale=False, metrics=None, bucket_area=None, bucket_mode="crop"):
+    # Decodes the image, resizes or buckets and converts it if asked, returns the path it was saved to and its bucket.
+    from PIL import Image
+    from .buckets import get_buckets, get_nearest_bucket, resize_to_bucket
+    validate_start_time = time.perf_counter()
+    save_kwargs = get_save_kwargs(image_format, quality, speed)
+    image_path = get_image_format_path(image_path, image_format)
+    bucket = None
+    with io.BytesIO(image_data) as image_filelike:
+        with Image.open(image_filelike) as img:
+            if bucket_area is not None:
+                bucket = get_nearest_bucket(img.width, img.height, get_buckets(bucket_area))
+                img = resize_to_bucket(img, bucket, bucket_mode, fast_downscale)
+            elif isinstance(width, int) and width > 0 and isinstance(height, int) and height > 0:
+                if fast_downscale:
+                    img.draft(None, (width, height)) # Lets JPEGs decode at a smaller scale directly.
+                    img = img.resize((width, height), reducing_gap=3.0)
+                else:
                     img = img.resize((width, height))
-                if convert_to_avif:
-                    import pillow_avif
-                    save_kwargs["quality"] = 50
-                    image_path = os.path.splitext(image_path)[0] + ".avif"
-                img.load()
-                img.save(image_path, **save_kwargs)
-        with open(metadata_path, "w", encoding="utf8") as metadata_file:
-            metadata_file.write(metadata)
+            img.load()
+            if image_format == "jpeg" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            encode_start_time = time.perf_counter()
+            output_format = Image.registered_extensions().get(os.path.splitext(image_path)[1].lower())
+            if output_format is None:
+                raise ValueError(f"unknown file extension: {os.path.splitext(image_path)[1]}")
+            # Encoded in memory first so the encoder's CPU time isn't counted as writing to disk.
+            with io.BytesIO() as output_filelike:
+                img.save(output_filelike, output_format, **save_kwargs)
+                write_start_time = time.perf_counter()
+                with open(image_path, "wb") as image_file:
+                    image_file.write(output_filelike.getbuffer())
+    if metrics is not None:
+        metrics.observe("validate", encode_start_time - validate_start_time)
+        metrics.observe("encode", write_start_time - encode_start_time)
+        metrics.observe("write", time.perf_counter() - write_start_time)
+    return image_path, bucket
+
+def validate_image(image_data, metadata, image_path, metadata_path, width=None, height=None, convert_to_avif=False, metrics=None, metadata_writer=None, bucket_area=None, bucket_mode="crop", post_stages=None):
+    image_format = "avif" if convert_to_avif else None
+    try:
+        image_path, bucket = transform_image(image_data, image_path, width, height, image_format, fast_downscale=bucket_area is not None, metrics=metrics, bucket_area=bucket_area, bucket_mode=bucket_mode)
+        metadata_text = metadata
+        if not isinstance(metadata, str): # Serialized here so the bucket can be recorded and the event loop doesn't do it.
+            if bucket is not None:
+                metadata.extra["bucket"] = list(bucket)
+            metadata_text = dumps_metadata(metadata)
+        if metadata_writer is not None:
+            metadata_writer.submit(image_path, metadata_path, metadata_text)
+        else:
+            with open(metadata_path, "w", encoding="utf8") as metadata_file:
+                metadata_file.write(metadata_text)
+        if post_stages is not None:
+            post_stages.process(metadata, image_data, image_path, metadata_path)
         return True
     except Exception as e:
+        image_path = get_image_format_path(image_path, image_format)
         print(f"Error validating image {image_path}: {e}")
         try:
             os.remove(image_path)
@@ -39,8 +107,9 @@ def validate_image(image_data, metadata, image_path, metadata_path, width=None,
             print("Error deleting metadata file:", e)
     return False
 
-async def submit_validation(thread_pool, image_data, metadata, image_path, metadata_path, width=None, height=None, convert_to_avif=False):
-    return await asyncio.wrap_future(thread_pool.submit(validate_image, image_data, metadata, image_path, metadata_path, width, height, convert_to_avif))
+async def submit_validation(thread_pool, image_data, metadata, image_path, metadata_path, width=None, height=None, convert_to_avif=False, metrics=None, metadata_writer=None, bucket_area=None, bucket_mode="crop", post_stages=None):
+    import asyncio
+    return await asyncio.wrap_future(thread_pool.submit(profile_call, "validate_image", validate_image, image_data, metadata, image_path, metadata_path, width, height, convert_to_avif, metrics, metadata_writer, bucket_area, bucket_mode, post_stages))
 
 def get_image_id_image_metadata_path_tuple_dict(image_dir):
     if not os.path.isdir(image_dir):
@@ -48,7 +117,7 @@ def get_image_id_image_metadata_path_tuple_dict(image_dir):
     image_id_image_metadata_path_tuple_dict = {}
     for path in os.listdir(image_dir):
         image_id, ext = os.path.splitext(path)
-        if ext == ".json":
+        if ext in (".json", ".txt"): # The TXT tags of convert.py and the caption post stage share the image's name.
             continue
         path = os.path.join(image_dir, path)
         if not os.path.isfile(path):
@@ -62,7 +131,23 @@ def get_image_id_image_metadata_path_tuple_dict(image_dir):
 def get_existing_image_id_set(image_dir):
     return set(get_image_id_image_metadata_path_tuple_dict(image_dir))
 
+def load_id_list(id_list_path):
+    # One image ID per line, like query_tags.py writes.
+    with open(id_list_path, "r", encoding="utf8") as id_list_file:
+        return {line.strip() for line in id_list_file if line.strip()}
+
+def filter_image_id_dict(image_id_dict, id_list_path=None):
+    # Keeps only the images in the ID list, if there is one.
+    if id_list_path is None:
+        return image_id_dict
+    image_ids = load_id_list(id_list_path)
+    return {image_id: value for image_id, value in image_id_dict.items() if image_id in image_ids}
+
 def get_session(timeout=None, cookies=None):
+    # An aiohttp ClientSession, or a session with the same interface on the transport chosen with set_transport.
+    if get_transport() == "http2":
+        return HTTPXSession(timeout, cookies)
+    import aiohttp # Imported here as it's slow to import and only needed by the network tools.
     kwargs = {"connector": aiohttp.TCPConnector(limit=0, ttl_dns_cache=600), "cookies": cookies}
     if timeout is not None:
         kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
@@ -84,32 +169,3 @@ def get_model_tags(model_tags_path):
     if len(sorted_index_tag_tuple_list) != sorted_index_tag_tuple_list[-1][0] + 1:
         raise ValueError(f"The index specified in \"{model_tags_path}\" is not continuous!")
     return [tag for _, tag in sorted_index_tag_tuple_list]
-
-def get_metadata(metadata_path):
-    if not os.path.isfile(metadata_path):
-        raise FileNotFoundError(f"\"{metadata_path}\" is not a file!")
-    with open(metadata_path, "r", encoding="utf8") as metadata_file:
-        return json.load(metadata_file)
-
-def get_tags(metadata_path_or_dict, exclude=None, include=None, no_rating_prefix=False):
-    if exclude is not None and include is not None:
-        raise ValueError("You can't set both exclude and include, please only set one.")
-    metadata = get_metadata(metadata_path_or_dict) if not isinstance(metadata_path_or_dict, dict) else metadata_path_or_dict
-    type_tags_dict = copy.copy(metadata.get("tags", {}))
-    if exclude is not None:
-        for e in exclude:
-            type_tags_dict.pop(e, None)
-        include_rating = "rating" not in exclude
-    elif include is not None:
-        for k in list(type_tags_dict):
-            if k not in include:
-                type_tags_dict.pop(k)
-        include_rating = "rating" in include
-    else:
-        include_rating = True
-    tags = []
-    for l in type_tags_dict.values():
-        tags += l
-    if include_rating:
-        tags.append(("" if no_rating_prefix else "rating:") + metadata["rating"])
-    return tags
@@ -0,0 +1,160 @@
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from typing import Optional
+from dataclasses import dataclass
+from .sigint_handler import get_sigint_count
+from .shards import get_shard_existing_image_id_set
+
+@dataclass
+class WorkUnit:
+    unit_id: int
+    min_id: int
+    max_id: int
+    attempts: int
+    lease_token: str
+
+    def get_id_tags(self):
+        return [f"id:>={self.min_id}", f"id:<={self.max_id}"]
+
+class WorkQueue:
+    # Work units are ID ranges of one search, leased by workers that keep their lease alive with heartbeats.
+    # A unit is only marked done after everything scraped in it is written, so the unit of a crashed worker is leased again once its lease expires.
+    # Lease expiry uses the wall clock of each worker, so the clocks of the nodes must be much closer than the lease duration.
+
+    def __init__(self, queue_path):
+        self.lock = threading.Lock()
+        # The default rollback journal instead of WAL, since WAL doesn't work on network filesystems.
+        self.connection = sqlite3.connect(queue_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS queue_info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS units (unit_id INTEGER PRIMARY KEY, min_id INTEGER NOT NULL, max_id INTEGER NOT NULL, state TEXT NOT NULL DEFAULT 'pending', "
+            "worker_id TEXT, lease_token TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, scraped_count INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def create(self, scraper, tags, min_id, max_id, unit_size):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self.connection.execute("SELECT COUNT(*) FROM units").fetchone()[0] > 0:
+                    raise RuntimeError("The work queue already has work units!")
+                self.connection.executemany("INSERT INTO queue_info (key, value) VALUES (?, ?)", (("scraper", scraper), ("tags", " ".join(tags))))
+                self.connection.executemany(
+                    "INSERT INTO units (min_id, max_id) VALUES (?, ?)",
+                    ((unit_min_id, min(unit_min_id + unit_size - 1, max_id)) for unit_min_id in range(min_id, max_id + 1, unit_size)),
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def get_info(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM queue_info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def lease(self, worker_id, lease_duration) -> Optional[WorkUnit]:
+        # Newest IDs first, pending units or ones whose lease expired.
+        with self.lock:
+            now = time.time()
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT unit_id, min_id, max_id, attempts FROM units WHERE state = 'pending' OR state = 'leased' AND lease_expires < ? ORDER BY max_id DESC LIMIT 1", (now,),
+                ).fetchone()
+                if row is None:
+                    self.connection.execute("COMMIT")
+                    return None
+                unit = WorkUnit(row[0], row[1], row[2], row[3] + 1, uuid.uuid4().hex)
+                self.connection.execute(
+                    "UPDATE units SET state = 'leased', worker_id = ?, lease_token = ?, lease_expires = ?, attempts = ? WHERE unit_id = ?",
+                    (worker_id, unit.lease_token, now + lease_duration, unit.attempts, unit.unit_id),
+                )
+                self.connection.execute("COMMIT")
+                return unit
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def update_unit(self, sql, parameters):
+        # Returns False if the lease was taken over by another worker.
+        with self.lock:
+            return self.connection.execute(sql, parameters).rowcount == 1
+
+    def heartbeat(self, unit, lease_duration):
+        return self.update_unit("UPDATE units SET lease_expires = ? WHERE unit_id = ? AND lease_token = ? AND state = 'leased'", (time.time() + lease_duration, unit.unit_id, unit.lease_token))
+
+    def complete(self, unit, scraped_count):
+        return self.update_unit(
+            "UPDATE units SET state = 'done', lease_token = NULL, lease_expires = NULL, scraped_count = scraped_count + ? WHERE unit_id = ? AND lease_token = ?", (scraped_count, unit.unit_id, unit.lease_token),
+        )
+
+    def release(self, unit, scraped_count):
+        return self.update_unit(
+            "UPDATE units SET state = 'pending', worker_id = NULL, lease_token = NULL, lease_expires = NULL, scraped_count = scraped_count + ? WHERE unit_id = ? AND lease_token = ?",
+            (scraped_count, unit.unit_id, unit.lease_token),
+        )
+
+    def get_state_counts(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT state, COUNT(*) FROM units GROUP BY state").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+async def keep_lease(work_queue, unit, lease_duration):
+    while True:
+        await asyncio.sleep(lease_duration / 3)
+        try:
+            if not await asyncio.to_thread(work_queue.heartbeat, unit, lease_duration):
+                print(f"Lost the lease of work unit {unit.unit_id}, another worker will scrape it again.")
+                return
+        except Exception as e:
+            print(f"Error sending the heartbeat of work unit {unit.unit_id}: {e}")
+
+async def wait_for_tasks(tasks):
+    while tasks and get_sigint_count() <= 1:
+        await asyncio.sleep(0.1)
+        for i in range(len(tasks) - 1, -1, -1):
+            task = tasks[i]
+            if task.done():
+                await task
+                del tasks[i]
+
+async def run_worker(work_queue, worker_id, image_dir, scrape_unit, scrape_state, tasks, should_stop, lease_duration=300):
+    # scrape_unit(unit) walks the search of the unit, returning True if it reached the end and False if it stopped early.
+    while not should_stop():
+        unit = await asyncio.to_thread(work_queue.lease, worker_id, lease_duration)
+        if unit is None:
+            state_counts = await asyncio.to_thread(work_queue.get_state_counts)
+            if not state_counts.get("pending") and not state_counts.get("leased"):
+                print("All work units are done.")
+                return
+            print(f"No work unit available, {state_counts.get('leased', 0)} are leased by other workers, waiting in case their leases expire...")
+            await asyncio.sleep(min(lease_duration / 3, 60))
+            continue
+        print(f"Leased work unit {unit.unit_id} with IDs from {unit.min_id} to {unit.max_id}, attempt {unit.attempts}.")
+        if unit.attempts > 1: # The worker that had it before may have scraped part of it.
+            scrape_state.existing_image_ids.update(await asyncio.to_thread(get_shard_existing_image_id_set, image_dir))
+        start_scraped_count = scrape_state.scraped_image_count
+        heartbeat_task = asyncio.create_task(keep_lease(work_queue, unit, lease_duration))
+        try:
+            finished = await scrape_unit(unit)
+            await wait_for_tasks(tasks)
+            # The images whose metadata failed to write are removed, so they don't count towards the unit.
+            scrape_state.take_back_metadata_failures(await asyncio.to_thread(scrape_state.metadata_writer.flush, scrape_state.metadata_failure_count))
+        finally:
+            heartbeat_task.cancel()
+        scraped_count = scrape_state.scraped_image_count - start_scraped_count
+        if finished and get_sigint_count() < 1:
+            if await asyncio.to_thread(work_queue.complete, unit, scraped_count):
+                print(f"Finished work unit {unit.unit_id}, scraped {scraped_count} images.")
+            else:
+                print(f"Finished work unit {unit.unit_id} after its lease was taken over, leaving it to the other worker.")
+        else:
+            await asyncio.to_thread(work_queue.release, unit, scraped_count)
+            print(f"Released work unit {unit.unit_id} after scraping {scraped_count} images.")
+            return